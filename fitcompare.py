@@ -31,13 +31,22 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pathlib 
+import bisect
+import concurrent.futures
+import multiprocessing
+import io
+import contextlib
 from scipy.signal import savgol_filter
 import numpy as np
 import csv
 import json
+import hashlib
+import sqlite3
 
 # Import advanced HR analysis functions
 from fitcompare_advanced import *
+# Import the fast FIT scanner
+from fitcompare_scan import scan_fit, scan_json_array
 
 # #############################
 # INIT section
@@ -46,12 +55,36 @@ from fitcompare_advanced import *
 sns.set()
 
 # Define CONST
-SCRIPT_VER = "2.7.1"
-# TODO: 
-# - Clean the filtering method of HRV
+SCRIPT_VER = "2.32.0"
+# TODO: 
 # - Create a configuration line on the project.yaml to remove the gray dotted line on HR chart
 # 
 # CHANGELOG:
+# 2.32.0: HR lag of each device against the reference over sliding windows (FFT cross-correlation): median and worst lag, intervals over a threshold, graph of the lag over time
+# 2.31.0: Power analysis: rolling power, normalized power and mean-maximal power curve of each device, with the gaps against the reference
+# 2.30.0: DEM altitude from local .hgt tiles (memory-mapped, bilinear sampling at the positions): added to the altitude graph, with the altitude error of each device
+# 2.29.0: Add align: distance, files recorded at different times are projected on the route of the reference file and resampled on a common distance grid
+# 2.28.0: Distance splits (every N m of the reference distance): time, pace, HR, HR gap and D+/D- of each device in the logfile and a CSV
+# 2.27.0: Frequency-domain HRV analysis: LF, HF and LF/HF over sliding windows (batched Welch spectra of the resampled RR series), compared to the reference
+# 2.26.0: Read the R-R array of the Suunto JSON with a streaming scanner and the HRV CSV in bulk, one abnormal value filter for all the HRV sources
+# 2.25.0: Detect the pauses and recording gaps of each file (in the summary), smooth the altitude per segment and fill the gaps when the data is not aligned
+# 2.24.0: Rolling agreement (bias and MAE against the reference over a sliding window) graph, with the worst windows in the logfile
+# 2.23.0: Agreement statistics against the reference (bias, limits of agreement, MAE, RMSE, Lin's CCC) with block bootstrap confidence intervals, and Bland-Altman plots
+# 2.22.0: Time in HR zones of each device and zone confusion matrices against the reference, in the logfile and as a bar chart
+# 2.21.0: Robust regression (Theil-Sen) of the battery discharge rate over the full battery series, per session and per GNSS mode, with an optional battery graph
+# 2.20.0: Detect the heart rate artifacts (dropouts, spikes, steep slopes, flat lines), score the heart rate without them and shade them on the heart rate graph
+# 2.19.0: Fast scan of the FIT files (definition messages only) for --listfields and the summary, and automatic detection of the GPS data for the map
+# 2.18.0: Add the GNSS distance and speed of each device (haversine over the track, including 5hz points) against its reported distance and speed
+# 2.17.0: Decode the laps of the FIT files and add per-lap statistics of each device (HR gap and score, distance, D+/D-, power) in the logfile and a CSV
+# 2.16.0: Add a resampling alignment (align: resample) on a common time grid with interpolation, and align on exact timestamps in O(N)
+# 2.15.0: Index the summaries, tags and scores of each run in a SQLite database, and query device / GNSS mode statistics (--query)
+# 2.14.0: Incremental rendering: outputs are fingerprinted (fit files, configuration, version) and only the stale ones are rebuilt (--force to rebuild all)
+# 2.13.0: Add a scoring engine for any field against the reference file, with score curves configurable in the scoring section
+# 2.12.0: Add an agreement matrix of all the pairs of devices (mean gap, max gap, score). HR score computed in a single vectorized pass
+# 2.11.0: Add a columnar export (--export-format npz) of all the aligned data of a project in a single file
+# 2.10.0: Build a session index during decode, add per-session analysis of multisport files and process windows in parallel
+# 2.9.0: Add several named zoom windows per run (zooms), sliced from a single decode of the files
+# 2.8.0: Add GNSS accuracy analysis (cross-track error against the reference track, per device and per GNSS mode)
 # 2.7.1: Fix a bug if some altitude value are "None"
 # 2.7.0: Add support for 5hz GPS on Garmin FIT files, import HRV from Suunto JSON files and skip specific timestamps
 # 2.6.1: Add values in charts titles / Clean error if no HRV data / Remove "half last point" for SIGMA devices
@@ -80,6 +113,9 @@ MAPBOX_API_KEY = config['map']['mapbox_api_key']
 # This script is run in a container. Define the working directory (mounted dir)
 APP_PATH = "/project/"
 
+# Index database of all the comparisons (can be shared by several projects)
+INDEX_DATABASE = config.get('index', 'database', fallback=APP_PATH + 'fitcompare.db')
+
 # Output the running dialog with version number at the very beginning
 print("Running fitcompare v%s" % (SCRIPT_VER))
 
@@ -92,31 +128,77 @@ hrvSuunto_values = {}
 hrvDelta_values = {}
 project_conf_zoom = False
 project_conf_zoom_range = [0, 0]
+project_conf_windows = [{'name': None, 'range': None}]
+project_conf_session_analysis = False
+project_conf_lap_analysis = False
+project_conf_distance_splits = None
+project_conf_parallel = True
 project_conf_ignore = []
 values_to_compare = ['heart_rate', 'altitude', 'distance']
-project_conf_map = True
+project_conf_map = None # Automatic: enabled if a file has GPS data
 project_conf_map_style = 'satellite-streets-v12'
 project_conf_align = True
+project_conf_resample_rate = 1
+project_conf_resample_max_gap = 5
+project_conf_distance_step = 5
+project_conf_distance_max_gap = 50
+project_conf_distance_band = 200
+project_conf_pause_threshold = 10
 project_conf_remove_hrv_abnormal = False
 project_conf_remove_hrv_abnormal_threshold = 20
 custom_graphs_values = []
+scoring_conf = {'heart_rate': {'latency': 5, 'start': 59, 'zeroIsMissing': True}}
 charge = {}
 conf_has_custom_graphs = False
 project_conf_inc_smoothed_alt = False
+project_conf_dem_directory = None
+project_conf_gnss_accuracy = False
+project_conf_agreement_matrix = False
+project_conf_gnss_accuracy_graph = False
+project_conf_gnss_distance = False
+project_conf_gnss_distance_graph = False
+project_conf_index = True
+project_conf_hr_artifacts = False
+project_conf_hr_zones = None
+project_conf_power_analysis = False
+project_conf_power_windows = [3, 10, 30]
+project_conf_hr_lag = False
+project_conf_hr_lag_window = 120
+project_conf_hr_lag_step = 10
+project_conf_hr_lag_max = 30
+project_conf_hr_lag_threshold = 10
+project_conf_rolling_agreement = False
+project_conf_rolling_window = 60
+project_conf_rolling_worst = 3
+project_conf_agreement_stats = False
+project_conf_bootstrap_resamples = 1000
+project_conf_bootstrap_block = 60
+project_conf_battery_regression = False
+project_conf_battery_graph = False
+project_conf_hrv_spectrum = False
+project_conf_hrv_spectrum_window = 300
+project_conf_hrv_spectrum_step = 30
+hr_artifact_conf = {'window': 61, 'madThreshold': 4, 'minDeviation': 15, 'maxSlope': 15, 'flatline': 30}
 
 # #############################
 # ARGS section
 
 # Handle the arguments and basic help
 parser = argparse.ArgumentParser(description='Compare two or more FIT files')
-parser.add_argument('fitfilesarg', metavar='FITFILE', nargs='+', help='Fit Files to compare')
+parser.add_argument('fitfilesarg', metavar='FITFILE', nargs='*', help='Fit Files to compare')
 parser.add_argument('--reference-file', '-r', dest='reference_file', help='Set the reference FIT File')
 parser.add_argument('--prefix', '-p', dest='project_prefix', help='Set the project prefix for output files')
 parser.add_argument('--debug', '-d', action='store_true', help='Enable debug')
 parser.add_argument('--export', '-e', action='store_true', help='Export graphs values also as CSV')
+parser.add_argument('--export-format', dest='export_format', choices=['csv', 'npz'], default='csv', help='Format of the export: one CSV per graph, or one NPZ file of aligned columns per project')
 parser.add_argument('--config', '-c', dest='project_config', help='Use an alternative configuration YAML file')
 parser.add_argument('--listfields', '-l', action='store_true', help='List all fields for FITFILE')
+parser.add_argument('--force', '-f', action='store_true', help='Rebuild all the outputs, even the ones which are up to date')
+parser.add_argument('--query', '-q', nargs='+', choices=['device', 'hr_measurement', 'gnss_mode', 'distance_measurement', 'manufacturer', 'sport'], help='Query the index database: statistics grouped by these columns (no FIT file is read)')
+parser.add_argument('--query-field', dest='query_field', default='heart_rate', help='Scored field of the query statistics (default: heart_rate)')
 args = parser.parse_args()
+if ((args.query == None) and (len(args.fitfilesarg) == 0)):
+  parser.error("the following arguments are required: FITFILE")
 
 # List fields:
 config_list_fields = args.listfields
@@ -169,15 +251,64 @@ if (os.path.isfile(project_conf_file)):
   if ("align" in project_conf['project']):
     project_conf_align = project_conf['project']['align']
     if (args.debug): print("[debug] Read configuration file: 'align' value set to " + str(project_conf['project']['align']))
+  # Rate of the common time grid of the resampling alignment (Hz)
+  if ("resampleRate" in project_conf['project']):
+    project_conf_resample_rate = project_conf['project']['resampleRate']
+    if (args.debug): print("[debug] Read configuration file: 'resampleRate' value set to " + str(project_conf['project']['resampleRate']))
+  # Maximum gap between two points to interpolate (seconds)
+  if ("resampleMaxGap" in project_conf['project']):
+    project_conf_resample_max_gap = project_conf['project']['resampleMaxGap']
+    if (args.debug): print("[debug] Read configuration file: 'resampleMaxGap' value set to " + str(project_conf['project']['resampleMaxGap']))
+  # Step of the common distance grid of the distance alignment (m)
+  if ("distanceStep" in project_conf['project']):
+    project_conf_distance_step = project_conf['project']['distanceStep']
+    if (args.debug): print("[debug] Read configuration file: 'distanceStep' value set to " + str(project_conf['project']['distanceStep']))
+  # Maximum gap between two points to interpolate on the distance grid (m)
+  if ("distanceMaxGap" in project_conf['project']):
+    project_conf_distance_max_gap = project_conf['project']['distanceMaxGap']
+    if (args.debug): print("[debug] Read configuration file: 'distanceMaxGap' value set to " + str(project_conf['project']['distanceMaxGap']))
+  # Maximum gap between the projection of a point on the route and its expected distance (m)
+  if ("distanceBand" in project_conf['project']):
+    project_conf_distance_band = project_conf['project']['distanceBand']
+    if (args.debug): print("[debug] Read configuration file: 'distanceBand' value set to " + str(project_conf['project']['distanceBand']))
+  # A step between two points longer than this number of seconds is a pause or a recording gap
+  if ("pauseThreshold" in project_conf['project']):
+    project_conf_pause_threshold = project_conf['project']['pauseThreshold']
+    if (args.debug): print("[debug] Read configuration file: 'pauseThreshold' value set to " + str(project_conf['project']['pauseThreshold']))
   # Include smoothed alt on graph plot (True or False)
   if ("includeSmoothedAlt" in project_conf['project']):
     project_conf_inc_smoothed_alt = project_conf['project']['includeSmoothedAlt']
     if (args.debug): print("[debug] Read configuration file: 'includeSmoothedAlt' value set to " + str(project_conf['project']['includeSmoothedAlt']))
+  # Directory of the DEM tiles (.hgt) for the reference altitude
+  if ("demDirectory" in project_conf['project']):
+    project_conf_dem_directory = project_conf['project']['demDirectory']
+    if (args.debug): print("[debug] Read configuration file: 'demDirectory' value set to " + str(project_conf['project']['demDirectory']))
   # Zoom to a certain part of the project (list of begining and end relative time)
   if ("zoom" in project_conf['project']):
-    project_conf_zoom = True
-    project_conf_zoom_range = project_conf['project']['zoom']
-    if (args.debug): print("[debug] Read configuration file: 'zoom' value set to [%i, %i]" % (project_conf_zoom_range[0], project_conf_zoom_range[1]))
+    project_conf_windows = [{'name': None, 'range': project_conf['project']['zoom']}]
+    if (args.debug): print("[debug] Read configuration file: 'zoom' value set to [%i, %i]" % (project_conf['project']['zoom'][0], project_conf['project']['zoom'][1]))
+  # Several named zoom windows (list of name / range), all computed from a single decode of the files
+  if ("zooms" in project_conf['project']):
+    project_conf_windows = []
+    for zoom_window in project_conf['project']['zooms']:
+      project_conf_windows.append({'name': str(zoom_window['name']), 'range': zoom_window['range']})
+      if (args.debug): print("[debug] Read configuration file: 'zooms' window %s set to [%i, %i]" % (zoom_window['name'], zoom_window['range'][0], zoom_window['range'][1]))
+  # Analyze each session of multisport files separately (in addition to the complete activity or zoom windows)
+  if ("sessionAnalysis" in project_conf['project']):
+    project_conf_session_analysis = project_conf['project']['sessionAnalysis']
+    if (args.debug): print("[debug] Read configuration file: 'sessionAnalysis' value set to " + str(project_conf['project']['sessionAnalysis']))
+  # Compute the statistics of each lap of the reference file
+  if ("lapAnalysis" in project_conf['project']):
+    project_conf_lap_analysis = project_conf['project']['lapAnalysis']
+    if (args.debug): print("[debug] Read configuration file: 'lapAnalysis' value set to " + str(project_conf['project']['lapAnalysis']))
+  # Compute the statistics of each distance split (m) of the reference file
+  if ("distanceSplits" in project_conf['project']):
+    project_conf_distance_splits = project_conf['project']['distanceSplits']
+    if (args.debug): print("[debug] Read configuration file: 'distanceSplits' value set to " + str(project_conf['project']['distanceSplits']))
+  # Process the zoom windows and sessions in parallel
+  if ("parallel" in project_conf['project']):
+    project_conf_parallel = project_conf['project']['parallel']
+    if (args.debug): print("[debug] Read configuration file: 'parallel' value set to " + str(project_conf['project']['parallel']))
   # Ignore certains timestamps (relative, first datapoint is 0)
   if ("ignore" in project_conf['project']):
     project_conf_ignore = project_conf['project']['ignore']
@@ -190,6 +321,98 @@ if (os.path.isfile(project_conf_file)):
   if ("map" in project_conf['project']):
     project_conf_map = project_conf['project']['map']
     if (args.debug): print("[debug] Read configuration file: 'map' value set to " + str(project_conf['project']['map']))
+  # Compute the GNSS accuracy (cross-track error against the reference track)
+  if ("gnssAccuracy" in project_conf['project']):
+    project_conf_gnss_accuracy = project_conf['project']['gnssAccuracy']
+    if (args.debug): print("[debug] Read configuration file: 'gnssAccuracy' value set to " + str(project_conf['project']['gnssAccuracy']))
+  # Generate a graph of the cross-track error over time
+  if ("gnssAccuracyGraph" in project_conf['project']):
+    project_conf_gnss_accuracy_graph = project_conf['project']['gnssAccuracyGraph']
+    if (args.debug): print("[debug] Read configuration file: 'gnssAccuracyGraph' value set to " + str(project_conf['project']['gnssAccuracyGraph']))
+  # Compute the agreement matrix of all the pairs of devices
+  if ("agreementMatrix" in project_conf['project']):
+    project_conf_agreement_matrix = project_conf['project']['agreementMatrix']
+    if (args.debug): print("[debug] Read configuration file: 'agreementMatrix' value set to " + str(project_conf['project']['agreementMatrix']))
+  # Index the summaries and scores of the project in the index database
+  if ("index" in project_conf['project']):
+    project_conf_index = project_conf['project']['index']
+    if (args.debug): print("[debug] Read configuration file: 'index' value set to " + str(project_conf['project']['index']))
+  # Compute the distance and speed of the GNSS track of each device against the reported distance and speed
+  if ("gnssDistance" in project_conf['project']):
+    project_conf_gnss_distance = project_conf['project']['gnssDistance']
+    if (args.debug): print("[debug] Read configuration file: 'gnssDistance' value set to " + str(project_conf['project']['gnssDistance']))
+  # Generate a graph of the GNSS distance discrepancy and speed over time
+  if ("gnssDistanceGraph" in project_conf['project']):
+    project_conf_gnss_distance_graph = project_conf['project']['gnssDistanceGraph']
+    if (args.debug): print("[debug] Read configuration file: 'gnssDistanceGraph' value set to " + str(project_conf['project']['gnssDistanceGraph']))
+  # Detect the heart rate artifacts, score the heart rate without them and shade them on the graph
+  if ("hrArtifacts" in project_conf['project']):
+    project_conf_hr_artifacts = project_conf['project']['hrArtifacts']
+    if (args.debug): print("[debug] Read configuration file: 'hrArtifacts' value set to " + str(project_conf['project']['hrArtifacts']))
+  # Agreement statistics against the reference file, with Bland-Altman plots
+  if ("agreementStats" in project_conf['project']):
+    project_conf_agreement_stats = project_conf['project']['agreementStats']
+    if (args.debug): print("[debug] Read configuration file: 'agreementStats' value set to " + str(project_conf['project']['agreementStats']))
+  # Number of resamples of the block bootstrap
+  if ("bootstrapResamples" in project_conf['project']):
+    project_conf_bootstrap_resamples = project_conf['project']['bootstrapResamples']
+    if (args.debug): print("[debug] Read configuration file: 'bootstrapResamples' value set to %i" % (project_conf['project']['bootstrapResamples']))
+  # Length of the blocks of the block bootstrap (points)
+  if ("bootstrapBlock" in project_conf['project']):
+    project_conf_bootstrap_block = project_conf['project']['bootstrapBlock']
+    if (args.debug): print("[debug] Read configuration file: 'bootstrapBlock' value set to %i" % (project_conf['project']['bootstrapBlock']))
+  # Rolling agreement graph against the reference file
+  if ("rollingAgreement" in project_conf['project']):
+    project_conf_rolling_agreement = project_conf['project']['rollingAgreement']
+    if (args.debug): print("[debug] Read configuration file: 'rollingAgreement' value set to " + str(project_conf['project']['rollingAgreement']))
+  # Length (s) of the rolling window
+  if ("rollingWindow" in project_conf['project']):
+    project_conf_rolling_window = project_conf['project']['rollingWindow']
+    if (args.debug): print("[debug] Read configuration file: 'rollingWindow' value set to %i" % (project_conf['project']['rollingWindow']))
+  # Number of worst windows listed in the logfile
+  if ("rollingWorst" in project_conf['project']):
+    project_conf_rolling_worst = project_conf['project']['rollingWorst']
+    if (args.debug): print("[debug] Read configuration file: 'rollingWorst' value set to %i" % (project_conf['project']['rollingWorst']))
+  # Lower bounds of the HR zones 2..N (bpm), for the time in zone of each device
+  if ("hrZones" in project_conf['project']):
+    project_conf_hr_zones = project_conf['project']['hrZones']
+    if (args.debug): print("[debug] Read configuration file: 'hrZones' value set to " + str(project_conf['project']['hrZones']))
+  # Power analysis: rolling power, normalized power and mean-maximal power curve of each device
+  if ("powerAnalysis" in project_conf['project']):
+    project_conf_power_analysis = project_conf['project']['powerAnalysis']
+    if (args.debug): print("[debug] Read configuration file: 'powerAnalysis' value set to " + str(project_conf['project']['powerAnalysis']))
+  # Windows (s) of the rolling power
+  if ("powerWindows" in project_conf['project']):
+    project_conf_power_windows = project_conf['project']['powerWindows']
+    if (args.debug): print("[debug] Read configuration file: 'powerWindows' value set to " + str(project_conf['project']['powerWindows']))
+  # HR lag of each device against the reference file, over sliding windows
+  if ("hrLag" in project_conf['project']):
+    project_conf_hr_lag = project_conf['project']['hrLag']
+    if (args.debug): print("[debug] Read configuration file: 'hrLag' value set to " + str(project_conf['project']['hrLag']))
+  # Length (s) of the windows of the HR lag
+  if ("hrLagWindow" in project_conf['project']):
+    project_conf_hr_lag_window = project_conf['project']['hrLagWindow']
+    if (args.debug): print("[debug] Read configuration file: 'hrLagWindow' value set to " + str(project_conf['project']['hrLagWindow']))
+  # Step (s) between the windows of the HR lag
+  if ("hrLagStep" in project_conf['project']):
+    project_conf_hr_lag_step = project_conf['project']['hrLagStep']
+    if (args.debug): print("[debug] Read configuration file: 'hrLagStep' value set to " + str(project_conf['project']['hrLagStep']))
+  # Longest HR lag searched (s)
+  if ("hrLagMax" in project_conf['project']):
+    project_conf_hr_lag_max = project_conf['project']['hrLagMax']
+    if (args.debug): print("[debug] Read configuration file: 'hrLagMax' value set to " + str(project_conf['project']['hrLagMax']))
+  # HR lag (s) over which an interval is listed
+  if ("hrLagThreshold" in project_conf['project']):
+    project_conf_hr_lag_threshold = project_conf['project']['hrLagThreshold']
+    if (args.debug): print("[debug] Read configuration file: 'hrLagThreshold' value set to " + str(project_conf['project']['hrLagThreshold']))
+  # Fit the battery discharge rate over the full battery series (instead of the first and last values)
+  if ("batteryRegression" in project_conf['project']):
+    project_conf_battery_regression = project_conf['project']['batteryRegression']
+    if (args.debug): print("[debug] Read configuration file: 'batteryRegression' value set to " + str(project_conf['project']['batteryRegression']))
+  # Generate a graph of the battery level and of the fitted discharge
+  if ("batteryGraph" in project_conf['project']):
+    project_conf_battery_graph = project_conf['project']['batteryGraph']
+    if (args.debug): print("[debug] Read configuration file: 'batteryGraph' value set to " + str(project_conf['project']['batteryGraph']))
   # Change map style (mapbox map style)
   if ("mapStyle" in project_conf['project']):
     project_conf_map_style = project_conf['project']['mapStyle']
@@ -206,6 +429,18 @@ if (os.path.isfile(project_conf_file)):
   if ("removeAbnormalHrvThreshold" in project_conf['project']):
     project_conf_remove_hrv_abnormal_threshold = project_conf['project']['removeAbnormalHrvThreshold']
     if (args.debug): print("[debug] Read configuration file: 'removeAbnormalHrvThreshold' value set to " + str(project_conf['project']['removeAbnormalHrvThreshold']))     
+  # Frequency-domain HRV analysis (LF, HF and LF/HF over sliding windows)
+  if ("hrvSpectrum" in project_conf['project']):
+    project_conf_hrv_spectrum = project_conf['project']['hrvSpectrum']
+    if (args.debug): print("[debug] Read configuration file: 'hrvSpectrum' value set to " + str(project_conf['project']['hrvSpectrum']))
+  # Length of the sliding windows of the HRV spectrum (s)
+  if ("hrvSpectrumWindow" in project_conf['project']):
+    project_conf_hrv_spectrum_window = project_conf['project']['hrvSpectrumWindow']
+    if (args.debug): print("[debug] Read configuration file: 'hrvSpectrumWindow' value set to %i" % (project_conf['project']['hrvSpectrumWindow']))
+  # Step of the sliding windows of the HRV spectrum (s)
+  if ("hrvSpectrumStep" in project_conf['project']):
+    project_conf_hrv_spectrum_step = project_conf['project']['hrvSpectrumStep']
+    if (args.debug): print("[debug] Read configuration file: 'hrvSpectrumStep' value set to %i" % (project_conf['project']['hrvSpectrumStep']))
       
   # Generate a list of custom graphs fields:
   if (("customGraphs" in project_conf) and (len(project_conf['customGraphs']) > 0)):
@@ -214,6 +449,22 @@ if (os.path.isfile(project_conf_file)):
     for custom_graph in project_conf['customGraphs']:
       for custom_value in custom_graph['values']:
         custom_graphs_values.append(custom_value['field'])
+  # Scoring parameters for each field (merged with the defaults)
+  if ("scoring" in project_conf):
+    if (args.debug): print("[debug] Read configuration file: 'scoring' is present")
+    for score_field in project_conf['scoring']:
+      if (score_field not in scoring_conf):
+        scoring_conf[score_field] = {}
+      if (project_conf['scoring'][score_field] != None):
+        scoring_conf[score_field].update(project_conf['scoring'][score_field])
+  # Parameters of the heart rate artifacts detection (merged with the defaults)
+  if (("hrArtifactDetection" in project_conf) and (project_conf['hrArtifactDetection'] != None)):
+    if (args.debug): print("[debug] Read configuration file: 'hrArtifactDetection' is present")
+    for artifact_param in project_conf['hrArtifactDetection']:
+      if (artifact_param in hr_artifact_conf):
+        hr_artifact_conf[artifact_param] = project_conf['hrArtifactDetection'][artifact_param]
+      else:
+        print("WARNING: Unknown heart rate artifact detection parameter %s" % (artifact_param))
   # Configuration for each fit file
   for ffile in fitfiles:
     # If we have the file
@@ -248,28 +499,56 @@ def fit_ts_to_dt(timestamp):
   datetime_fit = fit_epoch + datetime.timedelta(seconds=timestamp)
   return datetime_fit
 
-# This function load fit sessions (one for single activity, multiple for multisport)
+# This function build the session index of a fit file (one for single activity, multiple for multisport)
+# The sessions are read during fitSummary, they are only mapped here to the record offsets (no new parsing of the file)
 # Input: 
 # - fitname (fit file name)
 # - summary (array of summary data)
+# - file_timestamps: sorted array of the timestamps of the loaded data
 # Output: 
-# - Array of sessions (0 -> sport / 1 -> start_time / 2 -> total_elapsed_time)
-def loadFitSession(fitname, summary):
-  global APP_PATH
+# - Array of sessions (0 -> sport / 1 -> start_time / 2 -> total_elapsed_time / 3 -> relative start / 4 -> first record offset / 5 -> end record offset, excluded)
+def loadFitSession(fitname, summary, file_timestamps):
+  global delta_values
+  delta = 0
+  if fitname in delta_values:
+    delta = delta_values[fitname]
   r_sessions = []
-  data = fitparse.FitFile(APP_PATH + fitname)
-  i = 0
-  for session in data.get_messages("session"):
+  for session in summary[19]:
     r_session = []
-    r_session.append(session.get_value('sport'))
-    r_session.append(session.get_value('start_time'))
-    r_session.append(session.get_value('total_elapsed_time'))
-    duration_seconds = (session.get_value('start_time')-summary[4]).total_seconds()
+    r_session.append(session[0])
+    r_session.append(session[1])
+    r_session.append(session[2])
+    duration_seconds = (session[1]-summary[4]).total_seconds()
     r_session.append(duration_seconds)
-    # Add everything to the main return value
+    # Map the session boundaries to record offsets by binary search on timestamps
+    session_start = session[1] + datetime.timedelta(0,delta)
+    session_end = session_start + datetime.timedelta(0,session[2])
+    r_session.append(bisect.bisect_left(file_timestamps, session_start))
+    r_session.append(bisect.bisect_left(file_timestamps, session_end))
+    # Add everything to the main return value
     r_sessions.append(r_session)
   return r_sessions
 
+# This function build the lap index of a fit file
+# The laps are read during fitSummary, they are only mapped here to the record offsets (no new parsing of the file)
+# Input: 
+# - fitname (fit file name)
+# - summary (array of summary data)
+# - file_timestamps: sorted array of the timestamps of the loaded data
+# Output: 
+# - Array of laps (0 -> start_time with delta / 1 -> total_elapsed_time / 2 -> relative start / 3 -> first record offset / 4 -> end record offset, excluded)
+def loadFitLaps(fitname, summary, file_timestamps):
+  global delta_values
+  delta = 0
+  if fitname in delta_values:
+    delta = delta_values[fitname]
+  r_laps = []
+  for lap in summary[20]:
+    lap_start = lap[0] + datetime.timedelta(0,delta)
+    lap_end = lap_start + datetime.timedelta(0,lap[1])
+    r_laps.append([lap_start, lap[1], (lap[0]-summary[4]).total_seconds(), bisect.bisect_left(file_timestamps, lap_start), bisect.bisect_left(file_timestamps, lap_end)])
+  return r_laps
+
 # This function load fit data in an array
 # Input:
 # - fitname (fit file name)
@@ -278,7 +557,7 @@ def loadFitSession(fitname, summary):
 # Output: 
 # - Array of data for each point, a dict for each fields
 def loadFitData(fitname, summary, fields):
-  global delta_values, project_conf_zoom, project_conf_zoom_range, project_conf_map, custom_graphs_values, APP_PATH, config_list_fields
+  global delta_values, project_conf_map, project_conf_gnss_accuracy, project_conf_gnss_distance, custom_graphs_values, APP_PATH
   # By default we include the timestamp in the data collected
   fields.append('timestamp')
   
@@ -288,8 +567,6 @@ def loadFitData(fitname, summary, fields):
       fields.append(field)
   
   delta = 0
-  start_point = summary[4] + datetime.timedelta(0,project_conf_zoom_range[0])
-  end_point = summary[4] + datetime.timedelta(0,project_conf_zoom_range[1])
   
   # Order list for special fields:
   priority_fields = {}
@@ -301,12 +578,17 @@ def loadFitData(fitname, summary, fields):
     delta = delta_values[fitname]
     if (args.debug): print("[debug] [loadFitData] Delta value to apply for file %s: %i" % (fitname, delta))
   # Load in an array the following data:
-  # We include the position if map is enabled
-  if (project_conf_map):
+  # We include the position if map, GNSS accuracy, the distance alignment or the DEM altitude is enabled
+  if (project_conf_map or project_conf_gnss_accuracy or project_conf_gnss_distance or (project_conf_align == 'distance') or (project_conf_dem_directory != None)):
     fields.append('position')
     gps5hz_data = load5hzGPS(fitname, delta)
     if (args.debug) and (gps5hz_data): print("[debug] [loadFitData] Fitfile %s has 5hz GPS points" % (fitname))
     if (args.debug) and (not gps5hz_data): print("[debug] [loadFitData] Fitfile %s has NO 5hz GPS points" % (fitname))
+    # Index the 5hz points by timestamp (first point wins), to avoid a full scan for each record
+    gps5hz_index = {}
+    for g5hz_pt in gps5hz_data:
+      if (g5hz_pt['ts'] not in gps5hz_index):
+        gps5hz_index[g5hz_pt['ts']] = g5hz_pt
   # timestamp, heart_rate, altitude, distance, power
   data = fitparse.FitFile(APP_PATH + fitname)
   # For each point
@@ -322,145 +604,130 @@ def loadFitData(fitname, summary, fields):
   i = 0
   all_file_values = []
   for record in data.get_messages('record'):
-    # If we have no zoom, or in range
     record_timestamp = record.get_value('timestamp') + datetime.timedelta(0,delta)
-    if ((project_conf_zoom == False) or ((record_timestamp >= start_point) and (record_timestamp <= end_point))):
-      # New point 
-      this_value = {}
-      if ((i == 20) and (config_list_fields)):
-        print("*********************************************************")
-        print("Fields for file %s:" % (fitname))
-        for record_data in record:
-          print(" - %s" % (record_data.name))
-        print("*********************************************************")
-      for value in fields:
-        # If value is timestamp, then add the delta
-        if (value == "timestamp"):
-          this_value[value] = record.get_value(value) + datetime.timedelta(0,delta)
-        # If in prority, run trough all the possible fields
-        elif (value in priority_fields):
-          this_single_value = None
-          for possible_field in priority_fields[value]:
-            if (record.get_value(possible_field) != None):
-              this_single_value = record.get_value(possible_field)
-              if (possible_field == "altitude" or possible_field == "enhanced_altitude"):
-                alt_previous_value = this_single_value
-              break
-          if (possible_field == "altitude" or possible_field == "enhanced_altitude"):
-            this_value[value] = alt_previous_value
-          else:
-            this_value[value] = this_single_value
-        # If field is position, put an array instead of a single value:
-        elif (value == 'position'):
-          this_value[value] = []
-          # Search if we have 5hz GPS position for this point:
-          multiple_point = False
-          for g5hz_pt in gps5hz_data:
-            if (g5hz_pt['ts'] == record_timestamp):
-              this_value[value].append({'lat': g5hz_pt['lat'], 'long': g5hz_pt['long']})
-              multiple_point = True
-              break
-          if (multiple_point == False):
-            this_value[value].append({'lat': record.get_value('position_lat'), 'long': record.get_value('position_long')})
-        # No priority list, just put the value if not none
+    # New point 
+    this_value = {}
+    for value in fields:
+      # If value is timestamp, then add the delta
+      if (value == "timestamp"):
+        this_value[value] = record.get_value(value) + datetime.timedelta(0,delta)
+      # If in prority, run trough all the possible fields
+      elif (value in priority_fields):
+        this_single_value = None
+        for possible_field in priority_fields[value]:
+          if (record.get_value(possible_field) != None):
+            this_single_value = record.get_value(possible_field)
+            if (possible_field == "altitude" or possible_field == "enhanced_altitude"):
+              alt_previous_value = this_single_value
+            break
+        if (possible_field == "altitude" or possible_field == "enhanced_altitude"):
+          this_value[value] = alt_previous_value
         else:
-          if (value == 'heart_rate'):
-            if (record.get_value(value) == None):
-              this_value[value] = hr_previous_value
-              if (args.debug): print("[debug] [loadFitData] NOTICE: A value 'None' was found in heart_rate loading data from file %s " % (fitname))
-            else:
-              this_value[value] = record.get_value(value)
-              hr_previous_value = record.get_value(value)
+          this_value[value] = this_single_value
+      # If field is position, put an array instead of a single value:
+      elif (value == 'position'):
+        this_value[value] = []
+        # Search if we have 5hz GPS position for this point:
+        g5hz_pt = gps5hz_index.get(record_timestamp)
+        if (g5hz_pt != None):
+          this_value[value].append({'lat': g5hz_pt['lat'], 'long': g5hz_pt['long']})
+        else:
+          this_value[value].append({'lat': record.get_value('position_lat'), 'long': record.get_value('position_long')})
+      # No priority list, just put the value if not none
+      else:
+        if (value == 'heart_rate'):
+          # Keep track of the filled points for the artifacts detection
+          this_value['heart_rate_filled'] = (record.get_value(value) == None)
+          if (record.get_value(value) == None):
+            this_value[value] = hr_previous_value
+            if (args.debug): print("[debug] [loadFitData] NOTICE: A value 'None' was found in heart_rate loading data from file %s " % (fitname))
           else:
             this_value[value] = record.get_value(value)
-      all_values.append(this_value)
-      i = i+1
+            hr_previous_value = record.get_value(value)
+        else:
+          this_value[value] = record.get_value(value)
+    all_values.append(this_value)
+    i = i+1
   
   return all_values
 
-# This function loads a hrv array from a CSV
-def loadCsvHrv(csv_file, hrvDelta):
-  global APP_PATH, project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold
+# This function applies the soft and percentage filter to a list of RR intervals
+# An interval differing from the last valid one by more than the threshold is replaced by the last valid one
+def filterAbnormalHrv(rr_values):
+  global project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold
 
   rrintervals = []
   last_value = 0
-  with open(APP_PATH + csv_file, mode='r') as file:
-    csv_reader = csv.reader(file)
-    i = 0
-    for row in csv_reader:
-      i = i+1
-      if ((i > 1) and (i > hrvDelta)):
-        this_value = int(row[0])
-        if (last_value == 0):
-          hrv_percentage = 0
-        else:
-          hrv_percentage = abs(100-(this_value*100/last_value))
-                  
-        # The soft and percentage filter
-        if ((last_value != 0 and project_conf_remove_hrv_abnormal) and (hrv_percentage > project_conf_remove_hrv_abnormal_threshold)):
-          rrintervals.append(last_value)
-        else:
-          rrintervals.append(this_value)
-          last_value = this_value
-          
+  for this_value in rr_values:
+    if (last_value == 0):
+      hrv_percentage = 0
+    else:
+      hrv_percentage = abs(100-(this_value*100/last_value))
+
+    # The soft and percentage filter
+    if ((last_value != 0 and project_conf_remove_hrv_abnormal) and (hrv_percentage > project_conf_remove_hrv_abnormal_threshold)):
+      rrintervals.append(last_value)
+    else:
+      rrintervals.append(this_value)
+      last_value = this_value
+
   return rrintervals
 
-# This function loads a hrv array from a Suunto JSON
-def loadSuuntoHrv(json_file, hrvDelta):
-  global APP_PATH, project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold
-  with open(APP_PATH + json_file, 'r', encoding='utf-8') as file:
-    data = json.load(file)
-    rr_values = data['DeviceLog']['R-R']['Data']
+# This function loads a hrv array from a CSV
+# Only the first column is read, in bulk: the first hrvDelta lines are skipped, the header line counts as one of them (at least the header line is skipped)
+def loadCsvHrv(csv_file, hrvDelta):
+  global APP_PATH
 
-  rrintervals = []
-  i = 0
-  last_value = 0
-  for rr in rr_values:
-    i += 1
-    if (i > hrvDelta):
-      this_value = rr
-      if (last_value == 0):
-        hrv_percentage = 0
-      else:
-        hrv_percentage = abs(100-(this_value*100/last_value))
+  try:
+    rr_values = pd.read_csv(APP_PATH + csv_file, header=None, usecols=[0], skiprows=max(1, hrvDelta), dtype=float).iloc[:, 0].to_numpy()
+  except pd.errors.EmptyDataError:
+    return []
+  return filterAbnormalHrv(rr_values.tolist())
 
-      # The soft and percentage filter
-      if ((last_value != 0 and project_conf_remove_hrv_abnormal) and (hrv_percentage > project_conf_remove_hrv_abnormal_threshold)):
-        rrintervals.append(last_value)
-      else:
-        rrintervals.append(this_value)
-        last_value = this_value
+# This function loads a hrv array from a Suunto JSON
+# The R-R array is read with a streaming scanner, the rest of the log (samples...) is never loaded
+def loadSuuntoHrv(json_file, hrvDelta):
+  global APP_PATH
 
-  return rrintervals
+  rr_values = scan_json_array(APP_PATH + json_file, ['DeviceLog', 'R-R', 'Data'])
+  return filterAbnormalHrv(rr_values[max(hrvDelta, 0):].tolist())
 
 # This function loads a hrv array from a FIT
 def loadFitHrv(fitname, hrvDelta):
-  global APP_PATH, project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold
+  global APP_PATH
   
   data = fitparse.FitFile(APP_PATH + fitname)
-  rrintervals = []
-  last_value = 0
-  i = 0
+  rr_values = []
   for record in data.get_messages('hrv'):
     for record_data in record:
       for RR_interval in record_data.value:
         if RR_interval is not None:
-          i += 1
-          if (i > hrvDelta):
-            this_value = RR_interval*1000
-            if (last_value == 0):
-              hrv_percentage = 0
-            else:
-              hrv_percentage = abs(100-(this_value*100/last_value))
-            
-            # The soft and percentage filter
-            if ((last_value != 0 and project_conf_remove_hrv_abnormal) and (hrv_percentage > project_conf_remove_hrv_abnormal_threshold)):
-                rrintervals.append(last_value)
-            else:
-              rrintervals.append(this_value)
-              last_value = this_value
+          rr_values.append(RR_interval*1000)
             
-  return rrintervals
+  return filterAbnormalHrv(rr_values[max(hrvDelta, 0):])
+
+# This function loads the hrv array of a fit file from its HRV source (CSV, Suunto JSON or the FIT file itself)
+def loadHrv(ffile):
+  global hrvCsv_values, hrvSuunto_values, hrvDelta_values
+  hrvDelta = hrvDelta_values.get(ffile, 0)
+  if ffile in hrvCsv_values:
+    return loadCsvHrv(hrvCsv_values[ffile], hrvDelta)
+  elif ffile in hrvSuunto_values:
+    return loadSuuntoHrv(hrvSuunto_values[ffile], hrvDelta)
+  return loadFitHrv(ffile, hrvDelta)
+
+# This function returns the inputs of the HRV outputs: the filter settings, and the hash of the HRV source and the delta of each file
+def hrvInputs(fitfiles):
+  global project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold
+  hrv_inputs = [project_conf_remove_hrv_abnormal, project_conf_remove_hrv_abnormal_threshold]
+  for ffile in fitfiles:
+    if ffile in hrvCsv_values:
+      hrv_inputs.append([ffile, fileHash(hrvCsv_values[ffile]), hrvDelta_values.get(ffile, 0)])
+    elif ffile in hrvSuunto_values:
+      hrv_inputs.append([ffile, fileHash(hrvSuunto_values[ffile]), hrvDelta_values.get(ffile, 0)])
+    else:
+      hrv_inputs.append([ffile, None, hrvDelta_values.get(ffile, 0)])
+  return hrv_inputs
 
 # This function take a fit file name and "decode" all the values
 # Fit file name is something like: 
@@ -507,12 +774,117 @@ def decodeFitName(fitname):
     distancesource = None
   return [makemodel, hrsource, gnsssource, distancesource]
   
-# This function read the summary informations of a fit file
+# This function list all the fields of a fit file (with developer fields), with their message type and number of occurrences
+# Only the definition messages are read (fast scan, no decoding of the values)
+def listFields(fitname):
+  scan = scan_fit(APP_PATH + fitname)
+  print("*********************************************************")
+  print("Fields for file %s (FIT protocol %.2f / profile %.2f):" % (fitname, scan['protocol_version'], scan['profile_version']))
+  print(" %-24s %-36s %10s" % ("Message", "Field", "Count"))
+  for field_details in scan['inventory']:
+    field_name = field_details[1]
+    if (field_details[2]):
+      field_name += " (developer)"
+    print(" %-24s %-36s %10i" % (field_details[0], field_name, field_details[3]))
+  print("-----")
+  for message_name in scan['messages']:
+    print(" %-61s %10i" % (message_name + " messages", scan['messages'][message_name]))
+  print("*********************************************************")
+
+# This function read the summary informations of a fit file with the fast scan
+# Only the file_id, session and lap messages, and a few fields of the records are decoded
 # Input:
 # - fitname (fit file name)
 # Output:
-# - Complete array of summary data of the fit file
+# - Complete array of summary data of the fit file (same as fitSummaryDecode)
 def fitSummary(fitname):
+  global APP_PATH
+  try:
+    scan = scan_fit(APP_PATH + fitname, {0: ['manufacturer', 'time_created'],
+                                         18: ['start_position_lat', 'start_position_long', 'sport', 'sub_sport', 'total_ascent', 'total_descent', 'total_elapsed_time', 'total_moving_time', 'total_distance', 'start_time'],
+                                         19: ['start_time', 'total_elapsed_time'],
+                                         20: ['timestamp', 'position_lat', 'position_long', 'altitude', 'enhanced_altitude', 'distance', 'nktool_battery']})
+  except ValueError as scan_error:
+    print("WARNING: Fast scan of %s failed (%s), full decode of the file for the summary" % (fitname, scan_error))
+    return fitSummaryDecode(fitname)
+  records = scan['decoded'][20]
+  if (len(records) == 0):
+    return fitSummaryDecode(fitname)
+
+  # File details (first message)
+  manufacturer = None
+  time_created = None
+  if (len(scan['decoded'][0]) > 0):
+    manufacturer = scan['decoded'][0][0].get('manufacturer')
+    time_created = scan['decoded'][0][0].get('time_created')
+
+  # Get all the details from the sessions (the last one wins, like the full decode)
+  session_values = {'sport': '', 'sub_sport': '', 'total_ascent': 0, 'total_descent': 0, 'total_elapsed_time': 0, 'total_moving_time': 0, 'total_distance': 0}
+  fit_sessions = []
+  for session in scan['decoded'][18]:
+    fit_sessions.append([session.get('sport'), session.get('start_time'), session.get('total_elapsed_time')])
+    for session_field in session_values:
+      if (session_field in session):
+        session_values[session_field] = session[session_field]
+  fit_laps = []
+  for lap in scan['decoded'][19]:
+    if ((lap.get('start_time') != None) and (lap.get('total_elapsed_time') != None)):
+      fit_laps.append([lap['start_time'], lap['total_elapsed_time']])
+
+  # First and last records
+  timestamp = records[0].get('timestamp')
+  start_battery = records[0].get('nktool_battery')
+  end_battery = records[-1].get('nktool_battery')
+  dist = records[-1].get('distance')
+  # Start altitude: first altitude after the altitude gap, end altitude: last altitude
+  start_alt = 0
+  for record in records[max(project_conf_altitude_gap - 1, 0):]:
+    if (record.get('enhanced_altitude') != None):
+      start_alt = record['enhanced_altitude']
+    elif (record.get('altitude') != None):
+      start_alt = record['altitude']
+    if (start_alt != 0):
+      break
+  alt = 0
+  for record in reversed(records):
+    if (record.get('enhanced_altitude') != None):
+      alt = record['enhanced_altitude']
+      break
+    elif (record.get('altitude') != None):
+      alt = record['altitude']
+      break
+  # Average position to center the map, and GPS detection
+  positions = np.array([[record['position_lat'], record['position_long']] for record in records if ((record.get('position_lat') != None) and (record.get('position_long') != None))], dtype=float)
+  has_gps = (len(positions) > 0)
+  avg_lat_final = 0
+  avg_long_final = 0
+  if (has_gps):
+    avg_lat_final = float(np.mean(positions[:, 0])) * (180/pow(2,31))
+    avg_long_final = float(np.mean(positions[:, 1])) * (180/pow(2,31))
+
+  if (dist == None):
+    dist = session_values['total_distance']
+
+  # If battery detail is manually entered into the project YAML file
+  if (start_battery == None):
+    try:
+      start_battery = charge[fitname][0]
+      end_battery = charge[fitname][1]
+    except:
+      start_battery = None
+      end_battery = None
+
+  return [scan['profile_version'], scan['protocol_version'], manufacturer, time_created, timestamp, dist, len(records),
+          session_values['total_elapsed_time'], session_values['total_moving_time'], session_values['sport'], session_values['sub_sport'],
+          session_values['total_ascent'], session_values['total_descent'], start_battery, end_battery, avg_lat_final, avg_long_final,
+          start_alt, alt, fit_sessions, fit_laps, has_gps]
+
+# This function read the summary informations of a fit file (full decode, if the fast scan is not possible)
+# Input:
+# - fitname (fit file name)
+# Output:
+# - Complete array of summary data of the fit file
+def fitSummaryDecode(fitname):
   global APP_PATH
   # Load fit file
   data = fitparse.FitFile(APP_PATH + fitname)
@@ -543,9 +915,12 @@ def fitSummary(fitname):
   sub_sport = ''
   avg_lat = []
   avg_long = []
+  fit_sessions = []
+  fit_laps = []
   
   # Get all the details from the session
   for session in data.get_messages("session"):
+    fit_sessions.append([session.get_value('sport'), session.get_value('start_time'), session.get_value('total_elapsed_time')])
     for sess in session:
       if (sess.name == 'start_position_lat'):
         start_position_lat = sess.value
@@ -566,7 +941,12 @@ def fitSummary(fitname):
       if (sess.name == 'total_distance'):
         total_distance = sess.value
   
-  # Iterate trough all record points
+  # Get the boundaries of the laps
+  for lap in data.get_messages("lap"):
+    if ((lap.get_value('start_time') != None) and (lap.get_value('total_elapsed_time') != None)):
+      fit_laps.append([lap.get_value('start_time'), lap.get_value('total_elapsed_time')])
+
+  # Iterate trough all record points
   i=0
   dist=0
   start_battery = 0
@@ -592,10 +972,11 @@ def fitSummary(fitname):
       alt = record.get_value('altitude')
     dist = record.get_value('distance')
     end_battery = record.get_value('nktool_battery')
-    if ((record.get_value('position_lat') != None) and (record.get_value('position_long') != None) and (project_conf_map == True)):
+    if ((record.get_value('position_lat') != None) and (record.get_value('position_long') != None)):
       avg_lat.append(record.get_value('position_lat'))
       avg_long.append(record.get_value('position_long'))
-  if (project_conf_map): 
+  has_gps = (len(avg_lat) > 0)
+  if (has_gps):
     avg_lat_final = (sum(avg_lat) / len(avg_lat)) * (180/pow(2,31))
     avg_long_final = (sum(avg_long) / len(avg_long)) * (180/pow(2,31))
   
@@ -631,32 +1012,38 @@ def fitSummary(fitname):
   return_val.append(avg_long_final)     # 16 -> Average longitude to center the map
   return_val.append(start_alt)          # 17 -> Altitude at beginning of activity
   return_val.append(alt)                # 18 -> Altitude at end of activity
+  return_val.append(fit_sessions)       # 19 -> Sessions (sport, start time, total elapsed time)
+  return_val.append(fit_laps)           # 20 -> Laps (start time, total elapsed time)
+  return_val.append(has_gps)            # 21 -> GPS data available in the records
   
   return return_val
     
 # This function returns the smoothed data of altitude for a file
 # Input:
 # - file_data: array of value for a fit file
+# - altitude_gap: number of points ignored at the beginning (default: altitudeGap, for the points of the files)
 # Output:
 # - array of smoothed data of the altitude values
-def smoothAltitude(file_data):
-  global project_conf_zoom_range, project_conf_altitude_gap
+def smoothAltitude(file_data, altitude_gap=None):
+  global project_conf_zoom, project_conf_zoom_range, project_conf_altitude_gap
+  if (altitude_gap == None):
+    altitude_gap = project_conf_altitude_gap
   # If the zoom window is smaller than 70 (regular smoothed data)
   if ((project_conf_zoom) and ((project_conf_zoom_range[1] - project_conf_zoom_range[0]) <= 70)):
     smooth_window = project_conf_zoom_range[1] - project_conf_zoom_range[0]
   else:
     smooth_window = 70
-  a_alt = []
-  i = 0
-  for point in file_data:
-    i += 1
-    skipThisPoint = False
-    # If we are still in the skip window for altitude
-    if (i <= project_conf_altitude_gap):
-      skipThisPoint = True
-    if (skipThisPoint == False):
-      a_alt.append(point['altitude'])
-  smoothed_altitude = savgol_filter(a_alt, smooth_window, 3) # window size 51, polynomial order 3
+  # The points in the skip window for altitude are not included
+  altitude_data = file_data[altitude_gap:]
+  a_alt = dataColumn(altitude_data, 'altitude')
+  smoothed_altitude = np.full(len(a_alt), np.nan)
+  # Each segment between two pauses / recording gaps (or points without altitude) is smoothed separately
+  for segment in valid_segments(a_alt, detectGaps(altitude_data)[0]):
+    segment_window = min(smooth_window, segment[1] - segment[0])
+    if (segment_window > 3):
+      smoothed_altitude[segment[0]:segment[1]] = savgol_filter(a_alt[segment[0]:segment[1]], segment_window, 3) # window size 51, polynomial order 3
+    else:
+      smoothed_altitude[segment[0]:segment[1]] = a_alt[segment[0]:segment[1]]
   return smoothed_altitude.tolist()
   
 # This function commpute D+ from smoothed altitude data
@@ -687,17 +1074,58 @@ def normalizedAltLoss(smoothed_alt_data):
     i_alt = apoint
   return norm_alt_loss
 
+# This function detects the pauses (auto-pause) and recording gaps of a data array
+# Input:
+# - file_data: array of value for a fit file
+# Output:
+# - array of the offsets of the first point after each gap, array of the duration of each gap (s)
+def detectGaps(file_data):
+  global project_conf_pause_threshold
+  if (len(file_data) == 0):
+    return np.array([], dtype=int), np.array([])
+  times = np.array([(point['timestamp'] - file_data[0]['timestamp']).total_seconds() for point in file_data])
+  return timestamp_gaps(times, project_conf_pause_threshold)
+
+# This function returns an empty point with the same fields as a point of the data (all the values are None)
+def fillerPoint(template_point, timestamp):
+  this_point = {}
+  for field in template_point:
+    this_point[field] = None
+  this_point['timestamp'] = timestamp
+  if ('position' in template_point):
+    this_point['position'] = [{'lat': None, 'long': None}]
+  return this_point
+
+# This function fill the pauses / recording gaps of a data array with one empty point per second, so that the following points stay at their time when the data is not aligned
+# Input:
+# - data: array of value for a fit file
+# Output:
+# - data array with the points of the gaps
+def fillDataGaps(data):
+  gap_offsets, gap_durations = detectGaps(data)
+  if (len(gap_offsets) == 0):
+    return data
+  filled_data = []
+  previous_offset = 0
+  for gap_offset in gap_offsets:
+    filled_data.extend(data[previous_offset:gap_offset])
+    for i in range(1, int((data[gap_offset]['timestamp'] - data[gap_offset-1]['timestamp']).total_seconds())):
+      filled_data.append(fillerPoint(data[0], data[gap_offset-1]['timestamp'] + datetime.timedelta(0,i)))
+    previous_offset = gap_offset
+  filled_data.extend(data[previous_offset:])
+  return filled_data
+
 # This function fill a data array to the given value
 # Input: 
 # - data: array of value for a fit file
 # - lenght: lenght to fill the data array to
 # - fields: array of fields to add to the fit data (graphs and custom graphs) - IMPORTANT: prive a copy of array [:]
 def fillDataArray(data, lenght, fields):
-  global project_conf_map, custom_graphs_values
+  global project_conf_map, project_conf_gnss_accuracy, project_conf_gnss_distance, custom_graphs_values
   # Fill value
   fill_value = None
-  # We include the position if maap is enabled
-  if (project_conf_map):
+  # We include the position if map or GNSS accuracy is enabled
+  if (project_conf_map or project_conf_gnss_accuracy or project_conf_gnss_distance):
     fields.append('position_lat')
     fields.append('position_long')
   
@@ -716,9 +1144,90 @@ def fillDataArray(data, lenght, fields):
     this_point['timestamp'] = this_timestamp
     for field in fields:
       this_point[field] = fill_value
+    if ('position' in data[0]):
+      this_point['position'] = [{'lat': None, 'long': None}]
     data.append(this_point)
   return data
 
+# This function resamples the points of a file on a common time grid
+# Numeric fields are interpolated (not over the gaps longer than max_gap), other fields take the value of the closest point
+# Input:
+# - file_data: array of value for a fit file
+# - grid_start: timestamp of the first point of the grid
+# - grid: array of the grid times (seconds from grid_start)
+# - max_gap: maximum gap (seconds) between two points to interpolate
+# - sample_axis / grid_timestamps: to resample on another axis (distance...), the non decreasing coordinate of each point on this axis,
+#   and the timestamps given to the grid points
+# - extra_columns: dict of additional numeric columns (one value per point) resampled as fields
+# Output:
+# - array of value on the grid
+def resampleFile(file_data, grid_start, grid, max_gap, sample_axis=None, grid_timestamps=None, extra_columns=None):
+  if (sample_axis is None):
+    times = np.array([(point['timestamp'] - grid_start).total_seconds() for point in file_data])
+  else:
+    times = np.asarray(sample_axis, dtype=float)
+  nearest = nearest_sample(times, grid, max_gap).tolist()
+  resampled_columns = {}
+  for field in file_data[0]:
+    if (field == 'timestamp'):
+      continue
+    try:
+      resampled_columns[field] = resample_column(times, dataColumn(file_data, field), grid, max_gap).tolist()
+    except (TypeError, ValueError):
+      resampled_columns[field] = None
+  if (extra_columns != None):
+    for field in extra_columns:
+      resampled_columns[field] = resample_column(times, np.asarray(extra_columns[field], dtype=float), grid, max_gap).tolist()
+
+  resampled_data = []
+  for i in range(len(grid)):
+    this_point = {}
+    if (grid_timestamps is None):
+      this_point['timestamp'] = grid_start + datetime.timedelta(seconds=float(grid[i]))
+    else:
+      this_point['timestamp'] = grid_timestamps[i]
+    for field in resampled_columns:
+      if (resampled_columns[field] != None):
+        value = resampled_columns[field][i]
+        this_point[field] = None if math.isnan(value) else value
+      elif (nearest[i] >= 0):
+        this_point[field] = file_data[nearest[i]][field]
+      elif (field == 'position'):
+        this_point[field] = [{'lat': None, 'long': None}]
+      else:
+        this_point[field] = None
+    resampled_data.append(this_point)
+  return resampled_data
+
+# This function computes the along-track distance of each point of each file on the route of the first file (reference)
+# The positions are projected on the closest segment of the route, in the band around the distance covered by the device
+# Output:
+# - dict of arrays (points) of the non decreasing along-track distance (m) for each file, None if a file has no position
+def routeDistances(fitfiles, ff_data):
+  global project_conf_distance_band
+  ref_times, ref_lat, ref_long = extractPositions(ff_data[fitfiles[0]], ff_data[fitfiles[0]][0]['timestamp'])
+  if (len(ref_lat) < 2):
+    return None
+  ref_xy = local_metric_projection(ref_lat, ref_long, ref_lat[0], ref_long[0])
+  route_length = np.sqrt((np.diff(ref_xy, axis=0)**2).sum(axis=-1)).sum()
+  route_distances = {}
+  for ffile in fitfiles:
+    start_ts = ff_data[ffile][0]['timestamp']
+    pos_times, pos_lat, pos_long = extractPositions(ff_data[ffile], start_ts)
+    if (len(pos_lat) < 2):
+      return None
+    dev_xy = local_metric_projection(pos_lat, pos_long, ref_lat[0], ref_long[0])
+    # Expected along-track distance: distance covered by the device, scaled to the length of the route
+    dev_track = np.concatenate(([0], np.cumsum(np.sqrt((np.diff(dev_xy, axis=0)**2).sum(axis=-1)))))
+    if (dev_track[-1] > 0):
+      dev_track = dev_track * route_length / dev_track[-1]
+    along = route_projection(ref_xy, dev_xy, 8, dev_track, project_conf_distance_band)[0]
+    # The device only goes forward on the route (a point behind the previous ones keeps their distance)
+    along = np.maximum.accumulate(along)
+    record_times = np.array([(point['timestamp'] - start_ts).total_seconds() for point in ff_data[ffile]])
+    route_distances[ffile] = np.interp(record_times, pos_times, along)
+  return route_distances
+
 # This function will read and load additionnal positions of 5hz record 
 def load5hzGPS(fitname, delta):
   global APP_PATH
@@ -737,22 +1246,332 @@ def load5hzGPS(fitname, delta):
     
   return gps5hz_data
 
+# This function extract all the positions of a file (including 5hz GPS points) in degrees
+# Input:
+# - file_data: array of value for a fit file
+# - start_ts: timestamp used as the origin of the relative time
+# Output:
+# - Arrays of relative time (s), latitudes and longitudes (degrees)
+def extractPositions(file_data, start_ts):
+  a_time = []
+  a_lat = []
+  a_long = []
+  for point in file_data:
+    # Filled points don't have any position
+    if (point.get('position') == None):
+      continue
+    point_time = (point['timestamp'] - start_ts).total_seconds()
+    # If it's a 5hz GPS point, spread the sub-second points over the second
+    if (isinstance(point['position'][0]['long'], (tuple, list))):
+      nb_sub_points = len(point['position'][0]['long'])
+      i = 0
+      for gps_point in point['position'][0]['long']:
+        if (gps_point is not None and point['position'][0]['lat'][i] is not None):
+          a_time.append(point_time + i/nb_sub_points)
+          a_lat.append(point['position'][0]['lat'][i])
+          a_long.append(gps_point)
+        i += 1
+    elif ((point['position'][0]['long'] != None) and (point['position'][0]['lat'] != None)):
+      a_time.append(point_time)
+      a_lat.append(point['position'][0]['lat'])
+      a_long.append(point['position'][0]['long'])
+  return np.array(a_time, dtype=float), np.array(a_lat, dtype=float) * (180/pow(2,31)), np.array(a_long, dtype=float) * (180/pow(2,31))
+
+# This function extract a field of a file as a numpy array (None values are NaN)
+# Input:
+# - file_data: array of value for a fit file
+# - field: name of the field
+# Output:
+# - array of float values
+def dataColumn(file_data, field):
+  column = []
+  for point in file_data:
+    value = point.get(field)
+    if (value == None):
+      column.append(np.nan)
+    else:
+      column.append(value)
+  return np.array(column, dtype=float)
+
+# This function returns the number of points of the aligned data in a second (1 Hz, or the resample rate with align: resample)
+def pointsPerSecond():
+  global project_conf_align, project_conf_resample_rate
+  if (project_conf_align == 'resample'):
+    return project_conf_resample_rate
+  return 1
+
+# This function converts a duration of the settings (s) to a number of points of the aligned data
+# With align: distance, the durations are counted in points of the distance grid
+def secondsToPoints(seconds):
+  return int(round(seconds * pointsPerSecond()))
+
+# This function returns the scoring parameters of a field (project.yaml "scoring" section merged with the defaults)
+# The latency and the start are converted from seconds to points of the aligned data
+# Output:
+# - dict of gap parameters (latency, start, metric, zeroIsMissing) and dict of score curve parameters
+def scoringParams(field):
+  global scoring_conf, project_conf_altitude_gap
+  gap_params = {'latency': 1, 'start': 0, 'metric': 'absolute', 'zeroIsMissing': False}
+  curve_params = {'tolerance': 0.5, 'averageFactor': 10, 'averageMax': 60, 'maxFactor': 1.7, 'maxLimit': 80, 'maxScore': 50}
+  # The ignored altitude points are not scored
+  if (field == 'altitude'):
+    gap_params['start'] = project_conf_altitude_gap
+  if (field in scoring_conf):
+    for param in scoring_conf[field]:
+      if (param in gap_params):
+        gap_params[param] = scoring_conf[field][param]
+      elif (param in curve_params):
+        curve_params[param] = scoring_conf[field][param]
+      else:
+        print("WARNING: Unknown scoring parameter %s for field %s" % (param, field))
+  gap_params['latency'] = max(1, secondsToPoints(gap_params['latency']))
+  gap_params['start'] = secondsToPoints(gap_params['start'])
+  return gap_params, curve_params
+
+# This function extract the aligned columns of a field for several files, for the vectorized analysis
+# Input:
+# - file_list: list of fit files
+# - field: name of the field
+# - zero_is_missing: 0 values are considered as no value (heart_rate)
+# Output:
+# - array (files, points), truncated to the shortest file
+def fieldColumns(file_list, field, zero_is_missing=False):
+  global ff_data
+  nb_points = min([len(ff_data[ffile]) for ffile in file_list])
+  columns = np.vstack([dataColumn(ff_data[ffile][:nb_points], field) for ffile in file_list])
+  if (zero_is_missing):
+    columns[columns == 0] = np.nan
+  return columns
+
+# This function fits the battery discharge rate of a file on the complete activity and on each session (multisport)
+# Input:
+# - file_data: array of value for a fit file (with the charge field)
+# - file_sessions: sessions of the file (from loadFitSession)
+# Output:
+# - list of [segment name, discharge_rate result or None]
+def batteryRegression(file_data, file_sessions):
+  battery_times = np.array([(point['timestamp'] - file_data[0]['timestamp']).total_seconds() for point in file_data])
+  battery_values = dataColumn(file_data, 'charge')
+  battery_segments = [['activity', discharge_rate(battery_times, battery_values)]]
+  if (len(file_sessions) > 1):
+    for session in file_sessions:
+      battery_segments.append(["session %s" % (session[0]), discharge_rate(battery_times[session[4]:session[5]], battery_values[session[4]:session[5]])])
+  return battery_segments
+
+# This function generates the graph of the battery level of each file, with the fitted discharge of the activity
+def generateBatteryGraph(fitfiles, ff_full_data, ff_battery, project_prefix, APP_PATH):
+  if (project_prefix != ''):
+    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_battery"
+  else:
+    graph_file = APP_PATH + "pnggraphs/battery"
+  graph_fingerprint = artifactFingerprint({'graph': 'battery'})
+  if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+    print("Graph of the battery is up to date, skipped")
+    return
+
+  print("Generating battery graph")
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  sns.set_theme(font='Montserrat')
+  sns.set(rc = {'figure.figsize':(20, 10)})
+  fig, ax_battery = plt.subplots()
+  for ffile in ff_battery:
+    battery_fit = ff_battery[ffile][0][1]
+    if (battery_fit == None):
+      continue
+    battery_hours = np.array([(point['timestamp'] - ff_full_data[ffile][0]['timestamp']).total_seconds() for point in ff_full_data[ffile]]) / 3600
+    line = ax_battery.plot(battery_hours, dataColumn(ff_full_data[ffile], 'charge'), linewidth=1, label=decodeFitName(ffile)[0])
+    ax_battery.plot(battery_hours[[0, -1]], battery_fit['intercept'] - battery_fit['rate'] * battery_hours[[0, -1]], linewidth=1, linestyle='dashed', color=line[0].get_color(),
+                    label="%s: %.2f%%/h [%.2f - %.2f]" % (decodeFitName(ffile)[0], battery_fit['rate'], battery_fit['rate_low'], battery_fit['rate_high']))
+  ax_battery.set_title("Niveau de batterie (%) et décharge estimée")
+  ax_battery.set_xlabel("Heures")
+  ax_battery.legend()
+  plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+  plt.close(fig)
+  recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# This function display an additional analysis section and append it to the logfile
+def appendLogfile(textSection):
+  global flog_file
+  print("".join(textSection))
+  flog = open(flog_file, "a")
+  flog.write("".join(textSection))
+  flog.close()
+
+# This function computes the hash of the content of an input file (fit file, HRV CSV / JSON)
+def fileHash(file_name):
+  file_hash = hashlib.sha1()
+  with open(APP_PATH + file_name, 'rb') as input_file:
+    for chunk in iter(lambda: input_file.read(1048576), b''):
+      file_hash.update(chunk)
+  return file_hash.hexdigest()
+
+# This function computes the fingerprint of an output artifact
+# Input:
+# - artifact_inputs: configuration values used to build this artifact, in addition to the fit files and the window (window_inputs)
+# Output:
+# - fingerprint (sha1 of the inputs and of the script version)
+def artifactFingerprint(artifact_inputs):
+  global window_inputs
+  fingerprint_data = json.dumps([SCRIPT_VER, window_inputs, artifact_inputs], sort_keys=True, default=str)
+  return hashlib.sha1(fingerprint_data.encode('utf-8')).hexdigest()
+
+# This function checks if all the files of an artifact were built with the same inputs by a previous run
+# Input:
+# - artifact_files: list of output files of the artifact (PNG and CSV of a graph...)
+# - fingerprint: fingerprint of the current inputs
+# Output:
+# - True if the artifact can be skipped
+def artifactIsFresh(artifact_files, fingerprint):
+  global artifact_manifest
+  if (args.force):
+    return False
+  for artifact_file in artifact_files:
+    if ((artifact_manifest.get(os.path.relpath(artifact_file, APP_PATH)) != fingerprint) or (not os.path.isfile(artifact_file))):
+      return False
+  if (args.debug): print("[debug] Artifact %s is up to date" % (", ".join(artifact_files)))
+  return True
+
+# This function records the fingerprint of the files of a built artifact (merged in the manifest at the end of the run)
+def recordArtifact(artifact_files, fingerprint):
+  global artifact_updates
+  for artifact_file in artifact_files:
+    artifact_updates[os.path.relpath(artifact_file, APP_PATH)] = fingerprint
+
+# This function returns the configuration values which change the score of a field (shown in the legends)
+def scoringInputs(field):
+  global scoring_conf, project_conf_altitude_gap, project_conf_hr_artifacts, hr_artifact_conf
+  if (field == 'altitude'):
+    return [scoring_conf.get(field), project_conf_altitude_gap]
+  if ((field == 'heart_rate') and project_conf_hr_artifacts):
+    return [scoring_conf.get(field), hr_artifact_conf]
+  return scoring_conf.get(field)
+
+# This function open the index database and create the tables and indexes if needed
+def openIndex():
+  index_conn = sqlite3.connect(INDEX_DATABASE)
+  index_conn.execute("CREATE TABLE IF NOT EXISTS fit_files (fit_hash TEXT PRIMARY KEY, file_name TEXT, device TEXT, hr_measurement TEXT, gnss_mode TEXT, distance_measurement TEXT, "
+                     "profile_version REAL, protocol_version REAL, manufacturer TEXT, creation_time TEXT, first_timestamp TEXT, distance REAL, records INTEGER, elapsed_time REAL, moving_time REAL, "
+                     "sport TEXT, sub_sport TEXT, ascent REAL, descent REAL, normalized_ascent REAL, normalized_descent REAL, start_altitude REAL, end_altitude REAL, "
+                     "battery_start REAL, battery_end REAL, battery_rate REAL, sessions INTEGER, updated TEXT)")
+  index_conn.execute("CREATE TABLE IF NOT EXISTS comparisons (comparison_id TEXT, fit_hash TEXT, project_prefix TEXT, reference_hash TEXT, is_reference INTEGER, updated TEXT, PRIMARY KEY (comparison_id, fit_hash))")
+  index_conn.execute("CREATE TABLE IF NOT EXISTS scores (comparison_id TEXT, window TEXT, field TEXT, fit_hash TEXT, reference_hash TEXT, average_gap REAL, max_gap REAL, score REAL, points INTEGER, PRIMARY KEY (comparison_id, window, field, fit_hash))")
+  index_conn.execute("CREATE INDEX IF NOT EXISTS idx_fit_files_device ON fit_files (device, hr_measurement, gnss_mode)")
+  index_conn.execute("CREATE INDEX IF NOT EXISTS idx_fit_files_gnss_mode ON fit_files (gnss_mode)")
+  index_conn.execute("CREATE INDEX IF NOT EXISTS idx_scores_field ON scores (field, window, fit_hash)")
+  return index_conn
+
+# This function upsert the summaries, tags and scores of the project in the index database
+# Input:
+# - window_scores: scores of each window (window name, '' for the main window)
+def indexProject(window_scores):
+  global ff_summary, ff_index, ff_hashes, ff_sessions
+  now_str = datetime.datetime.now().isoformat()
+  # A comparison is identified by its files (content, in order) and its prefix
+  comparison_id = hashlib.sha1(("|".join([project_prefix] + [ff_hashes[ffile] for ffile in fitfiles])).encode('utf-8')).hexdigest()
+  reference_hash = None
+  if (with_reference_file):
+    reference_hash = ff_hashes[reference_file]
+
+  index_conn = openIndex()
+  with index_conn:
+    for ffile in fitfiles:
+      summary = ff_summary[ffile]
+      tags = ff_index[ffile]['tags']
+      index_conn.execute("INSERT OR REPLACE INTO fit_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (ff_hashes[ffile], os.path.basename(ffile), tags[0], tags[1], tags[2], tags[3],
+                          summary[0], summary[1], None if summary[2] == None else str(summary[2]), None if summary[3] == None else summary[3].isoformat(), summary[4].isoformat(),
+                          summary[5], summary[6], summary[7], summary[8], str(summary[9]), str(summary[10]), summary[11], summary[12],
+                          ff_index[ffile]['normalized_ascent'], ff_index[ffile]['normalized_descent'], summary[17], summary[18],
+                          summary[13], summary[14], ff_index[ffile]['battery_rate'], len(ff_sessions[ffile]), now_str))
+      index_conn.execute("INSERT OR REPLACE INTO comparisons VALUES (?, ?, ?, ?, ?, ?)",
+                         (comparison_id, ff_hashes[ffile], project_prefix, reference_hash, int(with_reference_file and (ffile == reference_file)), now_str))
+    for window_name in window_scores:
+      # The scores of a window are replaced (a field may not be scored anymore)
+      index_conn.execute("DELETE FROM scores WHERE comparison_id = ? AND window = ?", (comparison_id, window_name))
+      for score_field in window_scores[window_name]:
+        for ffile in window_scores[window_name][score_field]:
+          score_data = window_scores[window_name][score_field][ffile]
+          index_conn.execute("INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (comparison_id, window_name, score_field, ff_hashes[ffile], reference_hash, float(score_data['average_gap']), float(score_data['max_gap']), float(score_data['score']), int(score_data['points'])))
+  index_conn.close()
+  if (args.debug): print("[debug] Project indexed in %s (comparison %s)" % (INDEX_DATABASE, comparison_id))
+
+# This function display the statistics of the index database, grouped by device, GNSS mode...
+# Input:
+# - group_columns: columns of the fit files to group by
+# - score_field: field of the scores (scores of the complete activities only)
+def queryIndex(group_columns, score_field):
+  if (not os.path.isfile(INDEX_DATABASE)):
+    print("ERROR: No index database %s, run a comparison first" % (INDEX_DATABASE))
+    return
+  index_conn = openIndex()
+  group_sql = ", ".join(["f." + column for column in group_columns])
+  # The scores are first averaged per file (a file may be in several comparisons), Scored is the number of files with a score
+  rows = index_conn.execute("SELECT " + group_sql + ", COUNT(f.fit_hash), COUNT(s.fit_hash), AVG(s.score), MIN(s.score), MAX(s.score), AVG(s.average_gap), AVG(f.battery_rate) "
+                            "FROM fit_files f LEFT JOIN (SELECT fit_hash, AVG(score) AS score, AVG(average_gap) AS average_gap FROM scores "
+                            "WHERE field = ? AND window = '' GROUP BY fit_hash) s ON s.fit_hash = f.fit_hash "
+                            "GROUP BY " + group_sql + " ORDER BY " + group_sql, (score_field,)).fetchall()
+  index_conn.close()
+
+  textOutput = []
+  textOutput.append("=========================================================================\n")
+  textOutput.append(" INDEX QUERY: %s score by %s (%s)\n" % (score_field, " / ".join(group_columns), INDEX_DATABASE))
+  textOutput.append("-------------------------------------------------------------------------\n")
+  group_names = [" / ".join([str(value) for value in row[:len(group_columns)]]) for row in rows]
+  name_width = max([len(" / ".join(group_columns))] + [len(group_name) for group_name in group_names])
+  textOutput.append(" %-*s %6s %6s %8s %8s %8s %10s %10s\n" % (name_width, " / ".join(group_columns), "Files", "Scored", "Score", "Min", "Max", "Ecart moy", "Batt %/hr"))
+  for group_name, row in zip(group_names, rows):
+    stats = row[len(group_columns):]
+    values = []
+    for value in stats[2:]:
+      values.append("-" if value == None else "%.2f" % (value))
+    textOutput.append(" %-*s %6i %6i %8s %8s %8s %10s %10s\n" % (name_width, group_name, stats[0], stats[1], values[0], values[1], values[2], values[3], values[4]))
+  textOutput.append("=========================================================================\n")
+  print("".join(textOutput))
+
 
 # #############################
 # PROCESS section
 
+# Only query the index database, no fit file is read
+if (args.query != None):
+  queryIndex(args.query, args.query_field)
+  sys.exit(0)
+
+# Only list the fields of the fit files (fast scan of the definition messages)
+if (config_list_fields):
+  for ffile in fitfiles:
+    listFields(ffile)
+  sys.exit(0)
+
 # Iterate through the fit files, to store all the relevant informations into an array
 i=0
 ff_summary = {}
-ff_data = {}
+ff_full_data = {}
+ff_timestamps = {}
+ff_sessions = {}
+ff_laps = {}
+ff_hashes = {}
+ff_index = {}
+ff_battery = {}
+ff_gaps = {}
 textOutput = []
 max_nb_points = 0
+
+# Get the relevant details from the fit files content (fast scan)
+for ffile in fitfiles:
+  if (args.debug): print("[debug] Call fitSummary for file %s" % (ffile))
+  ff_summary[ffile] = fitSummary(ffile)
+  ff_hashes[ffile] = fileHash(ffile)
+
+# The map is generated automatically if at least one file has GPS data (unless set in the project file)
+if (project_conf_map == None):
+  project_conf_map = any([ff_summary[ffile][21] for ffile in fitfiles])
+  if (args.debug): print("[debug] Map automatically set to " + str(project_conf_map) + " from the GPS data of the files")
+
 for ffile in fitfiles:
   if (args.debug): print("[debug] Processing file %s" % (ffile))
   i+=1
-
-  # Get the relevant details from the fit file content
-  ff_summary[ffile] = fitSummary(ffile)
   summary = ff_summary[ffile]
   
   # Get the max number of points
@@ -763,15 +1582,32 @@ for ffile in fitfiles:
   
   # Load data of fit file in array
   if (args.debug): print("[debug] Call loadFitData for file %s" % (ffile))
-  ff_data[ffile] = loadFitData(ffile, summary, values_to_compare[:])
+  load_fields = values_to_compare[:]
+  # The GNSS distance analysis also needs the reported distance and speed
+  if (project_conf_gnss_distance):
+    for gnss_field in ['distance', 'speed']:
+      if (gnss_field not in load_fields):
+        load_fields.append(gnss_field)
+  # The battery regression needs the complete battery series
+  if (project_conf_battery_regression and ('charge' not in load_fields)):
+    load_fields.append('charge')
+  ff_full_data[ffile] = loadFitData(ffile, summary, load_fields)
+  # Keep the timestamps array to slice the zoom windows by binary search
+  ff_timestamps[ffile] = [record['timestamp'] for record in ff_full_data[ffile]]
+  # Pauses and recording gaps of the file
+  ff_gaps[ffile] = detectGaps(ff_full_data[ffile])
 
   if (args.debug): print("[debug] Call loadFitSession for file %s" % (ffile))
-  ff_session = loadFitSession(ffile, summary)
+  ff_sessions[ffile] = loadFitSession(ffile, summary, ff_timestamps[ffile])
+  ff_session = ff_sessions[ffile]
+  ff_laps[ffile] = loadFitLaps(ffile, summary, ff_timestamps[ffile])
   
   # If altitude in the graphs list, we compute smoothed alt for all devices as well ad normalized alt gain/loss
+  normalized_alt_gain = None
+  normalized_alt_loss = None
   if ("altitude" in values_to_compare):
     if (args.debug): print("[debug] Altitude is in the field list, so compute smoothed altitude for file %s" % (ffile))
-    smoothed_altitude = smoothAltitude(ff_data[ffile])
+    smoothed_altitude = smoothAltitude(ff_full_data[ffile])
     normalized_alt_gain = normalizedAltGain(smoothed_altitude)
     normalized_alt_loss = normalizedAltLoss(smoothed_altitude)
   
@@ -794,6 +1630,18 @@ for ffile in fitfiles:
       # Compute HH:MM for battery projection
       battery_projection_hours = int(battery_projection)
       battery_projection_minutes = (battery_projection*60) % 60
+  # Robust regression over the complete battery series (replaces the first / last estimation)
+  battery_fit = None
+  if (project_conf_battery_regression and (len(ff_full_data[ffile]) > 0)):
+    battery_segments = batteryRegression(ff_full_data[ffile], ff_session)
+    battery_fit = battery_segments[0][1]
+    # Only the files with a battery series are kept
+    if (battery_fit != None):
+      ff_battery[ffile] = battery_segments
+      battery_rate = battery_fit['rate']
+
+  # Values of this file for the index database
+  ff_index[ffile] = {'tags': fitfiletags, 'battery_rate': battery_rate, 'normalized_ascent': normalized_alt_gain, 'normalized_descent': normalized_alt_loss}
 
   # Display the summary of the fit file
   if (args.debug): print("[debug] Start summary output for file %s" % (ffile))
@@ -830,14 +1678,47 @@ for ffile in fitfiles:
       textOutput.append(" --> Session type %s\n" % (sess_details[0]))
       textOutput.append("     Session start:            %s (%i)\n" % (sess_details[1].strftime("%m/%d/%Y, %H:%M:%S"), sess_details[3]))
       textOutput.append("     Session duration:         %.2f (%s)\n" % (sess_details[2], datetime.timedelta(seconds=int(sess_details[2]))))
+      textOutput.append("     Session records:          %i -> %i\n" % (sess_details[4], sess_details[5]))
+  if (len(ff_laps[ffile]) > 0):
+    textOutput.append(" Number of laps:               %i\n" % (len(ff_laps[ffile])))
+  if (len(ff_gaps[ffile][0]) > 0):
+    textOutput.append(" Pauses / recording gaps:      %i (total: %s)\n" % (len(ff_gaps[ffile][0]), datetime.timedelta(seconds=int(ff_gaps[ffile][1].sum()))))
+    for gap_idx in range(len(ff_gaps[ffile][0])):
+      gap_offset = ff_gaps[ffile][0][gap_idx]
+      textOutput.append("   --> After %s (point %i):      %s\n" % (ff_timestamps[ffile][gap_offset - 1] - ff_timestamps[ffile][0], gap_offset, datetime.timedelta(seconds=int(ff_gaps[ffile][1][gap_idx]))))
   if ((summary[13] != None) and (summary[14] != None)):
     textOutput.append(" Battery level start / end:    %.2f / %.2f\n" % (summary[13], summary[14]))
     if (battery_projection != None):
-      textOutput.append(" Battery burn rate:            %.2f%%/hr (projection: %02dh%02d)\n" % (battery_rate, battery_projection_hours, battery_projection_minutes))
+      textOutput.append(" Battery burn rate:            %.2f%%/hr (projection: %02dh%02d)\n" % ((summary[13] - summary[14])/(summary[7]/3600), battery_projection_hours, battery_projection_minutes))
+  if (battery_fit != None):
+    textOutput.append(" Battery burn rate regression: %.2f%%/hr [%.2f - %.2f] (%i points)" % (battery_fit['rate'], battery_fit['rate_low'], battery_fit['rate_high'], battery_fit['points']))
+    if (battery_fit['rate'] > 0):
+      textOutput.append(" (projection: %s)" % (str(datetime.timedelta(seconds=int(100/battery_fit['rate']*3600)))))
+    textOutput.append("\n")
+    for battery_segment in ff_battery[ffile][1:]:
+      if (battery_segment[1] != None):
+        textOutput.append("   --> %-26s %.2f%%/hr [%.2f - %.2f]\n" % (battery_segment[0] + ":", battery_segment[1]['rate'], battery_segment[1]['rate_low'], battery_segment[1]['rate_high']))
   textOutput.append("=========================================================================\n\n")
 
 if (args.debug): print("[debug] End of files processing and summary output")
 
+# Battery discharge rate of each GNSS mode (average of the files)
+if (len(ff_battery) > 0):
+  gnss_mode_rates = {}
+  for ffile in ff_battery:
+    if (ff_battery[ffile][0][1] != None):
+      gnss_mode = ff_index[ffile]['tags'][2]
+      if (gnss_mode not in gnss_mode_rates):
+        gnss_mode_rates[gnss_mode] = []
+      gnss_mode_rates[gnss_mode].append(ff_battery[ffile][0][1]['rate'])
+  if (len(gnss_mode_rates) > 0):
+    textOutput.append("=========================================================================\n")
+    textOutput.append(" BATTERY DISCHARGE BY GNSS MODE (regression, %/hr)\n")
+    textOutput.append(" %-42s %6s %8s %8s %8s\n" % ("GNSS mode", "Files", "Mean", "Min", "Max"))
+    for gnss_mode in gnss_mode_rates:
+      textOutput.append(" %-42s %6i %8.2f %8.2f %8.2f\n" % (gnss_mode, len(gnss_mode_rates[gnss_mode]), np.mean(gnss_mode_rates[gnss_mode]), min(gnss_mode_rates[gnss_mode]), max(gnss_mode_rates[gnss_mode])))
+    textOutput.append("=========================================================================\n\n")
+
 # Display project values:
 if (args.debug): print("[debug] Starting project summary output")
 # Store current date/time
@@ -851,9 +1732,19 @@ textOutput.append(" Script version:                     %s\n" % (SCRIPT_VER))
 textOutput.append(" Python version:                     %i.%i.%i\n" % (sys.version_info[0], sys.version_info[1], sys.version_info[2]))
 textOutput.append(" Date/time of execution:             %s\n" % (now_str))
 textOutput.append(" Project file configuration exists:  %s\n" % (project_conf_file_exists))
-textOutput.append(" Zoom on certain points:             %s\n" % (project_conf_zoom))
-if (project_conf_zoom):
-  textOutput.append(" Zoom from / to:                     %i / %i\n" % (project_conf_zoom_range[0], project_conf_zoom_range[1]))
+textOutput.append(" Align mode:                         %s\n" % (project_conf_align))
+if (project_conf_align == 'resample'):
+  textOutput.append(" Resample rate / max gap:            %s Hz / %s s\n" % (project_conf_resample_rate, project_conf_resample_max_gap))
+elif (project_conf_align == 'distance'):
+  textOutput.append(" Distance step / max gap / band:     %s m / %s m / %s m\n" % (project_conf_distance_step, project_conf_distance_max_gap, project_conf_distance_band))
+textOutput.append(" Pause / recording gap threshold:    %s s\n" % (project_conf_pause_threshold))
+textOutput.append(" Zoom on certain points:             %s\n" % (project_conf_windows[0]['range'] != None))
+for window in project_conf_windows:
+  if (window['range'] != None):
+    if (window['name'] != None):
+      textOutput.append(" Zoom window %-24s%i / %i\n" % (window['name'] + ":", window['range'][0], window['range'][1]))
+    else:
+      textOutput.append(" Zoom from / to:                     %i / %i\n" % (window['range'][0], window['range'][1]))
 textOutput.append("-------------------------------------------------------------------------\n")
 for ffile in fitfiles:
   textOutput.append(" Configuration values for %s\n" % (ffile))
@@ -878,90 +1769,138 @@ flog.close()
 
 # Build an array with all the timestamps of all fit files
 # This is only needed when more than one fit file is analyzed
-if (project_conf_align):
-  if (args.debug): print("[debug] Align values configured: build an array of all common timestamps")
-  all_timestamp = []
-  i=0
-  for ffile in fitfiles:
-    this_timestamp = []
-    # For each record
-    for record in ff_data[ffile]:
-      this_timestamp.append(record['timestamp'])
-    all_timestamp.append(this_timestamp)
-
-  # Then build a common_timestamps array
-  common_timestamp = []
-  i = 0
-  for ts in all_timestamp[0]:
-    # By default, the timestamp is considered as OK
-    thisPoint = True
-    # If this relative point is in ignore list
-    if (i in project_conf_ignore):
-      thisPoint = False
-    
-    # Loop over all files
-    for filearray in all_timestamp:
-      # Loop over all timestamps
-      if ts not in filearray:
-        # The ts is not common to all files
-        thisPoint = False
-    # If point were found in each file, add to the common array
-    if (thisPoint == True):
-      common_timestamp.append(ts)
-    i += 1
-  print(" Common timestamps:                  %i" % (len(common_timestamp)))
-  # Now, remove all the timestamps in the fffiles arrays which are not in the common 
-  if (args.debug): print("[debug] Align: removing all timestamps points not in the common list")
-  for ffile in fitfiles:
-    for record in ff_data[ffile][:]:
-      if record['timestamp'] not in common_timestamp:
-        ff_data[ffile].remove(record)
+def alignData():
+  global ff_data, common_timestamp, common_timestamp_set, longest_ts_array
+  if (project_conf_align == 'resample'):
+    if (args.debug): print("[debug] Resample values configured: interpolate all files on a common grid at %s Hz" % (str(project_conf_resample_rate)))
+    common_timestamp = []
+    if (min([len(ff_data[ffile]) for ffile in fitfiles]) > 0):
+      # The grid covers the time span common to all the files
+      grid_start = max([ff_data[ffile][0]['timestamp'] for ffile in fitfiles])
+      grid_end = min([ff_data[ffile][-1]['timestamp'] for ffile in fitfiles])
+      grid = np.arange(0, (grid_end - grid_start).total_seconds() + 0.000001, 1 / project_conf_resample_rate)
+      # Remove the points of the ignored seconds (relative, first grid point is 0)
+      grid = grid[~np.isin(np.floor(grid + 0.000001).astype(int), project_conf_ignore)]
+      # A file given twice (reference file also in the list) is resampled once
+      for ffile in dict.fromkeys(fitfiles):
+        ff_data[ffile] = resampleFile(ff_data[ffile], grid_start, grid, project_conf_resample_max_gap)
+      common_timestamp = [record['timestamp'] for record in ff_data[fitfiles[0]]]
+    else:
+      for ffile in fitfiles:
+        ff_data[ffile] = []
+    common_timestamp_set = set(common_timestamp)
+    print(" Resampled points:                   %i" % (len(common_timestamp)))
+
+  elif (project_conf_align == 'distance'):
+    if (args.debug): print("[debug] Distance align configured: interpolate all files on a common grid of the route of %s every %s m" % (fitfiles[0], str(project_conf_distance_step)))
+    common_timestamp = []
+    route_distances = None
+    if (min([len(ff_data[ffile]) for ffile in fitfiles]) > 0):
+      route_distances = routeDistances(fitfiles, ff_data)
+    if (route_distances != None):
+      # The grid covers the part of the route common to all the files
+      grid_start = max([route_distances[ffile][0] for ffile in fitfiles])
+      grid_end = min([route_distances[ffile][-1] for ffile in fitfiles])
+      grid = np.arange(grid_start, grid_end + 0.000001, project_conf_distance_step)
+      # Remove the ignored points (relative, first grid point is 0)
+      grid = np.delete(grid, [point for point in project_conf_ignore if point < len(grid)])
+      # All the files get the timestamps of the reference file at the distances of the grid
+      ref_start = ff_data[fitfiles[0]][0]['timestamp']
+      ref_times = np.array([(point['timestamp'] - ref_start).total_seconds() for point in ff_data[fitfiles[0]]])
+      grid_timestamps = [ref_start + datetime.timedelta(seconds=float(grid_time)) for grid_time in np.interp(grid, route_distances[fitfiles[0]], ref_times)]
+      # Each file keeps its own time (elapsed_time, seconds from its first point) at the distances of the grid
+      # A file given twice (reference file also in the list) is resampled once
+      for ffile in dict.fromkeys(fitfiles):
+        elapsed_time = [(point['timestamp'] - ff_data[ffile][0]['timestamp']).total_seconds() for point in ff_data[ffile]]
+        ff_data[ffile] = resampleFile(ff_data[ffile], ref_start, grid, project_conf_distance_max_gap, route_distances[ffile], grid_timestamps, {'elapsed_time': elapsed_time})
+      common_timestamp = grid_timestamps
+    else:
+      print("WARNING: The distance alignment needs the positions of all the files, no point is aligned")
+      for ffile in fitfiles:
+        ff_data[ffile] = []
+    common_timestamp_set = set(common_timestamp)
+    print(" Distance points:                    %i" % (len(common_timestamp)))
+
+  elif (project_conf_align):
+    if (args.debug): print("[debug] Align values configured: build an array of all common timestamps")
+    # Timestamps present in all the files
+    common_timestamp_set = set([record['timestamp'] for record in ff_data[fitfiles[0]]])
+    for ffile in fitfiles[1:]:
+      common_timestamp_set &= set([record['timestamp'] for record in ff_data[ffile]])
+
+    # Then build a common_timestamps array, in the order of the first file, without the ignored points
+    common_timestamp = []
+    ignored_points = set(project_conf_ignore)
+    i = 0
+    for record in ff_data[fitfiles[0]]:
+      if ((i not in ignored_points) and (record['timestamp'] in common_timestamp_set)):
+        common_timestamp.append(record['timestamp'])
+      i += 1
+    common_timestamp_set = set(common_timestamp)
+    print(" Common timestamps:                  %i" % (len(common_timestamp)))
+    # Now, remove all the timestamps in the fffiles arrays which are not in the common 
+    if (args.debug): print("[debug] Align: removing all timestamps points not in the common list")
+    for ffile in fitfiles:
+      ff_data[ffile] = [record for record in ff_data[ffile] if record['timestamp'] in common_timestamp_set]
 
-else:
-  # If we don't align, we have to fill the shortest dataset to have the same amount of points
-  # First get all the file timestamps array lengh:
-  if (args.debug): print("[debug] Align values disabled")
-  longest_ts_array = 0
-  # If we have a zoom, then the longest is the window of the zoom:
-  if project_conf_zoom:
-    longest_ts_array = project_conf_zoom_range[1] - project_conf_zoom_range[0]
-  # If no zoom, measure all file lenght:
-  else: 
+  else:
+    # If we don't align, we have to fill the shortest dataset to have the same amount of points
+    # First get all the file timestamps array lengh:
+    if (args.debug): print("[debug] Align values disabled")
+    # The pauses / recording gaps are filled first, so that the points after a gap stay at their time
     for ffile in fitfiles:
+      ff_data[ffile] = fillDataGaps(ff_data[ffile])
+    longest_ts_array = 0
+    # If we have a zoom, then the longest is the window of the zoom:
+    if project_conf_zoom:
+      longest_ts_array = project_conf_zoom_range[1] - project_conf_zoom_range[0]
+    # If no zoom, measure all file lenght:
+    else: 
+      for ffile in fitfiles:
+        this_ffile_timestamps = []
+        for record in ff_data[ffile]:
+          this_ffile_timestamps.append(record['timestamp'])
+        this_ffile_lenght = len(this_ffile_timestamps)
+        if (args.debug): print("[debug] Before filling, %s file has %i points" % (ffile, this_ffile_lenght))
+        if (this_ffile_lenght > longest_ts_array):
+          longest_ts_array = this_ffile_lenght
+    print(" Longest timestamps:                  %i" % (longest_ts_array))
+  
+    # Put all the files at the same lenght:
+    for ffile in fitfiles:
+      ff_data[ffile] = fillDataArray(ff_data[ffile], longest_ts_array, values_to_compare[:])
+      if (args.debug): print("[debug] Filling file %s to %i points" % (ffile, longest_ts_array))
       this_ffile_timestamps = []
       for record in ff_data[ffile]:
         this_ffile_timestamps.append(record['timestamp'])
       this_ffile_lenght = len(this_ffile_timestamps)
-      if (args.debug): print("[debug] Before filling, %s file has %i points" % (ffile, this_ffile_lenght))
-      if (this_ffile_lenght > longest_ts_array):
-        longest_ts_array = this_ffile_lenght
-  print(" Longest timestamps:                  %i" % (longest_ts_array))
-  
-  # Put all the files at the same lenght:
-  for ffile in fitfiles:
-    ff_data[ffile] = fillDataArray(ff_data[ffile], longest_ts_array, values_to_compare[:])
-    if (args.debug): print("[debug] Filling file %s to %i points" % (ffile, longest_ts_array))
-    this_ffile_timestamps = []
-    for record in ff_data[ffile]:
-      this_ffile_timestamps.append(record['timestamp'])
-    this_ffile_lenght = len(this_ffile_timestamps)
-    if (args.debug): print("[debug] After filling, %s file has %i points" % (ffile, this_ffile_lenght))
-print("=========================================================================")
+      if (args.debug): print("[debug] After filling, %s file has %i points" % (ffile, this_ffile_lenght))
+  print("=========================================================================")
 
 # ==============
 # GRAPHS
-def generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, project_conf_align, chartTitle, hr_max_pos): 
-  # Generate the graph
-  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+# This function returns the output files (without extension) of a graph
+def compareGraphFile(APP_PATH, project_prefix, compare_value):
   if (project_prefix != ''):
-    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_" + re.sub( '(?<!^)(?=[A-Z])', '_', compare_value ).lower()
+    return APP_PATH + "pnggraphs/" + project_prefix + "_" + re.sub( '(?<!^)(?=[A-Z])', '_', compare_value ).lower()
   else:
-    graph_file = APP_PATH + "pnggraphs/" + re.sub( '([A-Z])', r'+\1', compare_value ).lower()
+    return APP_PATH + "pnggraphs/" + re.sub( '([A-Z])', r'+\1', compare_value ).lower()
+
+# This function returns the list of the files written for a graph (PNG, and CSV if exported)
+def graphArtifacts(graph_file):
+  if (args.export and (args.export_format == 'csv')):
+    return [graph_file + '.png', graph_file + '.csv']
+  return [graph_file + '.png']
+
+def generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, project_conf_align, chartTitle, hr_max_pos, artifact_segments=[], x_max=None): 
+  # Generate the graph
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  graph_file = compareGraphFile(APP_PATH, project_prefix, compare_value)
   
   # Create a Pandas DataSet for this graph
   chartDataFrame = pd.DataFrame(chartData)
   # If the CSV export is enabled
-  if (args.export):
+  if (args.export and (args.export_format == 'csv')):
     chartDataFrame.to_csv(graph_file + '.csv', sep=',', decimal='.')
   sns.set_theme(font='Montserrat')
   sns.set(rc = {'figure.figsize':(20, 10)})
@@ -972,6 +1911,9 @@ def generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, proj
   else:
     global longest_ts_array
     max_nb_points = longest_ts_array
+  # The graphs which are not on the points of the files have their own x range
+  if (x_max != None):
+    max_nb_points = x_max
   thisPlot, thisAx = sns.lineplot(x=None, y=None, data=chartDataFrame, linewidth=1, dashes=False).set(title=chartTitle, xlim=(-5,max_nb_points+5))
   plt.grid(True)
   
@@ -979,211 +1921,230 @@ def generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, proj
   if ((compare_value == "heart_rate") and project_conf_align):
     for mhp in hr_max_pos:
       plt.axvline(x=mhp, color='gray', linewidth=1, linestyle='dotted')
+
+  # Shade the heart rate artifacts with the color of the device line
+  if (compare_value == "heart_rate"):
+    palette = sns.color_palette()
+    for segments in artifact_segments:
+      for segment in segments[1]:
+        plt.axvspan(segment[0] - 0.5, segment[1] + 0.5, color=palette[segments[0] % len(palette)], alpha=0.15, linewidth=0)
   
   plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
   plt.clf()
 
 # Start with the generation of the comparaison data sets
-shortest_hrv = 0
-for compare_value in values_to_compare:
+def generateCompareGraphs():
+  global ff_data, ff_summary, project_prefix, common_timestamp, common_timestamp_set, field_scores, hr_artifact_classes, dem_altitude
+  shortest_hrv = 0
+  # Ignored altitude points of the aligned data
+  altitude_gap = secondsToPoints(project_conf_altitude_gap)
+  for compare_value in values_to_compare:
   
-  if (args.debug): print("[debug] Configuring output for field %s" % (compare_value))
-  # We print what we are doing
-  print("Generating data for %s" % (compare_value))
-  # Build a complete dataset
-  if (compare_value == 'heart_rate'):
-    chartTitle = "Analyse de la fréquence cardiaque (bpm)"
-  elif (compare_value == 'altitude'):
-    chartTitle = "Analyse de l'altitude (m)"
-  elif (compare_value == 'distance'):
-    chartTitle = "Analyse de l'accumulation de distance (m)"
-  elif (compare_value == 'power'):
-    chartTitle = "Analyse des données de puissance (W)"
-  elif (compare_value == 'hrv'):
-    chartTitle = "Analyse des données R-R (ms)"
-  else:
-    chartTitle = "Analyse du champ de données \"%s\"" % (compare_value)
+    if (args.debug): print("[debug] Configuring output for field %s" % (compare_value))
+    # Build a complete dataset
+    if (compare_value == 'heart_rate'):
+      chartTitle = "Analyse de la fréquence cardiaque (bpm)"
+    elif (compare_value == 'altitude'):
+      chartTitle = "Analyse de l'altitude (m)"
+    elif (compare_value == 'distance'):
+      chartTitle = "Analyse de l'accumulation de distance (m)"
+    elif (compare_value == 'power'):
+      chartTitle = "Analyse des données de puissance (W)"
+    elif (compare_value == 'hrv'):
+      chartTitle = "Analyse des données R-R (ms)"
+    else:
+      chartTitle = "Analyse du champ de données \"%s\"" % (compare_value)
+
+    # Skip the graph if it was already built with the same inputs
+    graph_inputs = {'graph': compare_value, 'scoring': scoringInputs(compare_value)}
+    if (compare_value == 'altitude'):
+      graph_inputs['altitude'] = [project_conf_altitude_gap, project_conf_inc_smoothed_alt, project_conf_dem_directory]
+    elif (compare_value == 'hrv'):
+      graph_inputs['hrv'] = hrvInputs(fitfiles)
+    graph_fingerprint = artifactFingerprint(graph_inputs)
+    graph_files = graphArtifacts(compareGraphFile(APP_PATH, project_prefix, compare_value))
+    if (artifactIsFresh(graph_files, graph_fingerprint)):
+      print("Graph for %s is up to date, skipped" % (compare_value))
+      continue
+    # We print what we are doing
+    print("Generating data for %s" % (compare_value))
  
-  # Loop over the fitfiles
-  #thisData = {}
-  #thisLabel = {}
-  chartData = {}
-  chartData.clear()
+    # Loop over the fitfiles
+    #thisData = {}
+    #thisLabel = {}
+    chartData = {}
+    chartData.clear()
   
-  # ##############################
-  # Generate all "standard" graphs
-  # ##############################
-  hr_max_pos = []
-  for ffile in fitfiles:
-    # Parse the fitfile
-    # Build a dataset for this file
-    #data = []
-    thisPoint = 0
-    a_values = []
-    # Loop over all points
-    i = 0
-    
-    # For the HR stats data
-    average_hr_gap = {}
-    average_hr_gap['average'] = []
-    average_hr_gap['max'] = 0
-    
-    hr_analyze = False
+    # ##############################
+    # Generate all "standard" graphs
+    # ##############################
+    hr_max_pos = []
+    artifact_segments = []
+    for ffile in fitfiles:
+      # Parse the fitfile
+      # Build a dataset for this file
+      #data = []
+      thisPoint = 0
+      a_values = []
+      # Loop over all points
+      i = 0
     
-    # For altitude stats
-    start_alt = None
-    end_alt = None
-
-    for record in ff_data[ffile]:
-      skipThisPoint = False
-      # If we have a sync timestamps, check that this timestamp is in the list
-      if (((project_conf_align) and (record['timestamp'] in common_timestamp)) or (project_conf_align == False)):
-        i += 1
+      # For altitude stats
+      start_alt = None
+      end_alt = None
+
+      for record in ff_data[ffile]:
+        skipThisPoint = False
+        # If we have a sync timestamps, check that this timestamp is in the list
+        if (((project_conf_align) and (record['timestamp'] in common_timestamp_set)) or (project_conf_align == False)):
+          i += 1
         
-        # Special process
-
-        # If the current field is HR
-        if ((compare_value == 'heart_rate') and (record['heart_rate'] != None)):
-          thisPoint = record['heart_rate']
-        # If the current field is heart_rate, and we have a reference file, and we have at least two files:
-        if ((compare_value == 'heart_rate') and (len(fitfiles) >= 2) and (with_reference_file)):
-          # If this file is not the reference file
-          if (ffile != reference_file):
-            # Than we can compute the HR score, starting after one minute
-            hr_analyze = True
-            if ((i >= 60) and (record['heart_rate'] != None)):
-              # Current bpm
-              cur_bpm = record['heart_rate']
-              # Get the HR value of the reference file for this timestamp
-              average_hr_gap = bpm_new_point(cur_bpm, record['timestamp'], average_hr_gap, ff_data, reference_file, i)
+          # Special process
+
+          # If the current field is HR
+          if ((compare_value == 'heart_rate') and (record['heart_rate'] != None)):
+            thisPoint = record['heart_rate']
         
-        # If the current field is altitude
-        if (compare_value == 'altitude'):
-          if ((i == 1) or (start_alt == None)):
+          # If the current field is altitude
+          if (compare_value == 'altitude'):
+            if ((i == 1) or (start_alt == None)):
+              if (record['altitude'] != None):
+                start_alt = record['altitude']
+            if (i <= altitude_gap):
+              skipThisPoint = True
+            elif (record['altitude'] != None):
+              thisPoint = record['altitude']
             if (record['altitude'] != None):
-              start_alt = record['altitude']
-          if (i <= project_conf_altitude_gap):
-            skipThisPoint = True
-          elif (record['altitude'] != None):
-            thisPoint = record['altitude']
-          if (record['altitude'] != None):
-            end_alt = record['altitude']
-
-        # All other fields
-        if (record[compare_value] != None):
-          thisPoint = record[compare_value]
+              end_alt = record['altitude']
+
+          # All other fields
+          if (record[compare_value] != None):
+            thisPoint = record[compare_value]
         
-        # Record this point
-        if (skipThisPoint == False):
-          a_values.append(thisPoint)
-    # Get the ffile decode
-    legend = decodeFitName(ffile)
-    # Get the summary
-    summary = ff_summary[ffile]
+          # Record this point
+          if (skipThisPoint == False):
+            a_values.append(thisPoint)
+
+      # Get the ffile decode
+      legend = decodeFitName(ffile)
+      # Get the summary
+      summary = ff_summary[ffile]
     
-    # If we have altitude data, get the smoothed and normalized values
-    if ("altitude" in values_to_compare):
-      smoothed_altitude = smoothAltitude(ff_data[ffile])
-      normalized_alt_gain = normalizedAltGain(smoothed_altitude)
-      normalized_alt_loss = normalizedAltLoss(smoothed_altitude)
+      # If we have altitude data, get the smoothed and normalized values
+      if ("altitude" in values_to_compare):
+        smoothed_altitude = smoothAltitude(ff_data[ffile], altitude_gap)
+        normalized_alt_gain = normalizedAltGain(smoothed_altitude)
+        normalized_alt_loss = normalizedAltLoss(smoothed_altitude)
     
-    # Compute the HR score
-    if (hr_analyze):
-      hr_adv_data = adv_hr_sum(average_hr_gap)  
-      hr_max_pos.append(hr_adv_data['max_gap_position'])
+      # Get the score against the reference file (computed by the scoring engine)
+      score_summary = ''
+      if ((compare_value in field_scores) and (ffile in field_scores[compare_value])):
+        score_data = field_scores[compare_value][ffile]
+        score_summary = " Ecart moyen: %.2f - Ecart max: %.2f - Score: %.1f%%" % (score_data['average_gap'], score_data['max_gap'], score_data['score'])
+        if (compare_value == 'heart_rate'):
+          hr_max_pos.append(score_data['max_gap_position'])
+      # Score without the heart rate artifacts, and artifact segments to shade
+      if (compare_value == 'heart_rate'):
+        if (('heart_rate_clean' in field_scores) and (ffile in field_scores['heart_rate_clean'])):
+          score_summary += " - Score sans artefacts: %.1f%%" % (field_scores['heart_rate_clean'][ffile]['score'])
+        if (ffile in hr_artifact_classes):
+          artifact_segments.append([fitfiles.index(ffile), flagged_segments(hr_artifact_classes[ffile] > 0)])
     
-    if (compare_value == 'heart_rate'):
-      hr_summary = ''
-      if (hr_analyze):
-        hr_summary = " Ecart moyen: %.2f - Ecart max: %.2f - Score: %.1f%%" % (hr_adv_data['average_gap'], hr_adv_data['max_gap'], hr_adv_data['hr_score'])
-      chart_legend = legend[0] + " (mesure cardio: " + legend[1] + ")" + hr_summary
-    elif (compare_value == 'altitude'):
-      chart_legend = "%s (D+: %.1f / D-: %.1f / Altitude de départ: %.1f / Altitude d'arrivée: %.1f" % (legend[0], normalized_alt_gain, normalized_alt_loss, summary[17], summary[18])
-    elif (compare_value == 'distance'):
-      if (summary[5] == None):
-        summary[5] = 0
-      if (legend[3] != None):
-        chart_legend = "%s (Distance mesurée par: %s): %.2f m" % (legend[0], legend[3], summary[5])
-      else:
-        chart_legend = "%s: %.2f m" % (legend[0], summary[5])
+      if (compare_value == 'heart_rate'):
+        chart_legend = legend[0] + " (mesure cardio: " + legend[1] + ")" + score_summary
+      elif (compare_value == 'altitude'):
+        chart_legend = "%s (D+: %.1f / D-: %.1f / Altitude de départ: %.1f / Altitude d'arrivée: %.1f" % (legend[0], normalized_alt_gain, normalized_alt_loss, summary[17], summary[18]) + score_summary
+      elif (compare_value == 'distance'):
+        if (summary[5] == None):
+          summary[5] = 0
+        if (legend[3] != None):
+          chart_legend = "%s (Distance mesurée par: %s): %.2f m" % (legend[0], legend[3], summary[5]) + score_summary
+        else:
+          chart_legend = "%s: %.2f m" % (legend[0], summary[5]) + score_summary
     
-    # This part for the HRV graph
-    elif (compare_value == "hrv"):
-      hrvDelta = 0
-      chart_legend = "%s (%s)" % (legend[0], legend[1])
-      if ffile in hrvDelta_values: 
-        hrvDelta = hrvDelta_values[ffile]
-      # If the current file has a HRV parameter
-      if ffile in hrvCsv_values:
-        a_values = loadCsvHrv(hrvCsv_values[ffile], hrvDelta)
-      elif ffile in hrvSuunto_values:
-        a_values = loadSuuntoHrv(hrvSuunto_values[ffile], hrvDelta)
+      # This part for the HRV graph
+      elif (compare_value == "hrv"):
+        chart_legend = "%s (%s)" % (legend[0], legend[1])
+        a_values = loadHrv(ffile)
+        if (args.debug): print("[debug] Number of HRV points for %s: %i" % (ffile, len(a_values)))
+        # If we have 0 points, then rise error, it's not possible to go ahead with HRV...
+        if (len(a_values) == 0): 
+        	print("ERROR: No valid HRV data. Add a CSV or ensure HRV is correctly set in FIT file")
+        	break
+        if (shortest_hrv == 0) or (shortest_hrv > len(a_values)):
+          shortest_hrv = len(a_values)
       else:
-        a_values = loadFitHrv(ffile, hrvDelta)
-      if (args.debug): print("[debug] Number of HRV points for %s: %i" % (ffile, len(a_values)))
-      # If we have 0 points, then rise error, it's not possible to go ahead with HRV...
-      if (len(a_values) == 0): 
-      	print("ERROR: No valid HRV data. Add a CSV or ensure HRV is correctly set in FIT file")
-      	break
-      if (shortest_hrv == 0) or (shortest_hrv > len(a_values)):
-        shortest_hrv = len(a_values)
-    else:
-      chart_legend = "%s" % (legend[0])
-    # Get the lengh of datatable to align next values
-    graph_lengh = len(a_values)
-    # Add the dataset to chart
-    chartData[chart_legend] = a_values
-    # If altitude graph AND include smoothed altitude
-    if ((compare_value == 'altitude') and (project_conf_inc_smoothed_alt)):
-      lengh_diff = len(smoothed_altitude) - graph_lengh
-      smoothed_altitude_aligned = smoothed_altitude[lengh_diff:]
-      # Add smoothed alt data to chart
-      chartData['%s (smoothed altitude)' % (legend[0])] = smoothed_altitude_aligned
+        chart_legend = "%s" % (legend[0]) + score_summary
+      # Get the lengh of datatable to align next values
+      graph_lengh = len(a_values)
+      # Add the dataset to chart
+      chartData[chart_legend] = a_values
+      # If altitude graph AND include smoothed altitude
+      if ((compare_value == 'altitude') and (project_conf_inc_smoothed_alt)):
+        lengh_diff = len(smoothed_altitude) - graph_lengh
+        smoothed_altitude_aligned = smoothed_altitude[lengh_diff:]
+        # Add smoothed alt data to chart
+        chartData['%s (smoothed altitude)' % (legend[0])] = smoothed_altitude_aligned
       
-  # Check for HRV data lenght
-  if (compare_value == "hrv"):
-    i = 0
-    for line in chartData:
-      key, value = list(chartData.items())[i]
-      if len(value) > shortest_hrv: 
-        line = value[:shortest_hrv]
-        chartData[key] = line
-      i = i+1
+    # Altitude of the DEM along the track of the first file (same points as its altitude)
+    if ((compare_value == 'altitude') and (fitfiles[0] in dem_altitude)):
+      chartData["Altitude MNT (trace de %s)" % (decodeFitName(fitfiles[0])[0])] = dem_altitude[fitfiles[0]][altitude_gap:].tolist()
+
+    # Check for HRV data lenght
+    if (compare_value == "hrv"):
+      i = 0
+      for line in chartData:
+        key, value = list(chartData.items())[i]
+        if len(value) > shortest_hrv: 
+          line = value[:shortest_hrv]
+          chartData[key] = line
+        i = i+1
   
-  # Generate graph
-  generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, project_conf_align, chartTitle, hr_max_pos)
+    # Generate graph
+    generateGraph(APP_PATH, project_prefix, compare_value, chartData, args, project_conf_align, chartTitle, hr_max_pos, artifact_segments)
+    recordArtifact(graph_files, graph_fingerprint)
   
+
 # ###############################
 # Generate all the customs graphs
 # ###############################
-if (conf_has_custom_graphs):
+def generateCustomGraphs():
+  global ff_data, project_prefix, common_timestamp, common_timestamp_set, longest_ts_array, field_scores
   for cust_graph in project_conf['customGraphs']:
     chartData = {}
     chartData.clear()
     graph_name = cust_graph['name']
     chartTitle = graph_name
+    if (project_prefix != ''):
+      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_" + graph_name.lower().replace(" ", "")
+    else:
+      graph_file = APP_PATH + "pnggraphs/" + graph_name.lower().replace(" ", "")
+    # Skip the graph if it was already built with the same definition
+    graph_inputs = {'customGraph': cust_graph, 'scoring': [scoringInputs(cg_value['field']) for cg_value in cust_graph['values']]}
+    graph_fingerprint = artifactFingerprint(graph_inputs)
+    graph_files = graphArtifacts(graph_file)
+    if (artifactIsFresh(graph_files, graph_fingerprint)):
+      print("Custom graph %s is up to date, skipped" % (graph_name))
+      continue
     print("Generating custom graph: %s" % (graph_name))
     for cg_value in cust_graph['values']:
       a_values = []
       for record in ff_data[cg_value['file']]:
         # If we have a sync timestamps, check that this timestamp is in the list
-        if ((project_conf_align) and (record['timestamp'] in common_timestamp) or (project_conf_align == False)):
-          i += 1
+        if ((project_conf_align) and (record['timestamp'] in common_timestamp_set) or (project_conf_align == False)):
           a_values.append(record[cg_value['field']])
       legend = decodeFitName(cg_value['file'])
       chart_legend = "%s - %s" % (legend[0], cg_value['label'])
+      if ((cg_value['field'] in field_scores) and (cg_value['file'] in field_scores[cg_value['field']])):
+        chart_legend += " (Score: %.1f%%)" % (field_scores[cg_value['field']][cg_value['file']]['score'])
       chartData[chart_legend] = a_values
 
     # Generate the graph
     pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
-    if (project_prefix != ''):
-      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_" + graph_name.lower().replace(" ", "")
-    else:
-      graph_file = APP_PATH + "pnggraphs/" + graph_name.lower().replace(" ", "")
     # Create a Pandas DataSet for this graph
     chartDataFrame = pd.DataFrame(chartData)
     # If the CSV export is enabled
-    if (args.export):
+    if (args.export and (args.export_format == 'csv')):
       chartDataFrame.to_csv(graph_file + '.csv', sep=',', decimal='.')
     sns.set_theme(font='Montserrat')
     sns.set(rc = {'figure.figsize':(20, 10)})
@@ -1194,16 +2155,185 @@ if (conf_has_custom_graphs):
       max_nb_points = longest_ts_array
     thisPlot, thisAx = sns.lineplot(x=None, y=None, data=chartDataFrame, linewidth=1, dashes=False).set(title=chartTitle, xlim=(-5,max_nb_points+5))
     plt.grid(True)
-    
+  
     plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
     plt.clf()
-    
-    
+    recordArtifact(graph_files, graph_fingerprint)
+
+# ###############################
+# GNSS accuracy analysis
+# ###############################
+def generateGnssAccuracy(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global project_conf_gnss_accuracy_graph
+
+  print("Generating GNSS accuracy analysis")
+  # Project all the tracks to a local metric frame centered on the reference track
+  start_ts = ff_data[reference_file][0]['timestamp']
+  ref_time, ref_lat, ref_long = extractPositions(ff_data[reference_file], start_ts)
+  if (len(ref_lat) < 2):
+    print("WARNING: The reference file %s has no GPS data, GNSS accuracy analysis skipped" % (reference_file))
+    return
+  lat0 = float(np.mean(ref_lat))
+  long0 = float(np.mean(ref_long))
+  ref_xy = local_metric_projection(ref_lat, ref_long, lat0, long0)
+
+  device_errors = {}
+  device_times = {}
+  mode_errors = {}
+  for ffile in fitfiles:
+    if (ffile == reference_file):
+      continue
+    dev_time, dev_lat, dev_long = extractPositions(ff_data[ffile], start_ts)
+    if (len(dev_lat) == 0):
+      if (args.debug): print("[debug] File %s has no GPS data, skipped from GNSS accuracy" % (ffile))
+      continue
+    device_errors[ffile] = cross_track_error(ref_xy, local_metric_projection(dev_lat, dev_long, lat0, long0))
+    device_times[ffile] = dev_time
+    gnss_mode = decodeFitName(ffile)[2]
+    if (gnss_mode not in mode_errors):
+      mode_errors[gnss_mode] = []
+    mode_errors[gnss_mode].append(device_errors[ffile])
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" GNSS ACCURACY (cross-track error against %s, m)\n" % (os.path.basename(reference_file)))
+  textSection.append("-------------------------------------------------------------------------\n")
+  for ffile in device_errors:
+    dist = error_distribution(device_errors[ffile])
+    textSection.append(" %s\n" % (decodeFitName(ffile)[0]))
+    textSection.append("   Points / median / p95 / max:  %i / %.2f / %.2f / %.2f\n" % (dist['points'], dist['median'], dist['p95'], dist['max']))
+  textSection.append("-------------------------------------------------------------------------\n")
+  for gnss_mode in mode_errors:
+    dist = error_distribution(np.concatenate(mode_errors[gnss_mode]))
+    textSection.append(" GNSS Mode: %s\n" % (gnss_mode))
+    textSection.append("   Points / median / p95 / max:  %i / %.2f / %.2f / %.2f\n" % (dist['points'], dist['median'], dist['p95'], dist['max']))
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Graph of the cross-track error over time
+  if (project_conf_gnss_accuracy_graph and (len(device_errors) > 0)):
+    pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+    if (project_prefix != ''):
+      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_gnss_accuracy"
+    else:
+      graph_file = APP_PATH + "pnggraphs/gnss_accuracy"
+    graph_fingerprint = artifactFingerprint({'graph': 'gnss_accuracy'})
+    if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+      print("Graph of the GNSS accuracy is up to date, skipped")
+      return
+    sns.set_theme(font='Montserrat')
+    sns.set(rc = {'figure.figsize':(20, 10)})
+    for ffile in device_errors:
+      plt.plot(device_times[ffile], device_errors[ffile], linewidth=1, label=decodeFitName(ffile)[0])
+    plt.title("Analyse de la précision GNSS (écart à la trace de référence, m)")
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+    plt.clf()
+    recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# ###############################
+# GNSS distance and speed
+# ###############################
+def generateGnssDistance(fitfiles, ff_data, project_prefix, APP_PATH):
+  global project_conf_gnss_distance_graph
+
+  print("Generating GNSS distance analysis")
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" GNSS DISTANCE (distance of the GNSS track against the distance reported by the device)\n")
+  discrepancies = {}
+  speeds = {}
+  for ffile in fitfiles:
+    if (len(ff_data[ffile]) < 2):
+      continue
+    start_ts = ff_data[ffile][0]['timestamp']
+    pos_time, pos_lat, pos_long = extractPositions(ff_data[ffile], start_ts)
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" %s\n" % (decodeFitName(ffile)[0]))
+    if (len(pos_lat) < 2):
+      textSection.append("   No GPS data\n")
+      continue
+    # Cumulative distance of the complete track (with the sub-second points), and of the first point of each second only
+    gnss_distance = track_distance(pos_lat, pos_long)
+    full_seconds = (pos_time == np.floor(pos_time))
+    gnss_distance_1hz = track_distance(pos_lat[full_seconds], pos_long[full_seconds])
+    # Reported values at the record times
+    record_time = np.array([(point['timestamp'] - start_ts).total_seconds() for point in ff_data[ffile]])
+    reported_distance = dataColumn(ff_data[ffile], 'distance')
+    reported_speed = dataColumn(ff_data[ffile], 'speed')
+    # GNSS distance and speed at the record times
+    gnss_record_distance = np.interp(record_time, pos_time, gnss_distance)
+    gnss_record_speed = np.gradient(gnss_record_distance, record_time)
+
+    textSection.append("   GNSS points (sub-second):     %i (%i)\n" % (len(pos_lat), len(pos_lat) - np.count_nonzero(full_seconds)))
+    textSection.append("   GNSS distance:                %.2f m\n" % (gnss_distance[-1]))
+    if (np.count_nonzero(full_seconds) < len(pos_lat)):
+      textSection.append("   GNSS distance (1 point/s):    %.2f m\n" % (gnss_distance_1hz[-1]))
+    valid_distance = ~np.isnan(reported_distance)
+    if (np.count_nonzero(valid_distance) > 0):
+      # Distance covered in the window, on both sides
+      reported_cumulative = reported_distance - reported_distance[valid_distance][0]
+      gnss_cumulative = gnss_record_distance - gnss_record_distance[valid_distance][0]
+      discrepancies[ffile] = [record_time, gnss_cumulative - reported_cumulative]
+      reported_total = reported_cumulative[valid_distance][-1]
+      gnss_total = gnss_cumulative[valid_distance][-1]
+      textSection.append("   Reported distance:            %.2f m\n" % (reported_total))
+      if (reported_total > 0):
+        textSection.append("   GNSS - reported:              %+.2f m (%+.2f%%)\n" % (gnss_total - reported_total, (gnss_total - reported_total) / reported_total * 100))
+      textSection.append("   Max discrepancy over time:    %.2f m\n" % (np.nanmax(np.abs(discrepancies[ffile][1]))))
+    valid_speed = ~np.isnan(reported_speed)
+    if (np.count_nonzero(valid_speed) > 0):
+      speeds[ffile] = [record_time, reported_speed, gnss_record_speed]
+      speed_diff = gnss_record_speed[valid_speed] - reported_speed[valid_speed]
+      textSection.append("   Speed GNSS - reported:        bias %+.3f m/s - mean abs. %.3f m/s\n" % (np.mean(speed_diff), np.mean(np.abs(speed_diff))))
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Graph of the distance discrepancy and of the speeds over time
+  if (project_conf_gnss_distance_graph and ((len(discrepancies) > 0) or (len(speeds) > 0))):
+    pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+    if (project_prefix != ''):
+      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_gnss_distance"
+    else:
+      graph_file = APP_PATH + "pnggraphs/gnss_distance"
+    graph_fingerprint = artifactFingerprint({'graph': 'gnss_distance'})
+    if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+      print("Graph of the GNSS distance is up to date, skipped")
+      return
+    sns.set_theme(font='Montserrat')
+    sns.set(rc = {'figure.figsize':(20, 10)})
+    fig, (ax_distance, ax_speed) = plt.subplots(2, 1, sharex=True)
+    for ffile in discrepancies:
+      ax_distance.plot(discrepancies[ffile][0], discrepancies[ffile][1], linewidth=1, label=decodeFitName(ffile)[0])
+    ax_distance.set_title("Distance de la trace GNSS - distance mesurée (m)")
+    ax_distance.legend()
+    for ffile in speeds:
+      line = ax_speed.plot(speeds[ffile][0], speeds[ffile][1], linewidth=1, label="%s (mesurée)" % (decodeFitName(ffile)[0]))
+      ax_speed.plot(speeds[ffile][0], speeds[ffile][2], linewidth=1, linestyle='dotted', color=line[0].get_color(), label="%s (GNSS)" % (decodeFitName(ffile)[0]))
+    ax_speed.set_title("Vitesse mesurée et vitesse de la trace GNSS (m/s)")
+    ax_speed.legend()
+    plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+    plt.close(fig)
+    recordArtifact([graph_file + '.png'], graph_fingerprint)
+
 # Generate a GPS MAP
 def generateMapboxMap(fitfiles, ff_data, project_prefix, MAPBOX_API_KEY, project_conf_map_style, ff_summary, APP_PATH):
 
+  if (project_prefix != ''):
+    map_file = APP_PATH + "map/" + project_prefix + "_" + 'map.html'
+  else:
+    map_file = APP_PATH + "map/" + 'map.html'
+  # Skip the map if it was already built with the same style
+  map_fingerprint = artifactFingerprint({'map': [project_conf_map_style, MAPBOX_API_KEY]})
+  if (artifactIsFresh([map_file], map_fingerprint)):
+    print("Map is up to date, skipped")
+    return
+
   print("Generating map")
   gpx_data = {}
+  start_lat = 0
+  start_long = 0
   gpx_colors = ['#0000ff', '#ff0000', '#00ff00', '#bf00ff', '#6e6e6e', '#D7DF01', '#A9BCF5', '#A9F5A9', '#F5A9A9', '#000000', '#01DFD7', '#F5A9E1', '#FF8000', '#08088A']
   for ffile in fitfiles:
     gpx_data[ffile] = []
@@ -1218,14 +2348,12 @@ def generateMapboxMap(fitfiles, ff_data, project_prefix, MAPBOX_API_KEY, project
       # It's a standard point
       elif ((point['position'][0]['long'] != None) and (point['position'][0]['lat'] != None)):
         gpx_data[ffile].append([point['position'][0]['long'] * (180/pow(2,31)), point['position'][0]['lat'] * (180/pow(2,31))])
-    start_lat = ff_summary[ffile][15]
-    start_long = ff_summary[ffile][16]
+    # Center the map on a file with GPS data
+    if (ff_summary[ffile][21]):
+      start_lat = ff_summary[ffile][15]
+      start_long = ff_summary[ffile][16]
 
   pathlib.Path(APP_PATH + "map").mkdir(exist_ok=True)
-  if (project_prefix != ''):
-    map_file = APP_PATH + "map/" + project_prefix + "_" + 'map.html'
-  else:
-    map_file = APP_PATH + "map/" + 'map.html'
 
   fmap = open(map_file, "w")
   fmap.write('<html lang="en">\n')
@@ -1310,40 +2438,1267 @@ def generateMapboxMap(fitfiles, ff_data, project_prefix, MAPBOX_API_KEY, project
 
   fmap.write('</script>')
   fmap.close()
+  recordArtifact([map_file], map_fingerprint)
+
+# ###############################
+# Scoring engine
+# ###############################
+# This function scores all the fields of graphs / customGraphs with a scoring configuration (and heart_rate) against the reference
+# Each field is scored for all the devices in one vectorized pass over the aligned columns
+def computeScores(fitfiles, ff_data, reference_file):
+  global field_scores, field_gap_series, values_to_compare, hr_artifact_classes
+
+  field_scores = {}
+  field_gap_series = {}
+  scored_files = [ffile for ffile in fitfiles if ffile != reference_file]
+  # heart_rate and the fields of graphs with a scoring section (the default score curve is the one of the heart rate)
+  # The fields of customGraphs belong to a single file, they are not scored across the devices
+  scored_fields = [score_field for score_field in scoring_conf if ((score_field in values_to_compare) and (score_field != 'hrv'))]
+  for score_field in scored_fields:
+    gap_params, curve_params = scoringParams(score_field)
+    try:
+      columns = fieldColumns(scored_files + [reference_file], score_field, gap_params['zeroIsMissing'])
+    except (TypeError, ValueError):
+      print("WARNING: Field %s is not numeric, not scored" % (score_field))
+      continue
+    gaps = field_gaps(columns[:-1], columns[-1], gap_params['latency'], gap_params['start'], gap_params['metric'])
+    field_gap_list = [[score_field, gaps]]
+    # The heart rate is also scored without the points with an artifact on the device or on the reference
+    if ((score_field == 'heart_rate') and (len(hr_artifact_classes) > 0)):
+      artifact_mask = np.vstack([hr_artifact_classes[ffile][:columns.shape[1]] for ffile in scored_files + [reference_file]]) > 0
+      clean_gaps = gaps.copy()
+      clean_gaps[artifact_mask[:-1] | artifact_mask[-1][None, :]] = np.nan
+      field_gap_list.append(['heart_rate_clean', clean_gaps])
+    for field_gap in field_gap_list:
+      scores = score_fields(field_gap[1], curve_params)
+      field_scores[field_gap[0]] = {}
+      field_gap_series[field_gap[0]] = {}
+      i = 0
+      for ffile in scored_files:
+        # Nothing to score if the file does not have this field
+        if (scores['points'][i] > 0):
+          field_scores[field_gap[0]][ffile] = {}
+          for score_value in scores:
+            field_scores[field_gap[0]][ffile][score_value] = scores[score_value][i]
+          field_gap_series[field_gap[0]][ffile] = field_gap[1][i]
+        i += 1
 
-# Generate Mapbox map if map is enabled
-if (project_conf_map):
-  generateMapboxMap(fitfiles, ff_data, project_prefix, MAPBOX_API_KEY, project_conf_map_style, ff_summary, APP_PATH)
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" SCORES (against %s)\n" % (os.path.basename(reference_file)))
+  for score_field in field_scores:
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Field: %s\n" % (score_field))
+    for ffile in field_scores[score_field]:
+      score_data = field_scores[score_field][ffile]
+      textSection.append("   %-28s Ecart moyen: %.2f - Ecart max: %.2f - Score: %.1f%%\n" % (decodeFitName(ffile)[0], score_data['average_gap'], score_data['max_gap'], score_data['score']))
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+# ###############################
+# Heart rate artifacts
+# ###############################
+
+# This function detects the heart rate artifacts of each device on the aligned data (dropouts, spikes, steep slopes, flat lines)
+# Input:
+# - fitfiles / ff_data: files and aligned data
+# Output:
+# - the global hr_artifact_classes (file -> class of each point) is set, and a section is added to the logfile
+def detectHrArtifacts(fitfiles, ff_data):
+  global hr_artifact_classes, hr_artifact_conf
+
+  hr_artifact_classes = {}
+  columns = fieldColumns(fitfiles, 'heart_rate', True)
+  filled = np.nan_to_num(fieldColumns(fitfiles, 'heart_rate_filled')) > 0
+  # The window and the flat line are in seconds and the slope is per second, converted to points of the aligned data
+  artifact_params = dict(hr_artifact_conf)
+  artifact_params['window'] = max(3, secondsToPoints(hr_artifact_conf['window']))
+  artifact_params['flatline'] = max(2, secondsToPoints(hr_artifact_conf['flatline']))
+  artifact_params['maxSlope'] = hr_artifact_conf['maxSlope'] / pointsPerSecond()
+  classes = hr_artifacts(columns, filled, **artifact_params)
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" HEART RATE ARTIFACTS\n")
+  textSection.append(" %-28s %8s %8s %8s %8s %8s %8s %9s\n" % ("Device", "Dropout", "Spike", "Slope", "Flatline", "Total", "%", "Segments"))
+  i = 0
+  for ffile in fitfiles:
+    hr_artifact_classes[ffile] = classes[i]
+    class_counts = np.bincount(classes[i], minlength=len(HR_ARTIFACT_CLASSES))
+    nb_artifacts = int(class_counts[1:].sum())
+    artifact_percent = (nb_artifacts * 100 / len(classes[i])) if (len(classes[i]) > 0) else 0
+    textSection.append(" %-28s %8i %8i %8i %8i %8i %7.1f%% %9i\n" % (decodeFitName(ffile)[0], class_counts[1], class_counts[2], class_counts[3], class_counts[4],
+                                                                   nb_artifacts, artifact_percent, len(flagged_segments(classes[i] > 0))))
+    i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
 
-# Generate an example config file
-# Get all sessions if more than 1
-sessions = []
-times = {}
-all_sessions = loadFitSession(fitfiles[0], ff_summary[fitfiles[0]])
-if (len(all_sessions) > 1):
+# ###############################
+# DEM altitude
+# ###############################
+
+# This function returns the position of each point of a file in degrees (NaN if no position, first position of the 5hz points)
+def positionColumns(file_data):
+  lat = np.full(len(file_data), np.nan)
+  long = np.full(len(file_data), np.nan)
+  i = 0
+  for point in file_data:
+    if (point.get('position') != None):
+      point_lat = point['position'][0]['lat']
+      point_long = point['position'][0]['long']
+      if (isinstance(point_long, (tuple, list))):
+        sub_points = [sub_point for sub_point in zip(point_lat, point_long) if ((sub_point[0] is not None) and (sub_point[1] is not None))]
+        point_lat, point_long = sub_points[0] if (len(sub_points) > 0) else (None, None)
+      if ((point_lat != None) and (point_long != None)):
+        lat[i] = point_lat
+        long[i] = point_long
+    i += 1
+  return lat * (180/pow(2,31)), long * (180/pow(2,31))
+
+# This function samples the DEM altitude at the positions of each device, and compares the altitude of the devices to it
+# Input:
+# - fitfiles / ff_data: files and aligned data
+# Output:
+# - the global dem_altitude (file -> DEM altitude at each point of the file) is set, and a section is added to the logfile
+def generateDemAltitude(fitfiles, ff_data):
+  global dem_altitude, project_conf_dem_directory
+
+  dem_altitude = {}
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" DEM ALTITUDE ERROR (device altitude - DEM altitude at the device positions, tiles of %s)\n" % (project_conf_dem_directory))
+  textSection.append("-------------------------------------------------------------------------\n")
+  textSection.append("   %-28s %8s %8s %8s %8s %18s\n" % ("Device", "Points", "Bias", "MAE", "RMSE", "LoA"))
+  for ffile in fitfiles:
+    lat, long = positionColumns(ff_data[ffile])
+    dem_altitude[ffile] = dem_elevation(APP_PATH + project_conf_dem_directory, lat, long)
+    device_altitude = dataColumn(ff_data[ffile], 'altitude')
+    valid = ~np.isnan(device_altitude) & ~np.isnan(dem_altitude[ffile])
+    if (np.count_nonzero(valid) < 2):
+      textSection.append("   %-28s %8i (no DEM tile or no position)\n" % (decodeFitName(ffile)[0], np.count_nonzero(valid)))
+      continue
+    statistics = agreement_statistics(device_altitude[valid], dem_altitude[ffile][valid])
+    textSection.append("   %-28s %8i %8.2f %8.2f %8.2f %8.2f / %7.2f\n" % (decodeFitName(ffile)[0], np.count_nonzero(valid), statistics['bias'], statistics['mae'], statistics['rmse'], statistics['loa_low'], statistics['loa_high']))
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+# ###############################
+# Agreement statistics
+# ###############################
+
+# This function computes the agreement statistics of each device against the reference file for all the fields of graphs / customGraphs
+# Bias, limits of agreement, MAE, RMSE and Lin's CCC, with block bootstrap confidence intervals, and a Bland-Altman plot for each field
+def generateAgreementStats(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global values_to_compare, custom_graphs_values, project_conf_bootstrap_resamples, project_conf_bootstrap_block
+
+  compared_files = [ffile for ffile in fitfiles if ffile != reference_file]
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" AGREEMENT STATISTICS (against %s)\n" % (os.path.basename(reference_file)))
+  textSection.append(" 95%% confidence intervals: block bootstrap, %i resamples, blocks of %i points\n" % (project_conf_bootstrap_resamples, project_conf_bootstrap_block))
+  stats_fields = []
+  for field in values_to_compare + custom_graphs_values:
+    if ((field != 'hrv') and (field not in stats_fields)):
+      stats_fields.append(field)
+  for stats_field in stats_fields:
+    gap_params, curve_params = scoringParams(stats_field)
+    try:
+      columns = fieldColumns(compared_files + [reference_file], stats_field, gap_params['zeroIsMissing'])
+    except (TypeError, ValueError):
+      print("WARNING: Field %s is not numeric, no agreement statistics" % (stats_field))
+      continue
+    # The ignored points at the beginning are not analyzed (same as the score)
+    columns[:, :gap_params['start']] = np.nan
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Field: %s\n" % (stats_field))
+    textSection.append(" %-20s %7s %22s %22s %22s %22s %22s %22s\n" % ("Device", "Points", "Bias", "LoA low", "LoA high", "MAE", "RMSE", "CCC"))
+    bland_altman = []
+    i = 0
+    for ffile in compared_files:
+      paired = ~np.isnan(columns[i]) & ~np.isnan(columns[-1])
+      device_values = columns[i][paired]
+      ref_values = columns[-1][paired]
+      i += 1
+      if (len(device_values) < 2):
+        continue
+      statistics = agreement_statistics(device_values, ref_values)
+      intervals = block_bootstrap(device_values, ref_values, project_conf_bootstrap_resamples, project_conf_bootstrap_block)
+      statistics_text = ["%7.2f [%6.2f,%6.2f]" % (statistics[statistic], intervals[statistic][0], intervals[statistic][1]) for statistic in ['bias', 'loa_low', 'loa_high', 'mae', 'rmse']]
+      statistics_text.append("%7.3f [%6.3f,%6.3f]" % (statistics['ccc'], intervals['ccc'][0], intervals['ccc'][1]))
+      textSection.append(" %-20s %7i %s\n" % (decodeFitName(ffile)[0], len(device_values), " ".join(statistics_text)))
+      bland_altman.append([ffile, (device_values + ref_values) / 2, device_values - ref_values, statistics])
+
+    # Bland-Altman plot of the field, one subplot for each device
+    if (len(bland_altman) == 0):
+      continue
+    if (project_prefix != ''):
+      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_bland_altman_" + stats_field.lower()
+    else:
+      graph_file = APP_PATH + "pnggraphs/bland_altman_" + stats_field.lower()
+    graph_fingerprint = artifactFingerprint({'blandAltman': stats_field, 'scoring': scoringInputs(stats_field)})
+    if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+      print("Bland-Altman plot for %s is up to date, skipped" % (stats_field))
+      continue
+    print("Generating Bland-Altman plot for %s" % (stats_field))
+    pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+    sns.set_theme(font='Montserrat')
+    sns.set(rc = {'figure.figsize':(20, 10)})
+    fig, ba_axes = plt.subplots(1, len(bland_altman), squeeze=False, sharey=True)
+    ax_idx = 0
+    for ba_data in bland_altman:
+      ba_ax = ba_axes[0][ax_idx]
+      ba_ax.scatter(ba_data[1], ba_data[2], s=4, alpha=0.3)
+      ba_ax.axhline(ba_data[3]['bias'], color='black', linewidth=1, label="Biais: %.2f" % (ba_data[3]['bias']))
+      ba_ax.axhline(ba_data[3]['loa_low'], color='gray', linewidth=1, linestyle='dashed', label="Limites d'agrément: %.2f / %.2f" % (ba_data[3]['loa_low'], ba_data[3]['loa_high']))
+      ba_ax.axhline(ba_data[3]['loa_high'], color='gray', linewidth=1, linestyle='dashed')
+      ba_ax.set_title(decodeFitName(ba_data[0])[0])
+      ba_ax.set_xlabel("Moyenne appareil / référence")
+      ba_ax.legend()
+      ax_idx += 1
+    ba_axes[0][0].set_ylabel("Différence appareil - référence")
+    fig.suptitle("Bland-Altman \"%s\"" % (stats_field))
+    plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+    plt.close(fig)
+    recordArtifact([graph_file + '.png'], graph_fingerprint)
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+# ###############################
+# Rolling agreement
+# ###############################
+
+# This function computes the rolling bias and MAE of each device against the reference file for all the fields of graphs / customGraphs
+# The worst windows (highest MAE) are listed in the logfile and the rolling series are drawn in a graph (one subplot for each field)
+def generateRollingAgreement(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global values_to_compare, custom_graphs_values, ff_summary, project_conf_rolling_window, project_conf_rolling_worst
+
+  compared_files = [ffile for ffile in fitfiles if ffile != reference_file]
+  rolling_fields = []
+  for field in values_to_compare + custom_graphs_values:
+    if ((field != 'hrv') and (field not in rolling_fields)):
+      rolling_fields.append(field)
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" ROLLING AGREEMENT (against %s, windows of %s s)\n" % (os.path.basename(reference_file), project_conf_rolling_window))
+  rolling_series = {}
+  rolling_points = max(1, secondsToPoints(project_conf_rolling_window))
+  for rolling_field in rolling_fields:
+    gap_params, curve_params = scoringParams(rolling_field)
+    try:
+      columns = fieldColumns(compared_files + [reference_file], rolling_field, gap_params['zeroIsMissing'])
+    except (TypeError, ValueError):
+      print("WARNING: Field %s is not numeric, no rolling agreement" % (rolling_field))
+      continue
+    diff = columns[:-1] - columns[-1][None, :]
+    diff[:, :gap_params['start']] = np.nan
+    rolling_series[rolling_field] = rolling_agreement(diff, rolling_points)
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Field: %s - worst windows (MAE)\n" % (rolling_field))
+    i = 0
+    for ffile in compared_files:
+      for worst_window in worst_windows(rolling_series[rolling_field]['mae'][i], rolling_points, project_conf_rolling_worst):
+        window_start = datetime.timedelta(seconds=int((ff_data[reference_file][worst_window[0]]['timestamp'] - ff_summary[reference_file][4]).total_seconds()))
+        window_end = datetime.timedelta(seconds=int((ff_data[reference_file][worst_window[1]]['timestamp'] - ff_summary[reference_file][4]).total_seconds()))
+        textSection.append("   %-28s points %5i - %5i (%s - %s): MAE %.2f - Biais %.2f\n" % (decodeFitName(ffile)[0], worst_window[0], worst_window[1], window_start, window_end,
+                                                                                             worst_window[2], rolling_series[rolling_field]['bias'][i][worst_window[1]]))
+      i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Graph of the rolling MAE (solid) and bias (dotted) of each device, one subplot for each field
+  if (len(rolling_series) == 0):
+    return
+  if (project_prefix != ''):
+    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_rolling_agreement"
+  else:
+    graph_file = APP_PATH + "pnggraphs/rolling_agreement"
+  graph_fingerprint = artifactFingerprint({'graph': 'rolling_agreement', 'window': project_conf_rolling_window, 'scoring': [scoringInputs(field) for field in rolling_series]})
+  if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+    print("Rolling agreement graph is up to date, skipped")
+    return
+  print("Generating rolling agreement graph")
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  sns.set_theme(font='Montserrat')
+  sns.set(rc = {'figure.figsize':(20, 10)})
+  fig, rolling_axes = plt.subplots(len(rolling_series), 1, sharex=True, squeeze=False, figsize=(20, 4 * len(rolling_series)))
+  ax_idx = 0
+  for rolling_field in rolling_series:
+    rolling_ax = rolling_axes[ax_idx][0]
+    i = 0
+    for ffile in compared_files:
+      line = rolling_ax.plot(rolling_series[rolling_field]['mae'][i], linewidth=1, label="%s (écart moyen absolu)" % (decodeFitName(ffile)[0]))
+      rolling_ax.plot(rolling_series[rolling_field]['bias'][i], linewidth=1, linestyle='dotted', color=line[0].get_color(), label="%s (biais)" % (decodeFitName(ffile)[0]))
+      i += 1
+    rolling_ax.axhline(0, color='gray', linewidth=1)
+    rolling_ax.set_title("Concordance glissante \"%s\" (fenêtre de %s s)" % (rolling_field, project_conf_rolling_window))
+    rolling_ax.legend()
+    ax_idx += 1
+  plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+  plt.close(fig)
+  recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# ###############################
+# HRV spectrum
+# ###############################
+
+# This function computes the LF, HF and LF/HF time series of each device from its RR series, and compares them to the reference file
+# Input:
+# - fitfiles: files (the RR series are loaded from their HRV source)
+# - reference_file: reference file (None: no comparison)
+# Output:
+# - a section is added to the logfile and a graph is generated for LF, HF and LF/HF (time of the windows in seconds from the first beat)
+def generateHrvSpectrum(fitfiles, reference_file, project_prefix, APP_PATH):
+  global project_conf_hrv_spectrum_window, project_conf_hrv_spectrum_step
+  spectrum_graphs = {'hrv_lf': "Analyse HRV: puissance LF (ms²)", 'hrv_hf': "Analyse HRV: puissance HF (ms²)", 'hrv_lf_hf': "Analyse HRV: ratio LF/HF"}
+  spectrum_bands = {'hrv_lf': 'lf', 'hrv_hf': 'hf', 'hrv_lf_hf': 'lf_hf'}
+
+  print("Generating HRV spectrum")
+  spectra = {}
+  for ffile in fitfiles:
+    spectrum = hrv_spectrum(rr_resample(loadHrv(ffile)), HRV_RESAMPLE_RATE, project_conf_hrv_spectrum_window, project_conf_hrv_spectrum_step)
+    if (len(spectrum['time']) == 0):
+      print("WARNING: Not enough HRV data for the spectrum of %s, skipped" % (ffile))
+      continue
+    spectra[ffile] = spectrum
+  if (len(spectra) == 0):
+    return
+  if (reference_file not in spectra):
+    reference_file = None
+
+  # Agreement of each band against the reference, on the windows of both series
+  band_statistics = {}
+  if (reference_file != None):
+    for ffile in spectra:
+      if (ffile == reference_file):
+        continue
+      band_statistics[ffile] = {}
+      nb_windows = min(len(spectra[ffile]['time']), len(spectra[reference_file]['time']))
+      for band in spectrum_bands.values():
+        device_values = spectra[ffile][band][:nb_windows]
+        ref_values = spectra[reference_file][band][:nb_windows]
+        valid = ~np.isnan(device_values) & ~np.isnan(ref_values)
+        if (np.count_nonzero(valid) >= 2):
+          band_statistics[ffile][band] = agreement_statistics(device_values[valid], ref_values[valid])
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" HRV SPECTRUM (windows of %i s every %i s, LF %.2f-%.2f Hz, HF %.2f-%.2f Hz)\n" % (project_conf_hrv_spectrum_window, project_conf_hrv_spectrum_step,
+                                                                                                 HRV_BANDS['lf'][0], HRV_BANDS['lf'][1], HRV_BANDS['hf'][0], HRV_BANDS['hf'][1]))
+  if (reference_file != None):
+    textSection.append(" Agreement against %s: bias / CCC\n" % (os.path.basename(reference_file)))
+  textSection.append("-------------------------------------------------------------------------\n")
+  textSection.append("   %-28s %8s %10s %10s %8s\n" % ("Device", "Windows", "LF (ms²)", "HF (ms²)", "LF/HF"))
+  for ffile in spectra:
+    textSection.append("   %-28s %8i %10.1f %10.1f %8.2f\n" % (decodeFitName(ffile)[0], len(spectra[ffile]['time']), np.nanmedian(spectra[ffile]['lf']),
+                                                           np.nanmedian(spectra[ffile]['hf']), np.nanmedian(spectra[ffile]['lf_hf'])))
+    if (ffile in band_statistics):
+      statistics_text = []
+      for band in spectrum_bands.values():
+        if (band in band_statistics[ffile]):
+          statistics_text.append("%s %.2f / %.3f" % (band.upper().replace('_', '/'), band_statistics[ffile][band]['bias'], band_statistics[ffile][band]['ccc']))
+      textSection.append("     %s\n" % (" - ".join(statistics_text)))
+  textSection.append(" (median of the windows)\n")
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # One graph for each band, with the plotting pipeline of the comparison graphs
+  graph_fingerprint = artifactFingerprint({'graph': 'hrv_spectrum', 'hrv': hrvInputs(fitfiles), 'spectrum': [project_conf_hrv_spectrum_window, project_conf_hrv_spectrum_step], 'reference': reference_file})
+  graph_files = []
+  for spectrum_graph in spectrum_graphs:
+    graph_files += graphArtifacts(compareGraphFile(APP_PATH, project_prefix, spectrum_graph))
+  if (artifactIsFresh(graph_files, graph_fingerprint)):
+    print("Graphs of the HRV spectrum are up to date, skipped")
+    return
+  x_max = max([spectra[ffile]['time'][-1] for ffile in spectra])
+  for spectrum_graph in spectrum_graphs:
+    band = spectrum_bands[spectrum_graph]
+    chartData = {}
+    for ffile in spectra:
+      legend = decodeFitName(ffile)
+      chart_legend = "%s (%s)" % (legend[0], legend[1])
+      if ((ffile in band_statistics) and (band in band_statistics[ffile])):
+        chart_legend += " Biais: %.2f - CCC: %.3f" % (band_statistics[ffile][band]['bias'], band_statistics[ffile][band]['ccc'])
+      chartData[chart_legend] = pd.Series(spectra[ffile][band], index=spectra[ffile]['time'])
+    generateGraph(APP_PATH, project_prefix, spectrum_graph, chartData, args, project_conf_align, spectrum_graphs[spectrum_graph], [], x_max=x_max)
+  recordArtifact(graph_files, graph_fingerprint)
+
+# ###############################
+# Power analysis
+# ###############################
+
+# Durations (s) of the mean-maximal power listed in the logfile
+POWER_CURVE_DURATIONS = [5, 60, 300, 1200, 3600]
+
+# This function computes the rolling power, normalized power and mean-maximal power curve of each device, and their gaps against the reference file
+# All the values are cumulative sums and sliding windows over the aligned power columns
+# Input:
+# - fitfiles / ff_data: files and aligned data
+# - reference_file: reference file (None: no gaps)
+# Output:
+# - a section is added to the logfile and a graph of the rolling power and of the mean-maximal power curves is generated
+def generatePowerAnalysis(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global project_conf_align, project_conf_resample_rate, project_conf_power_windows
+
+  if (project_conf_align == 'distance'):
+    print("NOTICE: The power analysis needs time aligned data, skipped with align: distance")
+    return
+  try:
+    columns = fieldColumns(fitfiles, 'power')
+  except (TypeError, ValueError):
+    print("WARNING: Field power is not numeric, no power analysis")
+    return
+  print("Generating power analysis")
+  # The windows are in seconds, the points of the aligned data are at 1 Hz (or at the resample rate)
+  points_per_second = pointsPerSecond()
+  rolling_power = {}
+  for power_window in project_conf_power_windows:
+    rolling_power[power_window] = rolling_mean(columns, max(1, int(round(power_window * points_per_second))))
+  np_values = normalized_power(columns, max(1, int(round(30 * points_per_second))))
+  curve_points = [int(round(duration * points_per_second)) for duration in POWER_CURVE_DURATIONS]
+  durations = np.union1d(curve_durations(columns.shape[1]), [points for points in curve_points if (0 < points <= columns.shape[1])]).astype(int)
+  power_curve = mean_maximal(columns, durations)
+  ref_idx = fitfiles.index(reference_file) if (reference_file != None) else None
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" POWER ANALYSIS (rolling power of %s s)\n" % (" / ".join([str(power_window) for power_window in project_conf_power_windows])))
+  textSection.append("-------------------------------------------------------------------------\n")
+  textSection.append("   %-28s %8s %8s" % ("Device", "Average", "NP"))
+  for duration in POWER_CURVE_DURATIONS:
+    textSection.append(" %10s" % ("MMP %s" % (formatDuration(duration))))
+  textSection.append("\n")
+  i = 0
+  for ffile in fitfiles:
+    textSection.append("   %-28s %8s %8s" % (decodeFitName(ffile)[0], formatStat(np.nanmean(columns[i]) if (not np.isnan(columns[i]).all()) else np.nan, "%.1f"), formatStat(np_values[i], "%.1f")))
+    for points in curve_points:
+      curve_value = power_curve[i][np.searchsorted(durations, points)] if (points in durations) else np.nan
+      textSection.append(" %10s" % (formatStat(curve_value, "%.1f")))
+    textSection.append("\n")
+    i += 1
+
+  # Gaps of the rolling power (bias / MAE), of the normalized power and of the power curve (%) against the reference file
+  rolling_gaps = {}
+  if (ref_idx != None):
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Gaps against %s (device - reference): rolling power bias / MAE (W), NP and power curve (%%)\n" % (os.path.basename(reference_file)))
+    i = 0
+    for ffile in fitfiles:
+      if (i != ref_idx):
+        rolling_gaps[ffile] = {}
+        gap_text = []
+        for power_window in project_conf_power_windows:
+          valid = ~np.isnan(rolling_power[power_window][i]) & ~np.isnan(rolling_power[power_window][ref_idx])
+          if (np.count_nonzero(valid) >= 2):
+            rolling_gaps[ffile][power_window] = agreement_statistics(rolling_power[power_window][i][valid], rolling_power[power_window][ref_idx][valid])
+            gap_text.append("%s s: %.1f / %.1f" % (power_window, rolling_gaps[ffile][power_window]['bias'], rolling_gaps[ffile][power_window]['mae']))
+        with np.errstate(invalid='ignore', divide='ignore'):
+          gap_text.append("NP: %s%%" % (formatStat((np_values[i] - np_values[ref_idx]) * 100 / np_values[ref_idx], "%+.1f")))
+          curve_gaps = (power_curve[i] - power_curve[ref_idx]) * 100 / power_curve[ref_idx]
+        for duration_idx in range(len(POWER_CURVE_DURATIONS)):
+          if (curve_points[duration_idx] in durations):
+            gap_text.append("MMP %s: %s%%" % (formatDuration(POWER_CURVE_DURATIONS[duration_idx]), formatStat(curve_gaps[np.searchsorted(durations, curve_points[duration_idx])], "%+.1f")))
+        textSection.append("   %-28s %s\n" % (decodeFitName(ffile)[0], " - ".join(gap_text)))
+      i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Graph of the rolling power (one subplot for each window) and of the mean-maximal power curves
+  if (project_prefix != ''):
+    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_power_analysis"
+  else:
+    graph_file = APP_PATH + "pnggraphs/power_analysis"
+  graph_fingerprint = artifactFingerprint({'graph': 'power_analysis', 'windows': project_conf_power_windows, 'rate': points_per_second, 'reference': reference_file})
+  if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+    print("Power analysis graph is up to date, skipped")
+    return
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  sns.set_theme(font='Montserrat')
+  sns.set(rc = {'figure.figsize':(20, 10)})
+  fig, power_axes = plt.subplots(len(project_conf_power_windows) + 1, 1, squeeze=False, figsize=(20, 4 * (len(project_conf_power_windows) + 1)))
+  ax_idx = 0
+  for power_window in project_conf_power_windows:
+    power_ax = power_axes[ax_idx][0]
+    i = 0
+    for ffile in fitfiles:
+      power_legend = decodeFitName(ffile)[0]
+      if ((ffile in rolling_gaps) and (power_window in rolling_gaps[ffile])):
+        power_legend += " Biais: %.1f W - Ecart moyen: %.1f W" % (rolling_gaps[ffile][power_window]['bias'], rolling_gaps[ffile][power_window]['mae'])
+      power_ax.plot(rolling_power[power_window][i], linewidth=1, label=power_legend)
+      i += 1
+    power_ax.set_title("Puissance glissante sur %s s (W)" % (power_window))
+    power_ax.legend()
+    ax_idx += 1
+  curve_ax = power_axes[ax_idx][0]
+  i = 0
+  for ffile in fitfiles:
+    curve_ax.plot(durations / points_per_second, power_curve[i], linewidth=1, label="%s (NP: %s W)" % (decodeFitName(ffile)[0], formatStat(np_values[i], "%.0f")))
+    i += 1
+  curve_ax.set_xscale('log')
+  curve_ax.set_xlabel("Durée (s)")
+  curve_ax.set_title("Courbe de puissance moyenne maximale (W)")
+  curve_ax.legend()
+  plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+  plt.close(fig)
+  recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# ###############################
+# HR lag
+# ###############################
+
+# This function estimates the lag of the heart rate of each device against the reference file over sliding windows (cross-correlation)
+# The lag is not compensated like in the scores (latency), it is measured: median and worst lag of each device, and the intervals with a lag over the threshold
+# Input:
+# - fitfiles / ff_data: files and aligned data
+# - reference_file: reference file
+# Output:
+# - a section is added to the logfile and a graph of the heart rate and of the lag over time is generated
+def generateHrLag(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global ff_summary, project_conf_align, project_conf_resample_rate, project_conf_hr_lag_window, project_conf_hr_lag_step, project_conf_hr_lag_max, project_conf_hr_lag_threshold
+
+  if (project_conf_align == 'distance'):
+    print("NOTICE: The HR lag needs time aligned data, skipped with align: distance")
+    return
+  compared_files = [ffile for ffile in fitfiles if ffile != reference_file]
+  gap_params, curve_params = scoringParams('heart_rate')
+  try:
+    columns = fieldColumns(compared_files + [reference_file], 'heart_rate', gap_params['zeroIsMissing'])
+  except (TypeError, ValueError):
+    print("WARNING: Field heart_rate is not numeric, no HR lag")
+    return
+  columns[:, :gap_params['start']] = np.nan
+  print("Generating HR lag")
+  # The settings are in seconds, the points of the aligned data are at 1 Hz (or at the resample rate)
+  points_per_second = pointsPerSecond()
+  window = max(3, int(round(project_conf_hr_lag_window * points_per_second)))
+  profile = lag_profile(columns[:-1], columns[-1], window, max(1, int(round(project_conf_hr_lag_step * points_per_second))),
+                        max(1, int(round(project_conf_hr_lag_max * points_per_second))))
+  if (len(profile['center']) == 0):
+    print("WARNING: Not enough HR data for the HR lag, skipped")
+    return
+  lags = profile['lag'] / points_per_second
+  center_points = np.round(profile['center']).astype(int)
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" HR LAG (against %s, windows of %s s every %s s, lags up to %s s)\n" % (os.path.basename(reference_file), project_conf_hr_lag_window, project_conf_hr_lag_step, project_conf_hr_lag_max))
+  textSection.append(" Positive lag: the device is late. Intervals with a lag over %s s\n" % (project_conf_hr_lag_threshold))
+  textSection.append("-------------------------------------------------------------------------\n")
+  textSection.append("   %-28s %8s %8s %8s %17s %10s\n" % ("Device", "Windows", "Median", "P90", "Worst", "Over"))
+  lag_intervals = {}
+  i = 0
+  for ffile in compared_files:
+    valid = ~np.isnan(lags[i])
+    lag_intervals[ffile] = []
+    if (not valid.any()):
+      textSection.append("   %-28s %8i %8s %8s %17s %10s\n" % (decodeFitName(ffile)[0], 0, "-", "-", "-", "-"))
+      i += 1
+      continue
+    worst_idx = int(np.nanargmax(np.abs(lags[i])))
+    worst_time = datetime.timedelta(seconds=int((ff_data[reference_file][center_points[worst_idx]]['timestamp'] - ff_summary[reference_file][4]).total_seconds()))
+    over = valid & (np.abs(np.where(valid, lags[i], 0)) > project_conf_hr_lag_threshold)
+    textSection.append("   %-28s %8i %8s %8s %17s %9.1f%%\n" % (decodeFitName(ffile)[0], np.count_nonzero(valid), formatStat(np.median(lags[i][valid]), "%+.1f"),
+                                                             formatStat(np.percentile(lags[i][valid], 90), "%+.1f"), "%+.1f (%s)" % (lags[i][worst_idx], worst_time),
+                                                             np.count_nonzero(over) * 100 / np.count_nonzero(valid)))
+    # Consecutive windows over the threshold, from the center of the first window to the center of the last one
+    for over_segment in flagged_segments(over):
+      interval_start = datetime.timedelta(seconds=int((ff_data[reference_file][center_points[over_segment[0]]]['timestamp'] - ff_summary[reference_file][4]).total_seconds()))
+      interval_end = datetime.timedelta(seconds=int((ff_data[reference_file][center_points[over_segment[1]]]['timestamp'] - ff_summary[reference_file][4]).total_seconds()))
+      interval_worst = lags[i][over_segment[0] + int(np.nanargmax(np.abs(lags[i][over_segment[0]:over_segment[1] + 1])))]
+      # Shaded on the graph over the steps of its windows
+      lag_intervals[ffile].append([profile['center'][over_segment[0]] / points_per_second - project_conf_hr_lag_step / 2, profile['center'][over_segment[1]] / points_per_second + project_conf_hr_lag_step / 2])
+      textSection.append("     %s - %s: lag up to %+.1f s\n" % (interval_start, interval_end, interval_worst))
+    i += 1
+  textSection.append(" (lag in s)\n")
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Graph of the heart rate of all the files and of the lag of each device, with the intervals over the threshold
+  if (project_prefix != ''):
+    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_hr_lag"
+  else:
+    graph_file = APP_PATH + "pnggraphs/hr_lag"
+  graph_fingerprint = artifactFingerprint({'graph': 'hr_lag', 'lag': [project_conf_hr_lag_window, project_conf_hr_lag_step, project_conf_hr_lag_max, project_conf_hr_lag_threshold],
+                                           'rate': points_per_second, 'scoring': scoringInputs('heart_rate'), 'reference': reference_file})
+  if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+    print("HR lag graph is up to date, skipped")
+    return
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  sns.set_theme(font='Montserrat')
+  sns.set(rc = {'figure.figsize':(20, 10)})
+  fig, lag_axes = plt.subplots(2, 1, sharex=True, figsize=(20, 10))
+  times = np.arange(columns.shape[1]) / points_per_second
+  lag_axes[0].plot(times, columns[-1], linewidth=1, color='black', label="%s (référence)" % (decodeFitName(reference_file)[0]))
   i = 0
-  all_sessions_start = []
-  for session in all_sessions:
-    session_start = []
+  for ffile in compared_files:
+    line = lag_axes[0].plot(times, columns[i], linewidth=1, label=decodeFitName(ffile)[0])
+    valid = ~np.isnan(lags[i])
+    lag_legend = decodeFitName(ffile)[0]
+    if (valid.any()):
+      lag_legend += " Médiane: %+.1f s" % (np.median(lags[i][valid]))
+    lag_axes[1].plot(profile['center'] / points_per_second, lags[i], linewidth=1, marker='.', color=line[0].get_color(), label=lag_legend)
+    for lag_interval in lag_intervals[ffile]:
+      lag_axes[1].axvspan(lag_interval[0], lag_interval[1], color=line[0].get_color(), alpha=0.15)
+    i += 1
+  lag_axes[0].set_title("Fréquence cardiaque (bpm)")
+  lag_axes[0].legend()
+  for threshold in [-project_conf_hr_lag_threshold, project_conf_hr_lag_threshold]:
+    lag_axes[1].axhline(threshold, color='red', linewidth=1, linestyle='dotted')
+  lag_axes[1].axhline(0, color='gray', linewidth=1)
+  lag_axes[1].set_title("Décalage de la fréquence cardiaque par rapport à %s (s, fenêtres de %s s)" % (decodeFitName(reference_file)[0], project_conf_hr_lag_window))
+  lag_axes[1].set_xlabel("Temps (s)")
+  lag_axes[1].legend()
+  plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+  plt.close(fig)
+  recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# ###############################
+# HR zones
+# ###############################
+
+# This function computes the time in each HR zone of each device and the zone confusion matrices against the reference file
+# Input:
+# - fitfiles / ff_data: files and aligned data
+# - reference_file: reference file (None: no confusion matrix)
+# Output:
+# - a section is added to the logfile and a bar chart of the time in zone is generated
+def generateHrZones(fitfiles, ff_data, reference_file, project_prefix, APP_PATH):
+  global project_conf_hr_zones
+
+  zone_bounds = sorted(project_conf_hr_zones)
+  columns = fieldColumns(fitfiles, 'heart_rate', True)
+  ref_column = None
+  if (reference_file != None):
+    ref_column = columns[fitfiles.index(reference_file)]
+  time_in_zone, confusion = zone_agreement(columns, ref_column, zone_bounds)
+  # Names of the zones with their bounds
+  zone_names = ["Z1 (<%i)" % (zone_bounds[0])]
+  for zone_idx in range(1, len(zone_bounds)):
+    zone_names.append("Z%i (%i-%i)" % (zone_idx + 1, zone_bounds[zone_idx - 1], zone_bounds[zone_idx]))
+  zone_names.append("Z%i (>=%i)" % (len(zone_bounds) + 1, zone_bounds[-1]))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    zone_percent = time_in_zone * 100 / time_in_zone.sum(axis=1)[:, None]
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" HR ZONES (time in zone, one point per second)\n")
+  textSection.append(" %-20s" % ("Device") + "".join([" %16s" % (zone_name) for zone_name in zone_names]) + "\n")
+  i = 0
+  for ffile in fitfiles:
+    textSection.append(" %-20s" % (decodeFitName(ffile)[0]) + "".join([" %7s (%5.1f%%)" % (str(datetime.timedelta(seconds=int(time_in_zone[i][zone_idx]))), zone_percent[i][zone_idx]) for zone_idx in range(len(zone_names))]) + "\n")
+    i += 1
+  # Confusion matrices: rows are the zones of the reference, columns the zones of the device
+  if (confusion is not None):
+    i = 0
     for ffile in fitfiles:
-      f_sessions = loadFitSession(ffile, ff_summary[ffile])
-      session_start.append(f_sessions[i][3])
+      if (ffile != reference_file):
+        nb_points = confusion[i].sum()
+        zone_match = (np.trace(confusion[i]) * 100 / nb_points) if (nb_points > 0) else 0
+        textSection.append("-------------------------------------------------------------------------\n")
+        textSection.append(" %s against %s: same zone %.1f%% of the time\n" % (decodeFitName(ffile)[0], decodeFitName(reference_file)[0], zone_match))
+        textSection.append(" %-20s" % ("Reference \\ Device") + "".join([" %12s" % (zone_name) for zone_name in zone_names]) + "\n")
+        for ref_zone_idx in range(len(zone_names)):
+          textSection.append(" %-20s" % (zone_names[ref_zone_idx]) + "".join([" %12i" % (zone_points) for zone_points in confusion[i][ref_zone_idx]]) + "\n")
+      i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Bar chart of the time in zone of each device
+  if (project_prefix != ''):
+    graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_hr_zones"
+  else:
+    graph_file = APP_PATH + "pnggraphs/hr_zones"
+  graph_fingerprint = artifactFingerprint({'graph': 'hr_zones', 'hrZones': zone_bounds})
+  if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+    print("Graph of the HR zones is up to date, skipped")
+    return
+  print("Generating HR zones graph")
+  pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+  zone_rows = []
+  i = 0
+  for ffile in fitfiles:
+    for zone_idx in range(len(zone_names)):
+      zone_rows.append({'Zone': zone_names[zone_idx], 'Appareil': decodeFitName(ffile)[0], 'Temps (%)': zone_percent[i][zone_idx]})
+    i += 1
+  sns.set_theme(font='Montserrat')
+  sns.set(rc = {'figure.figsize':(20, 10)})
+  fig, zone_ax = plt.subplots(figsize=(12, 6))
+  sns.barplot(data=pd.DataFrame(zone_rows), x='Zone', y='Temps (%)', hue='Appareil', ax=zone_ax)
+  zone_ax.set_title("Temps dans les zones cardiaques (%)")
+  plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+  plt.close(fig)
+  recordArtifact([graph_file + '.png'], graph_fingerprint)
+
+# ###############################
+# All-pairs agreement matrix
+# ###############################
+def generateAgreementMatrix(fitfiles, ff_data, project_prefix, APP_PATH):
+  global values_to_compare
+
+  print("Generating agreement matrix")
+  device_names = [decodeFitName(ffile)[0] for ffile in fitfiles]
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" AGREEMENT MATRIX (row: device, column: device it is compared to)\n")
+  i = 0
+  for ffile in fitfiles:
+    i += 1
+    textSection.append("   [%i] %s\n" % (i, device_names[i-1]))
+  for compare_value in values_to_compare:
+    if (compare_value == 'hrv'):
+      continue
+    # Same rules and score curve as the scoring against the reference file
+    gap_params, curve_params = scoringParams(compare_value)
+    try:
+      columns = fieldColumns(fitfiles, compare_value, gap_params['zeroIsMissing'])
+    except (TypeError, ValueError):
+      print("WARNING: Field %s is not numeric, no agreement matrix" % (compare_value))
+      continue
+    mean_gap, max_gap = pairwise_agreement(columns, gap_params['latency'], gap_params['start'], gap_params['metric'])
+    score = score_curve(mean_gap, max_gap, **curve_params)
+
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Field: %s\n" % (compare_value))
+    for matrix_name, matrix in [("Mean gap", mean_gap), ("Max gap", max_gap), ("Score", score)]:
+      textSection.append(" %-10s" % (matrix_name) + "".join(["%10s" % ("[%i]" % (col+1)) for col in range(len(fitfiles))]) + "\n")
+      for row in range(len(fitfiles)):
+        textSection.append(" %-10s" % ("[%i]" % (row+1)) + "".join(["%10.2f" % (matrix[row][col]) for col in range(len(fitfiles))]) + "\n")
+
+    # Heatmap of the score matrix
+    pathlib.Path(APP_PATH + "pnggraphs").mkdir(exist_ok=True)
+    if (project_prefix != ''):
+      graph_file = APP_PATH + "pnggraphs/" + project_prefix + "_agreement_" + compare_value.lower()
+    else:
+      graph_file = APP_PATH + "pnggraphs/agreement_" + compare_value.lower()
+    graph_fingerprint = artifactFingerprint({'agreement': compare_value, 'scoring': scoringInputs(compare_value)})
+    if (artifactIsFresh([graph_file + '.png'], graph_fingerprint)):
+      print("Agreement matrix graph for %s is up to date, skipped" % (compare_value))
+      continue
+    sns.set_theme(font='Montserrat')
+    sns.set(rc = {'figure.figsize':(20, 10)})
+    sns.heatmap(score, annot=True, fmt=".1f", cmap="RdYlGn", vmin=0, vmax=100, xticklabels=device_names, yticklabels=device_names).set(title="Matrice de concordance \"%s\" (score)" % (compare_value))
+    plt.savefig(graph_file + '.png', bbox_inches='tight', pad_inches=0.3)
+    plt.clf()
+    recordArtifact([graph_file + '.png'], graph_fingerprint)
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+# ###############################
+# Columnar export
+# ###############################
+def exportColumnar(fitfiles, ff_data, project_prefix, APP_PATH):
+  global values_to_compare, custom_graphs_values, project_conf_altitude_gap, field_gap_series, dem_altitude
+
+  altitude_gap = secondsToPoints(project_conf_altitude_gap)
+  if (project_prefix != ''):
+    export_file = APP_PATH + project_prefix + "_" + 'aligned.npz'
+  else:
+    export_file = APP_PATH + 'aligned.npz'
+  # All the compared fields (HRV is not a per point field)
+  export_fields = []
+  for field in values_to_compare + custom_graphs_values:
+    if ((field != 'hrv') and (field not in export_fields)):
+      export_fields.append(field)
+  # Skip the export if it was already written with the same fields
+  export_fingerprint = artifactFingerprint({'export': export_fields, 'altitudeGap': project_conf_altitude_gap, 'dem': project_conf_dem_directory, 'scoring': [scoringInputs(field) for field in export_fields]})
+  if (artifactIsFresh([export_file], export_fingerprint)):
+    print("Aligned data export is up to date, skipped")
+    return
+
+  print("Exporting aligned data")
+  columns = {}
+  for ffile in fitfiles:
+    column_prefix = os.path.splitext(os.path.basename(ffile))[0] + "/"
+    columns[column_prefix + 'timestamp'] = np.array([point['timestamp'] for point in ff_data[ffile]], dtype='datetime64[ms]')
+    for field in export_fields:
+      try:
+        columns[column_prefix + field] = dataColumn(ff_data[ffile], field)
+      except (TypeError, ValueError):
+        print("WARNING: Field %s of file %s is not numeric, not exported" % (field, ffile))
+    # Derived series: smoothed altitude (NaN for the ignored altitude points)
+    if (("altitude" in values_to_compare) and (len(ff_data[ffile]) > altitude_gap + 3)):
+      smoothed_altitude = np.full(len(ff_data[ffile]), np.nan)
+      smoothed_altitude[altitude_gap:] = smoothAltitude(ff_data[ffile], altitude_gap)
+      columns[column_prefix + 'smoothed_altitude'] = smoothed_altitude
+    # Derived series: altitude of the DEM at the positions of the file
+    if (ffile in dem_altitude):
+      columns[column_prefix + 'dem_altitude'] = dem_altitude[ffile]
+    # Derived series: gaps against the reference file (HR gap and the other scored fields)
+    for score_field in field_gap_series:
+      if (ffile in field_gap_series[score_field]):
+        columns[column_prefix + score_field + '_gap'] = field_gap_series[score_field][ffile]
+  # Common timestamps of the aligned data
+  columns['timestamp'] = columns[os.path.splitext(os.path.basename(fitfiles[0]))[0] + "/timestamp"]
+
+  # One bulk write of all the columns
+  np.savez_compressed(export_file, **columns)
+  recordArtifact([export_file], export_fingerprint)
+
+# ###############################
+# Lap statistics
+# ###############################
+
+# This function format a value of a statistic ("-" if there is no value)
+def formatStat(value, value_format="%.2f"):
+  if ((value == None) or np.isnan(value)):
+    return "-"
+  return value_format % (value)
+
+# This function format a duration in seconds ("5s", "20min"...)
+def formatDuration(duration):
+  if ((duration >= 60) and (duration % 60 == 0)):
+    return "%imin" % (duration // 60)
+  return "%is" % (duration)
+
+# This function returns the smoothed altitude of the aligned points of each file (NaN for the points of the first altitudeGap seconds)
+def smoothedAltitudeColumns(fitfiles, ff_data, nb_points):
+  global project_conf_altitude_gap
+  altitude_gap = secondsToPoints(project_conf_altitude_gap)
+  smoothed_columns = np.full((len(fitfiles), nb_points), np.nan)
+  if (nb_points <= altitude_gap + 3):
+    return smoothed_columns
+  i = 0
+  for ffile in fitfiles:
+    smoothed_columns[i][altitude_gap:] = smoothAltitude(ff_data[ffile][:nb_points], altitude_gap)
     i += 1
-    all_sessions_start.append(session_start)
+  return smoothed_columns
+
+# This function computes the statistics of each device on each lap of the first file (reference), on the aligned data
+# The laps are mapped to the aligned points by binary search, and all the statistics are segmented reductions of the aligned columns
+def generateLapStatistics(fitfiles, ff_data, project_prefix, APP_PATH):
+  global ff_laps, field_gap_series, values_to_compare, project_conf_altitude_gap
+
+  lap_file = fitfiles[0]
+  nb_points = min([len(ff_data[ffile]) for ffile in fitfiles])
+  if ((len(ff_laps[lap_file]) == 0) or (nb_points == 0)):
+    print("NOTICE: No lap in file %s for this window, no lap statistics" % (lap_file))
+    return
+  print("Generating lap statistics")
+
+  # Map the lap starts to the aligned points by binary search on the timestamps
+  aligned_ts = np.array([point['timestamp'] for point in ff_data[lap_file][:nb_points]], dtype='datetime64[ms]')
+  lap_starts = np.searchsorted(aligned_ts, np.array([lap[0] for lap in ff_laps[lap_file]], dtype='datetime64[ms]'))
+  # Keep the laps with points in the window (a lap started before the window begins at its first point)
+  lap_numbers = []
+  starts = []
+  for lap_idx in range(len(lap_starts)):
+    if ((lap_starts[lap_idx] < nb_points) and ((lap_idx == len(lap_starts) - 1) or (lap_starts[lap_idx+1] > lap_starts[lap_idx]))):
+      lap_numbers.append(lap_idx + 1)
+      starts.append(lap_starts[lap_idx])
+  starts = np.array(starts)
+  ends = np.append(starts[1:], nb_points)
+  lap_offsets = (aligned_ts[starts] - aligned_ts[0]) / np.timedelta64(1, 's')
+  lap_durations = (aligned_ts[ends - 1] - aligned_ts[starts]) / np.timedelta64(1, 's') + 1
+
+  # Statistics of all the devices, one segmented reduction per value
+  nan_stats = np.full((len(fitfiles), len(starts)), np.nan)
+  lap_distance = nan_stats
+  lap_ascent = nan_stats
+  lap_descent = nan_stats
+  lap_power = nan_stats
+  if ("distance" in ff_data[lap_file][0]):
+    lap_distance = segment_statistics(fieldColumns(fitfiles, 'distance'), starts)['range']
+  if ("power" in ff_data[lap_file][0]):
+    lap_power = segment_statistics(fieldColumns(fitfiles, 'power'), starts)['mean']
+  if ("altitude" in values_to_compare):
+    altitude_stats = segment_statistics(smoothedAltitudeColumns(fitfiles, ff_data, nb_points), starts)
+    lap_ascent = altitude_stats['gain']
+    lap_descent = altitude_stats['loss']
+  # HR gap and score against the reference file (gaps from the scoring engine)
+  lap_hr = {}
+  if ("heart_rate" in field_gap_series):
+    gap_files = list(field_gap_series['heart_rate'])
+    if (len(gap_files) > 0):
+      hr_stats = segment_statistics(np.vstack([field_gap_series['heart_rate'][ffile][:nb_points] for ffile in gap_files]), starts)
+      hr_scores = score_curve(hr_stats['mean'], hr_stats['max'], **scoringParams('heart_rate')[1])
+      i = 0
+      for ffile in gap_files:
+        lap_hr[ffile] = [hr_stats['mean'][i], hr_stats['max'][i], np.where(hr_stats['points'][i] > 0, hr_scores[i], np.nan)]
+        i += 1
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" LAP STATISTICS (laps of %s)\n" % (os.path.basename(lap_file)))
+  csv_rows = []
+  for lap_idx in range(len(starts)):
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Lap %i: start %i s, duration %i s\n" % (lap_numbers[lap_idx], lap_offsets[lap_idx], lap_durations[lap_idx]))
+    i = 0
+    for ffile in fitfiles:
+      # Shift of the lap button of this device against the lap file (same number of laps only)
+      lap_shift = None
+      if (len(ff_laps[ffile]) == len(ff_laps[lap_file])):
+        lap_shift = (ff_laps[ffile][lap_numbers[lap_idx]-1][0] - ff_laps[lap_file][lap_numbers[lap_idx]-1][0]).total_seconds()
+      hr_values = [None, None, None]
+      if (ffile in lap_hr):
+        hr_values = [float(lap_hr[ffile][0][lap_idx]), float(lap_hr[ffile][1][lap_idx]), float(lap_hr[ffile][2][lap_idx])]
+      textSection.append("   %-20s Dist: %s m - D+/D-: %s / %s - Puiss.: %s W" % (decodeFitName(ffile)[0], formatStat(lap_distance[i][lap_idx], "%.1f"), formatStat(lap_ascent[i][lap_idx], "%.1f"), formatStat(lap_descent[i][lap_idx], "%.1f"), formatStat(lap_power[i][lap_idx], "%.1f")))
+      if (ffile in lap_hr):
+        textSection.append(" - Ecart FC: %s / %s - Score: %s%%" % (formatStat(hr_values[0]), formatStat(hr_values[1]), formatStat(hr_values[2], "%.1f")))
+      if ((lap_shift != None) and (ffile != lap_file)):
+        textSection.append(" - Décalage: %+.0f s" % (lap_shift))
+      textSection.append("\n")
+      csv_rows.append([lap_numbers[lap_idx], lap_offsets[lap_idx], lap_durations[lap_idx], os.path.basename(ffile), decodeFitName(ffile)[0], lap_distance[i][lap_idx], lap_ascent[i][lap_idx], lap_descent[i][lap_idx], lap_power[i][lap_idx], hr_values[0], hr_values[1], hr_values[2], lap_shift])
+      i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Per-lap CSV
+  if (project_prefix != ''):
+    laps_file = APP_PATH + project_prefix + "_" + 'laps.csv'
+  else:
+    laps_file = APP_PATH + 'laps.csv'
+  with open(laps_file, 'w', newline='') as flaps:
+    laps_writer = csv.writer(flaps)
+    laps_writer.writerow(['lap', 'start', 'duration', 'file', 'device', 'distance', 'ascent', 'descent', 'average_power', 'hr_average_gap', 'hr_max_gap', 'hr_score', 'lap_shift'])
+    for csv_row in csv_rows:
+      laps_writer.writerow(['' if ((value is None) or (isinstance(value, float) and math.isnan(value))) else value for value in csv_row])
+
+# ###############################
+# Distance splits
+# ###############################
+
+# This function computes the statistics of each device on each distance split (every project_conf_distance_splits meters) of the first file (reference)
+# The split boundaries are found by binary search on the cumulative distance of the first file, and the statistics are segmented reductions of the aligned columns
+def generateDistanceSplits(fitfiles, ff_data, project_prefix, APP_PATH):
+  global field_gap_series, project_conf_distance_splits
+
+  split_file = fitfiles[0]
+  nb_points = min([len(ff_data[ffile]) for ffile in fitfiles])
+  if ((nb_points < 2) or ("distance" not in ff_data[split_file][0])):
+    print("NOTICE: No distance in file %s for this window, no distance splits" % (split_file))
+    return
+  # Cumulative distance of each device, from the start of the window (a missing value keeps the previous distance)
+  distance_columns = np.fmax.accumulate(fieldColumns(fitfiles, 'distance'), axis=1)
+  distance_columns = distance_columns - np.fmin.reduce(distance_columns, axis=1)[:, None]
+  split_distance = np.nan_to_num(distance_columns[0])
+  if (split_distance[-1] <= 0):
+    print("NOTICE: No distance in file %s for this window, no distance splits" % (split_file))
+    return
+  print("Generating distance splits")
+
+  # First point of each split: first point at or after each multiple of the split distance (splits without points are merged)
+  starts = np.unique(np.searchsorted(split_distance, np.arange(0, split_distance[-1], project_conf_distance_splits), side='left'))
+  starts = starts[starts < nb_points - 1]
+  # A split goes from its first point to the first point of the next one (last split: to the last point)
+  bounds = np.append(starts, nb_points - 1)
+  aligned_ts = np.array([point['timestamp'] for point in ff_data[split_file][:nb_points]], dtype='datetime64[ms]')
+  split_durations = (aligned_ts[bounds[1:]] - aligned_ts[bounds[:-1]]) / np.timedelta64(1, 's')
+  split_distances = distance_columns[:, bounds[1:]] - distance_columns[:, bounds[:-1]]
+  # Time of each device on the split: its own time with the distance alignment, else the time of the split
+  if ("elapsed_time" in ff_data[split_file][0]):
+    time_columns = fieldColumns(fitfiles, 'elapsed_time')
+    split_times = time_columns[:, bounds[1:]] - time_columns[:, bounds[:-1]]
+  else:
+    split_times = np.tile(split_durations, (len(fitfiles), 1))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    split_paces = np.where(split_distances > 0, split_times * 1000 / split_distances, np.nan)
+
+  # Heart rate, HR gap against the reference file and D+/D-, one segmented reduction per value
+  nan_stats = np.full((len(fitfiles), len(starts)), np.nan)
+  split_hr = nan_stats
+  split_ascent = nan_stats
+  split_descent = nan_stats
+  if ("heart_rate" in ff_data[split_file][0]):
+    split_hr = segment_statistics(fieldColumns(fitfiles, 'heart_rate', True), starts)['mean']
+  if ("altitude" in values_to_compare):
+    altitude_stats = segment_statistics(smoothedAltitudeColumns(fitfiles, ff_data, nb_points), starts)
+    split_ascent = altitude_stats['gain']
+    split_descent = altitude_stats['loss']
+  split_hr_gap = {}
+  if ("heart_rate" in field_gap_series):
+    gap_files = list(field_gap_series['heart_rate'])
+    if (len(gap_files) > 0):
+      hr_stats = segment_statistics(np.vstack([field_gap_series['heart_rate'][ffile][:nb_points] for ffile in gap_files]), starts)
+      i = 0
+      for ffile in gap_files:
+        split_hr_gap[ffile] = [hr_stats['mean'][i], hr_stats['max'][i]]
+        i += 1
+
+  textSection = []
+  textSection.append("=========================================================================\n")
+  textSection.append(" DISTANCE SPLITS (every %s m of the distance of %s)\n" % (formatStat(project_conf_distance_splits, "%g"), os.path.basename(split_file)))
+  csv_rows = []
+  for split_idx in range(len(starts)):
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" Split %i: %.0f - %.0f m, duration %i s\n" % (split_idx + 1, split_distance[bounds[split_idx]], split_distance[bounds[split_idx+1]], split_durations[split_idx]))
+    i = 0
+    for ffile in fitfiles:
+      hr_gap = [None, None]
+      if (ffile in split_hr_gap):
+        hr_gap = [float(split_hr_gap[ffile][0][split_idx]), float(split_hr_gap[ffile][1][split_idx])]
+      pace_text = "-"
+      if (not np.isnan(split_paces[i][split_idx])):
+        pace_text = "%i:%02i" % (split_paces[i][split_idx] // 60, split_paces[i][split_idx] % 60)
+      textSection.append("   %-20s Dist: %s m - Temps: %s s - Allure: %s /km - FC: %s - D+/D-: %s / %s" % (decodeFitName(ffile)[0], formatStat(split_distances[i][split_idx], "%.1f"), formatStat(split_times[i][split_idx], "%.0f"), pace_text, formatStat(split_hr[i][split_idx], "%.1f"),
+                                                                                       formatStat(split_ascent[i][split_idx], "%.1f"), formatStat(split_descent[i][split_idx], "%.1f")))
+      if (ffile in split_hr_gap):
+        textSection.append(" - Ecart FC: %s / %s" % (formatStat(hr_gap[0]), formatStat(hr_gap[1])))
+      textSection.append("\n")
+      csv_rows.append([split_idx + 1, split_distance[bounds[split_idx]], split_distance[bounds[split_idx+1]], split_durations[split_idx], os.path.basename(ffile), decodeFitName(ffile)[0], split_distances[i][split_idx], split_times[i][split_idx], split_paces[i][split_idx],
+                       split_hr[i][split_idx], hr_gap[0], hr_gap[1], split_ascent[i][split_idx], split_descent[i][split_idx]])
+      i += 1
+  textSection.append("=========================================================================\n")
+  appendLogfile(textSection)
+
+  # Per-split CSV
+  if (project_prefix != ''):
+    splits_file = APP_PATH + project_prefix + "_" + 'splits.csv'
+  else:
+    splits_file = APP_PATH + 'splits.csv'
+  with open(splits_file, 'w', newline='') as fsplits:
+    splits_writer = csv.writer(fsplits)
+    splits_writer.writerow(['split', 'start_distance', 'end_distance', 'duration', 'file', 'device', 'distance', 'time', 'pace', 'average_hr', 'hr_average_gap', 'hr_max_gap', 'ascent', 'descent'])
+    for csv_row in csv_rows:
+      splits_writer.writerow(['' if ((value is None) or (isinstance(value, float) and math.isnan(value))) else value for value in csv_row])
+
+# ###############################
+# Zoom windows
+# ###############################
+
+# This function slice the points of a file between two timestamps, by binary search on the timestamps array
+# Input:
+# - file_data: array of value for a fit file
+# - file_timestamps: sorted array of the timestamps of file_data
+# - start_point / end_point: timestamps of the window (included)
+# Output:
+# - array of value for the window
+def sliceWindow(file_data, file_timestamps, start_point, end_point):
+  start_idx = bisect.bisect_left(file_timestamps, start_point)
+  end_idx = bisect.bisect_right(file_timestamps, end_point)
+  return file_data[start_idx:end_idx]
+
+# This function build the summary section of a zoom window
+def windowSummary(window):
+  global ff_data, values_to_compare
+  textSection = []
+  textSection.append("=========================================================================\n")
+  if ('offsets' in window):
+    textSection.append(" SESSION: %s [%i, %i]\n" % (window['name'], window['range'][0], window['range'][1]))
+  elif (window['name'] != None):
+    textSection.append(" ZOOM WINDOW: %s [%i, %i]\n" % (window['name'], window['range'][0], window['range'][1]))
+  else:
+    textSection.append(" ZOOM WINDOW: [%i, %i]\n" % (window['range'][0], window['range'][1]))
+  for ffile in fitfiles:
+    textSection.append("-------------------------------------------------------------------------\n")
+    textSection.append(" FIT FILE: %s\n" % (os.path.basename(ffile)))
+    if (len(ff_data[ffile]) == 0):
+      textSection.append(" No point in this window\n")
+      continue
+    textSection.append(" Number of points:             %i\n" % (len(ff_data[ffile])))
+    textSection.append(" First / last point timestamp: %s / %s\n" % (ff_data[ffile][0]['timestamp'].strftime("%m/%d/%Y, %H:%M:%S"), ff_data[ffile][-1]['timestamp'].strftime("%m/%d/%Y, %H:%M:%S")))
+    if ("distance" in values_to_compare):
+      window_distances = [record['distance'] for record in ff_data[ffile] if record['distance'] != None]
+      if (len(window_distances) > 0):
+        textSection.append(" Distance in window:           %.2f\n" % (window_distances[-1] - window_distances[0]))
+    if (("altitude" in values_to_compare) and (len(ff_data[ffile]) > secondsToPoints(project_conf_altitude_gap) + 3)):
+      smoothed_altitude = smoothAltitude(ff_data[ffile], secondsToPoints(project_conf_altitude_gap))
+      textSection.append(" Normalized ascent / descent:  %.2f / %.2f\n" % (normalizedAltGain(smoothed_altitude), normalizedAltLoss(smoothed_altitude)))
+  textSection.append("=========================================================================\n")
+  return textSection
+
+# This function runs the complete analysis (alignment, graphs, map) of one zoom window
+# Input:
+# - window: dict with the name (None for the main window, no suffix) and the range (None for the complete activity)
+# Output:
+# - fingerprints of the artifacts built for this window (to update the manifest) and scores of the window (for the index)
+def analyzeWindow(window):
+  global ff_data, project_prefix, flog_file, project_conf_zoom, project_conf_zoom_range, field_scores, field_gap_series, window_inputs, artifact_updates, hr_artifact_classes, dem_altitude
+
+  # Slice the window from the complete data
+  ff_data = {}
+  field_scores = {}
+  field_gap_series = {}
+  artifact_updates = {}
+  # Inputs shared by all the artifacts of this window
+  window_inputs = {'files': ff_inputs, 'reference': with_reference_file, 'align': [project_conf_align, project_conf_resample_rate, project_conf_resample_max_gap, project_conf_distance_step, project_conf_distance_max_gap, project_conf_distance_band, project_conf_pause_threshold], 'ignore': project_conf_ignore, 'window': [window['name'], window['range'], window.get('offsets')]}
+  if ('offsets' in window):
+    # A session window is already mapped to record offsets by the session index
+    project_conf_zoom = True
+    project_conf_zoom_range = window['range']
+    for ffile in fitfiles:
+      ff_data[ffile] = ff_full_data[ffile][window['offsets'][ffile][0]:window['offsets'][ffile][1]]
+  elif (window['range'] != None):
+    project_conf_zoom = True
+    project_conf_zoom_range = window['range']
+    for ffile in fitfiles:
+      start_point = ff_summary[ffile][4] + datetime.timedelta(0,project_conf_zoom_range[0])
+      end_point = ff_summary[ffile][4] + datetime.timedelta(0,project_conf_zoom_range[1])
+      ff_data[ffile] = sliceWindow(ff_full_data[ffile], ff_timestamps[ffile], start_point, end_point)
+  else:
+    project_conf_zoom = False
+    for ffile in fitfiles:
+      ff_data[ffile] = ff_full_data[ffile][:]
+
+  # A named window has its own prefix and logfile
+  if (window['name'] != None):
+    print("Processing window %s" % (window['name']))
+    if (project_base_prefix != ''):
+      project_prefix = project_base_prefix + "_" + window['name']
+    else:
+      project_prefix = window['name']
+    flog_file = APP_PATH + project_prefix + "_" + 'logfile.txt'
+    flog = open(flog_file, "w")
+    flog.close()
+  else:
+    project_prefix = project_base_prefix
+    flog_file = project_logfile
+  if (window['range'] != None):
+    appendLogfile(windowSummary(window))
+
+  alignData()
+  # Altitude of the DEM at the positions of each device (used by the altitude graph and the export)
+  dem_altitude = {}
+  if ((project_conf_dem_directory != None) and ("altitude" in values_to_compare)):
+    generateDemAltitude(fitfiles, ff_data)
+  # Detect the heart rate artifacts (used by the scores and the heart rate graph)
+  hr_artifact_classes = {}
+  if (project_conf_hr_artifacts and ("heart_rate" in values_to_compare)):
+    detectHrArtifacts(fitfiles, ff_data)
+  # Score the fields against the reference file
+  if (with_reference_file and (len(fitfiles) >= 2)):
+    computeScores(fitfiles, ff_data, reference_file)
+  # Agreement statistics against the reference file
+  if (project_conf_agreement_stats and with_reference_file and (len(fitfiles) >= 2)):
+    generateAgreementStats(fitfiles, ff_data, reference_file, project_prefix, APP_PATH)
+  # Rolling agreement against the reference file
+  if (project_conf_rolling_agreement and with_reference_file and (len(fitfiles) >= 2)):
+    generateRollingAgreement(fitfiles, ff_data, reference_file, project_prefix, APP_PATH)
+  # HR lag of each device against the reference file
+  if (project_conf_hr_lag and ("heart_rate" in values_to_compare) and with_reference_file and (len(fitfiles) >= 2)):
+    generateHrLag(fitfiles, ff_data, reference_file, project_prefix, APP_PATH)
+  # Time in HR zones and zone agreement against the reference file
+  if ((project_conf_hr_zones != None) and ("heart_rate" in values_to_compare)):
+    generateHrZones(fitfiles, ff_data, reference_file if with_reference_file else None, project_prefix, APP_PATH)
+  # Rolling power, normalized power and power curve of each device
+  if (project_conf_power_analysis and ("power" in values_to_compare)):
+    generatePowerAnalysis(fitfiles, ff_data, reference_file if with_reference_file else None, project_prefix, APP_PATH)
+  # Statistics of each lap
+  if (project_conf_lap_analysis):
+    generateLapStatistics(fitfiles, ff_data, project_prefix, APP_PATH)
+  # Statistics of each distance split
+  if (project_conf_distance_splits != None):
+    generateDistanceSplits(fitfiles, ff_data, project_prefix, APP_PATH)
+  # Export the aligned data in a single columnar file
+  if (args.export and (args.export_format == 'npz')):
+    exportColumnar(fitfiles, ff_data, project_prefix, APP_PATH)
+  generateCompareGraphs()
+  if (conf_has_custom_graphs):
+    generateCustomGraphs()
+
+  # Generate the agreement matrix of all the pairs of devices if enabled
+  if (project_conf_agreement_matrix and (len(fitfiles) >= 2)):
+    generateAgreementMatrix(fitfiles, ff_data, project_prefix, APP_PATH)
+
+  # Generate the GNSS accuracy analysis if enabled
+  if (project_conf_gnss_accuracy):
+    if (with_reference_file):
+      generateGnssAccuracy(fitfiles, ff_data, reference_file, project_prefix, APP_PATH)
+    else:
+      print("WARNING: GNSS accuracy analysis needs a reference file (--reference-file), skipped")
+
+  # Generate the GNSS distance and speed analysis if enabled
+  if (project_conf_gnss_distance):
+    generateGnssDistance(fitfiles, ff_data, project_prefix, APP_PATH)
+
+  # Generate the HRV spectrum once (the RR series are not windowed), with the first window
+  if (project_conf_hrv_spectrum and (window == analysis_windows[0])):
+    generateHrvSpectrum(fitfiles, reference_file if with_reference_file else None, project_base_prefix, APP_PATH)
+
+  # Generate the battery graph once (complete activity), with the first window
+  if (project_conf_battery_graph and (len(ff_battery) > 0) and (window == analysis_windows[0])):
+    generateBatteryGraph(fitfiles, ff_full_data, ff_battery, project_base_prefix, APP_PATH)
+
+  # Generate Mapbox map if map is enabled
+  if (project_conf_map):
+    generateMapboxMap(fitfiles, ff_data, project_prefix, MAPBOX_API_KEY, project_conf_map_style, ff_summary, APP_PATH)
+
+  return [artifact_updates, field_scores]
+
+# This function runs the analysis of a window in a worker process, with its console output kept together
+# Output:
+# - result of analyzeWindow and text of the console output of the window (printed by the main process)
+def analyzeWindowCaptured(window):
+  window_output = io.StringIO()
+  with contextlib.redirect_stdout(window_output), contextlib.redirect_stderr(window_output):
+    window_result = analyzeWindow(window)
+  return [window_result, window_output.getvalue()]
+
+# Add a window for each session of multisport files, mapped to the record offsets of the session index
+analysis_windows = project_conf_windows[:]
+nb_sessions = min([len(ff_sessions[ffile]) for ffile in fitfiles])
+if (project_conf_session_analysis and (nb_sessions > 1)):
+  for s_idx in range(nb_sessions):
+    first_session = ff_sessions[fitfiles[0]][s_idx]
+    session_window = {}
+    session_window['name'] = "session%i_%s" % (s_idx+1, first_session[0])
+    session_window['range'] = [first_session[3], first_session[3] + first_session[2]]
+    session_window['offsets'] = {}
+    for ffile in fitfiles:
+      session_window['offsets'][ffile] = [ff_sessions[ffile][s_idx][4], ff_sessions[ffile][s_idx][5]]
+    analysis_windows.append(session_window)
+elif (project_conf_session_analysis):
+  print("NOTICE: Session analysis enabled, but the files do not contain several sessions")
+
+# Fingerprint of the fit files used by all the outputs (content and delta, in the order of the files)
+ff_inputs = []
+for ffile in fitfiles:
+  ff_inputs.append([ffile, ff_hashes[ffile], delta_values.get(ffile, 0)])
+
+# Read the manifest of the outputs of the previous runs of this project, to rebuild only the stale ones
+if (project_prefix != ''):
+  manifest_file = APP_PATH + project_prefix + "_" + 'manifest.json'
+else:
+  manifest_file = APP_PATH + 'manifest.json'
+artifact_manifest = {}
+if (os.path.isfile(manifest_file)):
+  with open(manifest_file, 'r') as fmanifest:
+    artifact_manifest = json.load(fmanifest)
+  if (args.debug): print("[debug] Manifest %s contains %i artifacts" % (manifest_file, len(artifact_manifest)))
+
+# Run the analysis of each zoom window (the complete activity if no zoom is configured) and each session
+project_base_prefix = project_prefix
+project_logfile = flog_file
+if (project_conf_parallel and (len(analysis_windows) > 1) and ('fork' not in multiprocessing.get_all_start_methods())):
+  print("NOTICE: Parallel processing needs forked processes, not available on this platform: the windows are processed one after the other")
+if (project_conf_parallel and (len(analysis_windows) > 1) and ('fork' in multiprocessing.get_all_start_methods())):
+  # The windows are independent: each one is processed in a forked process, sharing the decoded data
+  # The console output of each window is printed at once, in the order of the windows
+  window_results = []
+  with concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context('fork')) as executor:
+    for window_result, window_output in executor.map(analyzeWindowCaptured, analysis_windows):
+      print(window_output, end='')
+      window_results.append(window_result)
+else:
+  window_results = [analyzeWindow(window) for window in analysis_windows]
+window_scores = {}
+for window, window_result in zip(analysis_windows, window_results):
+  artifact_manifest.update(window_result[0])
+  window_scores['' if window['name'] == None else window['name']] = window_result[1]
+
+# Save the manifest with the fingerprints of the rebuilt outputs
+with open(manifest_file, 'w') as fmanifest:
+  json.dump(artifact_manifest, fmanifest, indent=2, sort_keys=True)
+
+# Index the summaries, tags and scores of the project
+if (project_conf_index):
+  indexProject(window_scores)
+
+# Generate an example config file
+# Get all sessions if more than 1 (from the session index, no new parsing of the files)
+all_sessions = ff_sessions[fitfiles[0]]
     
 fexconf = open(APP_PATH + "project.yaml.example", "w")
 fexconf.write('project:\n')
 fexconf.write('  align: False\n')
 # If multisession:
-if (len(all_sessions) > 1):
-  i = 0
-  for session in all_sessions_start:   
-    this_start = np.amax(session)
-    if (i >= 1):
-      fexconf.write('  zoom: [%i, %i] # %s\n' % (old_start, this_start, all_sessions[i-1][0]))
-    old_start = this_start
-    i += 1
-  fexconf.write('  zoom: [%i, %i] # %s\n' % (old_start, len(common_timestamp), all_sessions[i-1][0]))
+if (nb_sessions > 1):
+  fexconf.write('  sessionAnalysis: true\n')
+  fexconf.write('  zooms:\n')
+  for s_idx in range(nb_sessions):
+    this_start = max([ff_sessions[ffile][s_idx][3] for ffile in fitfiles])
+    this_end = max([ff_sessions[ffile][s_idx][3] + ff_sessions[ffile][s_idx][2] for ffile in fitfiles])
+    fexconf.write('    - name: %s\n' % (all_sessions[s_idx][0]))
+    fexconf.write('      range: [%i, %i]\n' % (this_start, this_end))
 else:
   # Not multisession, an arbitrary example
   fexconf.write('  zoom: [90, 120]\n')
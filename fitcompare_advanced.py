@@ -1,4 +1,11 @@
+import os
+import math
+import warnings
 import numpy as np
+from scipy.spatial import cKDTree
+from scipy.stats import theilslopes
+from scipy.signal import welch
+from scipy.interpolate import CubicSpline
 
 # This function find the closest value to "value" in "array"
 def find_nearest_value(array, value):
@@ -63,24 +70,760 @@ def bpm_new_point(cur_bpm, ts, average_hr_gap, ff_data, reference_file, a_positi
 def adv_hr_sum(average_hr_gap):
   # Average BPM diff:
   avg_bpm_gap_final = sum(average_hr_gap['average']) / len(average_hr_gap['average']) 
-  # Score of average bpm
-  if (avg_bpm_gap_final <= 0.5):
-    avg_bpm_coef = 0
-  else:
-    avg_bpm_coef = abs(avg_bpm_gap_final) - 0.5
-  hr_gap_score = avg_bpm_coef*10
-  if (hr_gap_score >= 60):
-    hr_gap_score = 60
-  if (average_hr_gap['max'] <= 80):
-    max_bpm_gap_score = abs(average_hr_gap['max']/1.7)
-  else:
-    max_bpm_gap_score = 50
-
-  hr_score = 100 - (hr_gap_score + max_bpm_gap_score)
+  hr_score_final = float(score_curve(avg_bpm_gap_final, average_hr_gap['max']))
   
   returnValues = {}
   returnValues['average_gap'] = avg_bpm_gap_final
   returnValues['max_gap'] = average_hr_gap['max']
   returnValues['max_gap_position'] = average_hr_gap['max_position']
-  returnValues['hr_score'] = hr_score
-  return returnValues
\ No newline at end of file
+  returnValues['hr_score'] = hr_score_final
+  return returnValues
+
+# This function projects WGS84 positions (degrees) to a local metric frame (equirectangular, centered on lat0/long0)
+# Precise enough for the extent of an activity, and fully vectorized
+def local_metric_projection(lat, long, lat0, long0):
+  earth_radius = 6371008.8
+  x = np.radians(np.asarray(long, dtype=float) - long0) * earth_radius * np.cos(np.radians(lat0))
+  y = np.radians(np.asarray(lat, dtype=float) - lat0) * earth_radius
+  return np.column_stack((x, y))
+
+# This function computes the cross-track error (m) of each device point against a reference track
+# Input:
+# - ref_xy: reference track points (n, 2) in local metric frame, in recording order
+# - dev_xy: device points (m, 2) in the same frame
+# - neighbours: number of nearest reference points queried in the spatial index
+# Output:
+# - array (m) of distances to the closest reference segment
+def cross_track_error(ref_xy, dev_xy, neighbours=4):
+  if (len(ref_xy) == 0) or (len(dev_xy) == 0):
+    return np.zeros(0)
+  if (len(ref_xy) < 2):
+    return np.sqrt(((np.asarray(dev_xy, dtype=float) - ref_xy[0])**2).sum(axis=-1))
+  return route_projection(ref_xy, dev_xy, neighbours)[1]
+
+# This function projects device points on the closest segment of a reference route, found through a spatial index
+# With expected along-track distances, the segments further than band from them are not candidates (loops, out-and-back routes)
+# Input:
+# - ref_xy: reference route points (n >= 2, 2) in local metric frame, in recording order
+# - dev_xy: device points (m, 2) in the same frame
+# - neighbours: number of nearest reference points queried in the spatial index
+# - expected / band: optional array (m) of the expected along-track distance of each point, and maximum gap (m) to it
+# Output:
+# - array (m) of the along-track distance (m) of the projections on the route, array (m) of the distance (m) to the route
+def route_projection(ref_xy, dev_xy, neighbours=4, expected=None, band=None):
+  ref_xy = np.asarray(ref_xy, dtype=float)
+  dev_xy = np.asarray(dev_xy, dtype=float)
+  tree = cKDTree(ref_xy)
+  neighbours = min(neighbours, len(ref_xy))
+  idx = tree.query(dev_xy, k=neighbours)[1].reshape(len(dev_xy), -1)
+  # Each nearest point is the end of a segment and the start of the next one
+  seg_start = np.clip(np.concatenate((idx - 1, idx), axis=1), 0, len(ref_xy) - 2)
+  seg_a = ref_xy[seg_start]
+  seg_ab = ref_xy[seg_start + 1] - seg_a
+  seg_ap = dev_xy[:, None, :] - seg_a
+  seg_len2 = (seg_ab * seg_ab).sum(axis=-1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    proj = np.where(seg_len2 > 0, (seg_ap * seg_ab).sum(axis=-1) / seg_len2, 0)
+  proj = np.clip(proj, 0, 1)
+  seg_gap = seg_ap - proj[..., None] * seg_ab
+  gap_dist = np.sqrt((seg_gap * seg_gap).sum(axis=-1))
+  route_dist = np.concatenate(([0], np.cumsum(np.sqrt((np.diff(ref_xy, axis=0)**2).sum(axis=-1)))))
+  along = route_dist[seg_start] + proj * np.sqrt(seg_len2)
+  candidate_dist = gap_dist
+  if (expected is not None):
+    # A point without candidate in the band keeps its closest segment
+    out_of_band = np.abs(along - np.asarray(expected, dtype=float)[:, None]) > band
+    candidate_dist = np.where(out_of_band & ~out_of_band.all(axis=1)[:, None], np.inf, gap_dist)
+  best = np.argmin(candidate_dist, axis=1)
+  rows = np.arange(len(dev_xy))
+  return along[rows, best], gap_dist[rows, best]
+
+# This function summarizes an error distribution (median, p95, max)
+def error_distribution(errors):
+  errors = np.asarray(errors, dtype=float)
+  errors = errors[~np.isnan(errors)]
+  returnValues = {}
+  returnValues['points'] = len(errors)
+  if (len(errors) == 0):
+    returnValues['median'] = None
+    returnValues['p95'] = None
+    returnValues['max'] = None
+    return returnValues
+  returnValues['median'] = float(np.median(errors))
+  returnValues['p95'] = float(np.percentile(errors, 95))
+  returnValues['max'] = float(errors.max())
+  return returnValues
+
+# This function computes the gap of each point of several devices against the reference, in a single vectorized pass
+# Generalization of bpm_new_point / reduce_latency: the gap is computed from the point "start",
+# against the closest reference value in the last "latency_window" points (current point included)
+# Input:
+# - columns: array (devices, points) of values (NaN if no value)
+# - ref_column: array (points) of the reference values, aligned with columns
+# - metric: 'absolute' (unit of the field) or 'relative' (percentage of the reference value)
+# Output:
+# - array (devices, points) of the gap for each point (NaN when not computed)
+def field_gaps(columns, ref_column, latency_window=1, start=0, metric='absolute'):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  ref_column = np.asarray(ref_column, dtype=float)
+  nb_points = min(columns.shape[1], len(ref_column))
+  columns = columns[:, :nb_points]
+  ref_column = ref_column[:nb_points]
+  # Reference values padded at the beginning of the activity
+  padded_ref = np.concatenate((np.full(latency_window - 1, np.nan), ref_column))
+  gaps = np.full(columns.shape, np.inf)
+  for shift in range(latency_window):
+    shift_ref = padded_ref[shift:shift + nb_points]
+    with np.errstate(invalid='ignore', divide='ignore'):
+      shift_gaps = np.abs(columns - shift_ref)
+      if (metric == 'relative'):
+        shift_gaps = shift_gaps * 100 / np.abs(shift_ref)
+    shift_gaps[np.isnan(shift_gaps)] = np.inf
+    np.minimum(gaps, shift_gaps, out=gaps)
+  gaps[np.isinf(gaps)] = np.nan
+  # Points not analyzed: before start, no value on the device, no value on the reference
+  gaps[:, :start] = np.nan
+  gaps[np.isnan(columns) | np.isnan(ref_column)[None, :]] = np.nan
+  return gaps
+
+# This function computes the score from the average and max gap (works on single values or arrays)
+# The default curve is the HR score
+def score_curve(average_gap, max_gap, tolerance=0.5, averageFactor=10, averageMax=60, maxFactor=1.7, maxLimit=80, maxScore=50):
+  average_gap = np.asarray(average_gap, dtype=float)
+  max_gap = np.asarray(max_gap, dtype=float)
+  # Score of average gap
+  average_coef = np.where(average_gap <= tolerance, 0, np.abs(average_gap) - tolerance)
+  average_gap_score = np.minimum(average_coef*averageFactor, averageMax)
+  # Score of max gap
+  max_gap_score = np.where(max_gap <= maxLimit, np.abs(max_gap/maxFactor), maxScore)
+  return 100 - (average_gap_score + max_gap_score)
+
+# This function computes the average gap, max gap (and position) and score of each device from the gaps array
+# Input:
+# - gaps: array (devices, points) from field_gaps
+# - curve: dict of score_curve parameters
+# Output:
+# - dict of arrays (devices): average_gap, max_gap, max_gap_position (1 is the first point), score
+def score_fields(gaps, curve):
+  gaps = np.atleast_2d(gaps)
+  valid = ~np.isnan(gaps)
+  nb_valid = valid.sum(axis=1)
+  masked_max = np.where(valid, gaps, -np.inf)
+  returnValues = {}
+  with np.errstate(invalid='ignore', divide='ignore'):
+    returnValues['average_gap'] = np.where(valid, gaps, 0).sum(axis=1) / nb_valid
+  returnValues['max_gap'] = np.where(nb_valid > 0, masked_max.max(axis=1), np.nan)
+  returnValues['max_gap_position'] = masked_max.argmax(axis=1) + 1
+  returnValues['score'] = score_curve(returnValues['average_gap'], returnValues['max_gap'], **curve)
+  returnValues['points'] = nb_valid
+  return returnValues
+
+# This function computes the agreement of all the pairs of devices, in a single broadcast pass over the aligned arrays
+# Input:
+# - columns: array (devices, points) of aligned values (NaN if no value)
+# - latency_window: the gap is computed against the closest value of the other device in this number of points
+# - start: number of points ignored at the beginning of the activity
+# - metric: 'absolute' or 'relative' (see field_gaps)
+# Output:
+# - mean gap and max gap matrices (devices, devices): row is the device, column the device it is compared to
+def pairwise_agreement(columns, latency_window=1, start=0, metric='absolute'):
+  columns = np.asarray(columns, dtype=float)
+  nb_devices, nb_points = columns.shape
+  padded = np.concatenate((np.full((nb_devices, latency_window - 1), np.nan), columns), axis=1)
+  pair_gaps = np.full((nb_devices, nb_devices, nb_points), np.inf)
+  for shift in range(latency_window):
+    shift_ref = padded[None, :, shift:shift + nb_points]
+    with np.errstate(invalid='ignore', divide='ignore'):
+      shift_gaps = np.abs(columns[:, None, :] - shift_ref)
+      if (metric == 'relative'):
+        shift_gaps = shift_gaps * 100 / np.abs(shift_ref)
+    shift_gaps[np.isnan(shift_gaps)] = np.inf
+    np.minimum(pair_gaps, shift_gaps, out=pair_gaps)
+  # Points without value on the device or on the compared device are not analyzed
+  valid = ~np.isinf(pair_gaps)
+  valid[:, :, :start] = False
+  valid &= ~np.isnan(columns)[None, :, :]
+  nb_valid = valid.sum(axis=-1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean_gap = np.where(valid, pair_gaps, 0).sum(axis=-1) / nb_valid
+  max_gap = np.where(valid, pair_gaps, -np.inf).max(axis=-1)
+  max_gap[nb_valid == 0] = np.nan
+  return mean_gap, max_gap
+
+# This function gives, for each point of a time grid, the index of the closest sample in time
+# Input:
+# - times: sorted array of the sample times (s)
+# - grid: array of the grid times (s)
+# - max_gap: a grid point further than max_gap / 2 from any sample has no sample
+# Output:
+# - array of the sample index for each grid point (-1 if none)
+def nearest_sample(times, grid, max_gap):
+  times = np.asarray(times, dtype=float)
+  if (len(times) == 0):
+    return np.full(len(grid), -1)
+  right = np.clip(np.searchsorted(times, grid), 0, len(times) - 1)
+  left = np.clip(right - 1, 0, len(times) - 1)
+  nearest = np.where(np.abs(times[left] - grid) <= np.abs(times[right] - grid), left, right)
+  return np.where(np.abs(times[nearest] - grid) <= max_gap / 2, nearest, -1)
+
+# This function resamples a column on a time grid by linear interpolation, without bridging the gaps longer than max_gap
+# Input:
+# - times: sorted array of the sample times (s)
+# - values: array of the sample values (NaN if no value)
+# - grid: array of the grid times (s)
+# - max_gap: maximum time (s) between two samples to interpolate between them
+# Output:
+# - array of the values on the grid (NaN if the grid point is in a gap or outside of the samples)
+def resample_column(times, values, grid, max_gap):
+  valid = ~np.isnan(values)
+  times = np.asarray(times, dtype=float)[valid]
+  values = values[valid]
+  if (len(times) == 0):
+    return np.full(len(grid), np.nan)
+  resampled = np.interp(grid, times, values)
+  # Samples around each grid point: a grid point on a sample is always kept
+  right = np.clip(np.searchsorted(times, grid), 0, len(times) - 1)
+  left = np.clip(right - 1, 0, len(times) - 1)
+  on_sample = (times[right] == grid)
+  in_gap = ((times[right] - times[left]) > max_gap) | (grid < times[0]) | (grid > times[-1])
+  resampled[in_gap & ~on_sample] = np.nan
+  return resampled
+
+# This function computes the statistics of each segment (lap...) of aligned columns, with segmented reductions (no loop over the points)
+# Input:
+# - columns: array (devices, points) of aligned values (NaN if no value)
+# - starts: strictly increasing array of the first point of each segment (a segment ends at the start of the next one, the last one at the last point)
+# Output:
+# - dict of arrays (devices, segments): points (with a value), mean, max, range (max - min), gain / loss (sum of the positive / negative steps inside the segment)
+def segment_statistics(columns, starts):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  starts = np.asarray(starts, dtype=int)
+  valid = ~np.isnan(columns)
+  points = np.add.reduceat(valid.astype(int), starts, axis=1)
+  total = np.add.reduceat(np.where(valid, columns, 0), starts, axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = np.where(points > 0, total / points, np.nan)
+  seg_max = np.fmax.reduceat(columns, starts, axis=1)
+  seg_min = np.fmin.reduceat(columns, starts, axis=1)
+  # Step into each point, the step between two segments is not counted
+  steps = np.nan_to_num(np.diff(columns, axis=1, prepend=np.nan))
+  steps[:, starts] = 0
+  gain = np.add.reduceat(np.clip(steps, 0, None), starts, axis=1)
+  loss = np.add.reduceat(np.clip(-steps, 0, None), starts, axis=1)
+  return {'points': points, 'mean': mean, 'max': seg_max, 'range': seg_max - seg_min, 'gain': gain, 'loss': loss}
+
+# This function computes the cumulative distance along a track with the haversine formula, in a single vectorized pass
+# Input:
+# - lat / long: arrays of the positions (degrees)
+# Output:
+# - array of the cumulative distance (m) at each position, 0 at the first one
+def track_distance(lat, long):
+  earth_radius = 6371008.8
+  lat = np.radians(np.asarray(lat, dtype=float))
+  long = np.radians(np.asarray(long, dtype=float))
+  if (len(lat) == 0):
+    return np.array([])
+  haversine = np.sin(np.diff(lat) / 2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(long) / 2)**2
+  steps = 2 * earth_radius * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+  return np.concatenate(([0], np.cumsum(steps)))
+
+# Classes of the heart rate artifacts (index is the class of a point in hr_artifacts)
+HR_ARTIFACT_CLASSES = ['none', 'dropout', 'spike', 'slope', 'flatline']
+
+# This function computes a rolling median of each row, centered on each point (NaN values are ignored)
+# Input:
+# - columns: array (devices, points)
+# - window: number of points of the rolling window (odd)
+# Output:
+# - array (devices, points) of the rolling median (NaN if the window has no value)
+def rolling_median(columns, window):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  half_window = window // 2
+  padded = np.pad(columns, ((0, 0), (half_window, half_window)), constant_values=np.nan)
+  windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * half_window + 1, axis=1)
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    return np.nanmedian(windows, axis=-1)
+
+# This function classifies each point of heart rate columns (optical sensor dropouts, spikes, steep slopes, flat lines), in vectorized passes over the whole arrays
+# Input:
+# - columns: array (devices, points) of heart rate values (NaN if no value)
+# - missing: array (devices, points), True for the points without value in the file (forward-filled when loaded)
+# - window: number of points of the rolling median and MAD
+# - madThreshold: a spike is further than madThreshold MAD (scaled to a standard deviation) from the rolling median...
+# - minDeviation: ...and further than minDeviation bpm
+# - maxSlope: maximum change between two points (bpm)
+# - flatline: minimum number of identical consecutive values of a flat line
+# Output:
+# - array (devices, points) of the class of each point (index in HR_ARTIFACT_CLASSES, 0 is no artifact)
+def hr_artifacts(columns, missing=None, window=61, madThreshold=4, minDeviation=15, maxSlope=15, flatline=30):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  classes = np.zeros(columns.shape, dtype=int)
+  valid = ~np.isnan(columns)
+  # Flat line: runs of identical consecutive values, numbered across all the rows
+  run_starts = np.ones(columns.shape, dtype=bool)
+  run_starts[:, 1:] = (columns[:, 1:] != columns[:, :-1])
+  run_ids = np.cumsum(run_starts.ravel()) - 1
+  run_lengths = np.bincount(run_ids)[run_ids].reshape(columns.shape)
+  classes[valid & (run_lengths >= flatline)] = 4
+  # Spike: far from the rolling median, in number of MAD
+  median = rolling_median(columns, window)
+  deviation = np.abs(columns - median)
+  mad = rolling_median(deviation, window) * 1.4826
+  with np.errstate(invalid='ignore'):
+    spikes = (deviation > np.maximum(madThreshold * mad, minDeviation))
+  # Steep slope: step into the point (the return from a spike is part of the spike)
+  steps = np.nan_to_num(np.abs(np.diff(columns, axis=1, prepend=np.nan)))
+  steep = (steps > maxSlope)
+  steep[:, 1:] &= ~spikes[:, :-1]
+  classes[steep] = 3
+  classes[spikes] = 2
+  # Dropout: no value on the device
+  dropout = ~valid
+  if (missing is not None):
+    dropout |= np.asarray(missing, dtype=bool)
+  classes[dropout] = 1
+  return classes
+
+# This function returns the segments of consecutive flagged points
+# Input:
+# - flags: array (points) of booleans
+# Output:
+# - array (segments, 2) of the first and last point of each segment
+def flagged_segments(flags):
+  edges = np.diff(np.concatenate(([0], np.asarray(flags, dtype=int), [0])))
+  return np.column_stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1))
+
+# This function estimates the discharge rate of a battery series with a robust linear regression (Theil-Sen), with its confidence interval
+# The battery is an integer percentage: only the first point of each level (and the last point) are used, so the pairwise slopes stay small
+# Input:
+# - times: array of the times of the points (s)
+# - values: array of the battery levels (%, NaN if no value)
+# - confidence: confidence level of the interval of the rate
+# - max_points: the points used are subsampled above this number
+# Output:
+# - dict: rate / rate_low / rate_high (%/hr, positive when discharging), intercept (% at time 0) and points (used), None if the series is too short
+def discharge_rate(times, values, confidence=0.95, max_points=2000):
+  times = np.asarray(times, dtype=float)
+  values = np.asarray(values, dtype=float)
+  valid = ~np.isnan(values)
+  times = times[valid]
+  values = values[valid]
+  if ((len(times) < 2) or (times[-1] <= times[0])):
+    return None
+  level_starts = np.concatenate(([True], np.diff(values) != 0))
+  level_starts[-1] = True
+  times = times[level_starts]
+  values = values[level_starts]
+  if (len(times) > max_points):
+    subsample = np.unique(np.linspace(0, len(times) - 1, max_points).astype(int))
+    times = times[subsample]
+    values = values[subsample]
+  slope, intercept, slope_low, slope_high = theilslopes(values, times, confidence)
+  return {'rate': float(0 - slope * 3600), 'rate_low': float(0 - slope_high * 3600), 'rate_high': float(0 - slope_low * 3600), 'intercept': float(intercept), 'points': len(times)}
+
+# This function computes the time in each HR zone of each device, and the zone confusion matrices against the reference, in one digitize / bincount pass
+# Input:
+# - columns: array (devices, points) of aligned heart rate values (NaN if no value)
+# - ref_column: array (points) of the reference values, aligned with columns (None: no confusion matrix)
+# - bounds: increasing lower bounds of the zones 2..N (the first zone is below the first bound)
+# Output:
+# - array (devices, zones) of the number of points in each zone
+# - array (devices, reference zones, device zones) of the number of points, or None
+def zone_agreement(columns, ref_column, bounds):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  nb_devices, nb_points = columns.shape
+  nb_zones = len(bounds) + 1
+  zones = np.digitize(columns, bounds)
+  valid = ~np.isnan(columns)
+  # Offset of each device, to count all the devices in a single bincount
+  device_offsets = np.arange(nb_devices)[:, None] * nb_zones
+  time_in_zone = np.bincount((zones + device_offsets)[valid], minlength=nb_devices * nb_zones).reshape(nb_devices, nb_zones)
+  if (ref_column is None):
+    return time_in_zone, None
+  ref_column = np.asarray(ref_column, dtype=float)[:nb_points]
+  ref_zones = np.digitize(ref_column, bounds)
+  valid &= ~np.isnan(ref_column)[None, :]
+  confusion_index = device_offsets * nb_zones + ref_zones[None, :] * nb_zones + zones
+  confusion = np.bincount(confusion_index[valid], minlength=nb_devices * nb_zones * nb_zones).reshape(nb_devices, nb_zones, nb_zones)
+  return time_in_zone, confusion
+
+# This function computes the agreement statistics of paired series (batched on the leading axes)
+# Input:
+# - x / y: arrays (..., points) of the device and reference values (no NaN)
+# Output:
+# - dict of arrays (...): bias (mean of x - y), loa_low / loa_high (limits of agreement, bias -/+ 1.96 SD), mae, rmse, ccc (Lin's concordance)
+def agreement_statistics(x, y):
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  diff = x - y
+  bias = diff.mean(axis=-1)
+  diff_sd = diff.std(axis=-1, ddof=1)
+  mean_x = x.mean(axis=-1)
+  mean_y = y.mean(axis=-1)
+  covariance = ((x - mean_x[..., None]) * (y - mean_y[..., None])).mean(axis=-1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    ccc = 2 * covariance / (x.var(axis=-1) + y.var(axis=-1) + (mean_x - mean_y)**2)
+  return {'bias': bias, 'loa_low': bias - 1.96 * diff_sd, 'loa_high': bias + 1.96 * diff_sd,
+          'mae': np.abs(diff).mean(axis=-1), 'rmse': np.sqrt((diff**2).mean(axis=-1)), 'ccc': ccc}
+
+# This function computes the confidence intervals of the agreement statistics with a moving block bootstrap
+# The resamples are built as index arrays and computed in batches (no loop over the resamples)
+# Input:
+# - x / y: arrays (points) of the paired device and reference values (no NaN)
+# - nb_resamples: number of bootstrap resamples
+# - block: length of the blocks (points), to keep the autocorrelation of the series
+# - confidence: confidence level of the intervals
+# - seed: seed of the random generator (reproducible outputs)
+# Output:
+# - dict of [low, high] for each statistic of agreement_statistics
+def block_bootstrap(x, y, nb_resamples=1000, block=60, confidence=0.95, seed=0):
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  nb_points = len(x)
+  block = max(1, min(block, nb_points))
+  nb_blocks = -(-nb_points // block)
+  rng = np.random.default_rng(seed)
+  # Batches of resamples limited to a few million values
+  batch_size = max(1, 4000000 // (nb_blocks * block))
+  resampled = {}
+  for batch_start in range(0, nb_resamples, batch_size):
+    batch_resamples = min(batch_size, nb_resamples - batch_start)
+    block_starts = rng.integers(0, nb_points - block + 1, size=(batch_resamples, nb_blocks))
+    indexes = (block_starts[:, :, None] + np.arange(block)[None, None, :]).reshape(batch_resamples, -1)[:, :nb_points]
+    batch_statistics = agreement_statistics(x[indexes], y[indexes])
+    for statistic in batch_statistics:
+      resampled.setdefault(statistic, []).append(batch_statistics[statistic])
+  tail = (1 - confidence) / 2 * 100
+  intervals = {}
+  for statistic in resampled:
+    intervals[statistic] = np.nanpercentile(np.concatenate(resampled[statistic]), [tail, 100 - tail])
+  return intervals
+
+# This function computes the rolling bias and MAE of the differences against the reference, in O(N) with cumulative sums
+# Input:
+# - diff: array (devices, points) of the differences device - reference (NaN if not analyzed)
+# - window: number of points of the rolling window (the value of a point is computed on the window ending at this point)
+# - min_points: minimum number of values in a window (default: half of the window)
+# Output:
+# - dict of arrays (devices, points): bias and mae (NaN if the window has not enough values)
+def rolling_agreement(diff, window, min_points=None):
+  diff = np.atleast_2d(np.asarray(diff, dtype=float))
+  if (min_points == None):
+    min_points = max(1, window // 2)
+  valid = ~np.isnan(diff)
+  padding = np.zeros((diff.shape[0], 1))
+  # Cumulative sums with a leading 0, the sum of a window is the difference of two of them
+  sum_diff = np.concatenate((padding, np.cumsum(np.where(valid, diff, 0), axis=1)), axis=1)
+  sum_abs = np.concatenate((padding, np.cumsum(np.where(valid, np.abs(diff), 0), axis=1)), axis=1)
+  count = np.concatenate((padding, np.cumsum(valid, axis=1)), axis=1)
+  window_start = np.maximum(np.arange(1, diff.shape[1] + 1) - window, 0)
+  window_end = np.arange(1, diff.shape[1] + 1)
+  window_count = count[:, window_end] - count[:, window_start]
+  enough = (window_count >= min_points) & (window_end >= window)[None, :]
+  with np.errstate(invalid='ignore', divide='ignore'):
+    bias = np.where(enough, (sum_diff[:, window_end] - sum_diff[:, window_start]) / window_count, np.nan)
+    mae = np.where(enough, (sum_abs[:, window_end] - sum_abs[:, window_start]) / window_count, np.nan)
+  return {'bias': bias, 'mae': mae}
+
+# This function returns the worst non-overlapping windows of a rolling series
+# Input:
+# - series: array (points) of a rolling value (window ending at each point, NaN if no value)
+# - window: number of points of the rolling window
+# - nb_windows: number of windows to return
+# Output:
+# - list of [first point, last point, value] of the worst windows, worst first
+def worst_windows(series, window, nb_windows):
+  series = np.array(series, dtype=float)
+  worst = []
+  for window_idx in range(nb_windows):
+    if (np.all(np.isnan(series))):
+      break
+    window_end = int(np.nanargmax(series))
+    worst.append([max(window_end - window + 1, 0), window_end, float(series[window_end])])
+    # The windows overlapping this one are excluded
+    series[max(window_end - window + 1, 0):window_end + window] = np.nan
+  return worst
+
+# This function detects the pauses (auto-pause) and recording gaps of a file from its timestamps
+# Input:
+# - times: sorted array of the times of the points (s)
+# - threshold: a step between two points longer than threshold seconds is a gap
+# Output:
+# - array of the offsets of the first point after each gap, array of the duration of each gap (s)
+def timestamp_gaps(times, threshold):
+  steps = np.diff(np.asarray(times, dtype=float))
+  gap_idx = np.flatnonzero(steps > threshold)
+  return gap_idx + 1, steps[gap_idx]
+
+# This function returns the boundaries of the segments of consecutive valid values of a series, also split at the given offsets
+# Input:
+# - values: array (points), NaN if no value
+# - split_offsets: offsets of the first point of new segments (gaps), none by default
+# Output:
+# - list of [first point, end point (excluded)] of the segments with values
+def valid_segments(values, split_offsets=None):
+  if (split_offsets is None):
+    split_offsets = []
+  valid = ~np.isnan(np.asarray(values, dtype=float))
+  if (len(valid) == 0):
+    return []
+  boundaries = np.union1d(np.flatnonzero(np.diff(valid.astype(int))) + 1, split_offsets)
+  boundaries = np.concatenate(([0], boundaries[(boundaries > 0) & (boundaries < len(valid))], [len(valid)])).astype(int)
+  return [[int(boundaries[idx]), int(boundaries[idx+1])] for idx in range(len(boundaries) - 1) if valid[boundaries[idx]]]
+
+# Sampling rate of the resampled RR series (Hz)
+HRV_RESAMPLE_RATE = 4
+# Frequency bands of the HRV spectrum (Hz)
+HRV_BANDS = {'lf': [0.04, 0.15], 'hf': [0.15, 0.4]}
+
+# This function resamples a RR series (one value per beat) to an evenly spaced signal, by cubic spline interpolation at the beat times
+# Input:
+# - rr: array of the RR intervals (ms)
+# - rate: sampling rate of the signal (Hz)
+# Output:
+# - array of the RR signal (ms), the first value is at the time of the first beat
+def rr_resample(rr, rate=HRV_RESAMPLE_RATE):
+  rr = np.asarray(rr, dtype=float)
+  # The beat times must be strictly increasing
+  rr = rr[rr > 0]
+  if (len(rr) < 2):
+    return np.array([])
+  beat_times = np.cumsum(rr) / 1000
+  return CubicSpline(beat_times, rr)(np.arange(beat_times[0], beat_times[-1], 1 / rate))
+
+# This function computes the LF and HF powers of a RR signal over sliding windows
+# The windows are views of the signal and their Welch spectra are computed in batches (no loop over the windows)
+# Input:
+# - signal: array of the RR signal resampled at rate (ms)
+# - rate: sampling rate of the signal (Hz)
+# - window / step: length and step of the sliding windows (s)
+# - segment: length of the Welch segments in a window (s, 50% overlap)
+# Output:
+# - dict of arrays (windows): time (center of the window, s from the first beat), lf and hf (ms²), lf_hf (ratio)
+def hrv_spectrum(signal, rate=HRV_RESAMPLE_RATE, window=300, step=30, segment=120):
+  signal = np.asarray(signal, dtype=float)
+  window_points = int(window * rate)
+  step_points = max(1, int(step * rate))
+  spectrum = {'time': np.array([]), 'lf': np.array([]), 'hf': np.array([]), 'lf_hf': np.array([])}
+  if ((window_points < 2) or (len(signal) < window_points)):
+    return spectrum
+  windows = np.lib.stride_tricks.sliding_window_view(signal, window_points)[::step_points]
+  segment_points = min(int(segment * rate), window_points)
+  # Batches of windows limited to a few million values
+  batch_size = max(1, 4000000 // window_points)
+  powers = {band: [] for band in HRV_BANDS}
+  for batch_start in range(0, len(windows), batch_size):
+    freqs, psd = welch(windows[batch_start:batch_start + batch_size], fs=rate, nperseg=segment_points, detrend='linear', axis=-1)
+    for band in HRV_BANDS:
+      band_mask = (freqs >= HRV_BANDS[band][0]) & (freqs < HRV_BANDS[band][1])
+      powers[band].append(psd[:, band_mask].sum(axis=-1) * (freqs[1] - freqs[0]))
+  spectrum['time'] = (np.arange(len(windows)) * step_points + window_points / 2) / rate
+  for band in HRV_BANDS:
+    spectrum[band] = np.concatenate(powers[band])
+  with np.errstate(invalid='ignore', divide='ignore'):
+    spectrum['lf_hf'] = np.where(spectrum['hf'] > 0, spectrum['lf'] / spectrum['hf'], np.nan)
+  return spectrum
+
+# Value of the points without data of the DEM tiles
+HGT_VOID = -32768
+# DEM tiles already opened (memory-mapped), by directory and south-west corner
+DEM_TILE_CACHE = {}
+
+# This function opens a DEM tile (SRTM / Copernicus .hgt: square grid of big-endian int16, 1x1 degree, first row at the north edge)
+# The tile is memory-mapped, only the pages of the sampled points are read, and kept in the cache
+# Input:
+# - directory: directory of the tiles
+# - lat_floor / long_floor: south-west corner of the tile (degrees)
+# Output:
+# - array (rows, columns) of the elevations (m), None if there is no tile
+def dem_tile(directory, lat_floor, long_floor):
+  tile_key = (directory, lat_floor, long_floor)
+  if (tile_key not in DEM_TILE_CACHE):
+    tile_name = "%s%02i%s%03i.hgt" % ('N' if lat_floor >= 0 else 'S', abs(lat_floor), 'E' if long_floor >= 0 else 'W', abs(long_floor))
+    tile_path = os.path.join(directory, tile_name)
+    DEM_TILE_CACHE[tile_key] = None
+    if (os.path.isfile(tile_path)):
+      tile_side = math.isqrt(os.path.getsize(tile_path) // 2)
+      if ((tile_side >= 2) and (tile_side * tile_side * 2 == os.path.getsize(tile_path))):
+        DEM_TILE_CACHE[tile_key] = np.memmap(tile_path, dtype='>i2', mode='r', shape=(tile_side, tile_side))
+  return DEM_TILE_CACHE[tile_key]
+
+# This function samples the elevation of the DEM tiles at positions, by bilinear interpolation
+# The positions are grouped by tile and each tile is sampled in a single vectorized pass
+# Input:
+# - directory: directory of the tiles
+# - lat / long: arrays of the positions (degrees, NaN if no position)
+# Output:
+# - array of the elevations (m), NaN without position, tile or data
+def dem_elevation(directory, lat, long):
+  lat = np.asarray(lat, dtype=float)
+  long = np.asarray(long, dtype=float)
+  elevation = np.full(len(lat), np.nan)
+  valid = ~np.isnan(lat) & ~np.isnan(long)
+  if (not valid.any()):
+    return elevation
+  lat_floor = np.floor(lat[valid]).astype(int)
+  long_floor = np.floor(long[valid]).astype(int)
+  valid_idx = np.flatnonzero(valid)
+  for tile_corner in np.unique(np.column_stack((lat_floor, long_floor)), axis=0):
+    tile = dem_tile(directory, int(tile_corner[0]), int(tile_corner[1]))
+    if (tile is None):
+      continue
+    in_tile = (lat_floor == tile_corner[0]) & (long_floor == tile_corner[1])
+    points_idx = valid_idx[in_tile]
+    tile_side = tile.shape[0]
+    row = (tile_corner[0] + 1 - lat[points_idx]) * (tile_side - 1)
+    col = (long[points_idx] - tile_corner[1]) * (tile_side - 1)
+    row0 = np.clip(np.floor(row).astype(int), 0, tile_side - 2)
+    col0 = np.clip(np.floor(col).astype(int), 0, tile_side - 2)
+    row_frac = (row - row0)[:, None]
+    col_frac = (col - col0)[:, None]
+    # The 4 corners of the cell of each point
+    corners = np.stack((tile[row0, col0], tile[row0, col0 + 1], tile[row0 + 1, col0], tile[row0 + 1, col0 + 1]), axis=1).astype(float)
+    corners[corners == HGT_VOID] = np.nan
+    weights = np.hstack(((1 - row_frac) * (1 - col_frac), (1 - row_frac) * col_frac, row_frac * (1 - col_frac), row_frac * col_frac))
+    elevation[points_idx] = (corners * weights).sum(axis=1)
+  return elevation
+
+# This function computes the rolling mean of aligned columns with cumulative sums (power...)
+# Input:
+# - columns: array (devices, points) of values (NaN if no value)
+# - window: number of points of the rolling window (the value of a point is computed on the window ending at this point)
+# Output:
+# - array (devices, points) of the rolling means (NaN if the window is not complete or has a missing value)
+def rolling_mean(columns, window):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  valid = ~np.isnan(columns)
+  padding = np.zeros((columns.shape[0], 1))
+  total = np.concatenate((padding, np.cumsum(np.where(valid, columns, 0), axis=1)), axis=1)
+  count = np.concatenate((padding, np.cumsum(valid, axis=1)), axis=1)
+  rolling = np.full(columns.shape, np.nan)
+  if (columns.shape[1] >= window):
+    window_total = total[:, window:] - total[:, :-window]
+    window_count = count[:, window:] - count[:, :-window]
+    rolling[:, window-1:] = np.where(window_count == window, window_total / window, np.nan)
+  return rolling
+
+# This function computes the normalized power of aligned power columns (4th power mean of the 30 s rolling power)
+# Input:
+# - columns: array (devices, points) of power values (NaN if no value)
+# - window: number of points of 30 s
+# Output:
+# - array (devices) of the normalized power (NaN if no complete window)
+def normalized_power(columns, window=30):
+  rolling = rolling_mean(columns, window)
+  valid = ~np.isnan(rolling)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return (np.where(valid, rolling**4, 0).sum(axis=1) / valid.sum(axis=1))**0.25
+
+# This function returns the durations of a mean-maximal curve: every point up to 60, then log-spaced up to the longest duration
+def curve_durations(nb_points, nb_log_durations=200):
+  if (nb_points < 1):
+    return np.array([], dtype=int)
+  durations = np.arange(1, min(nb_points, 60) + 1)
+  if (nb_points > 60):
+    durations = np.union1d(durations, np.unique(np.round(np.logspace(np.log10(60), np.log10(nb_points), nb_log_durations)).astype(int)))
+  return durations
+
+# This function computes the mean-maximal curve of aligned columns (best average over each duration)
+# Each duration is a single vectorized difference of the cumulative sums, the windows with a missing value are not used
+# Input:
+# - columns: array (devices, points) of values (NaN if no value)
+# - durations: array of the durations (points)
+# Output:
+# - array (devices, durations) of the mean-maximal values (NaN if no complete window)
+def mean_maximal(columns, durations):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  valid = ~np.isnan(columns)
+  padding = np.zeros((columns.shape[0], 1))
+  total = np.concatenate((padding, np.cumsum(np.where(valid, columns, 0), axis=1)), axis=1)
+  count = np.concatenate((padding, np.cumsum(valid, axis=1)), axis=1)
+  curve = np.full((columns.shape[0], len(durations)), np.nan)
+  i = 0
+  for duration in durations:
+    if (duration <= columns.shape[1]):
+      window_mean = np.where(count[:, duration:] - count[:, :-duration] == duration, (total[:, duration:] - total[:, :-duration]) / duration, -np.inf)
+      curve[:, i] = window_mean.max(axis=1)
+    i += 1
+  curve[np.isinf(curve)] = np.nan
+  return curve
+
+# This function estimates the lag of each device against the reference over sliding windows, from their cross-correlation
+# Each reference window is compared with the device windows shifted by every lag (the windows always overlap completely), the lag is the shift
+# with the smallest mean squared difference: unlike the normalized correlation, it also locates the shift of a linear rise or fall of the values
+# The cross-correlations of all the windows are computed in batches with FFTs and the sums of the shifted windows with cumulative sums
+# Input:
+# - columns: array (devices, points) of values (NaN if no value)
+# - ref_column: array (points) of the reference values
+# - window / step: length and step of the sliding windows (points)
+# - max_lag: longest lag searched (points), the lag of a window with its peak at the limit is max_lag
+# - min_corr: the windows with a lower correlation (Pearson) at the lag have no lag (flat or unrelated series)
+# - min_valid: minimum part of the points of a window with values in both series
+# Output:
+# - dict: center (array (windows) of the center point of each window), lag (array (devices, windows) in points, positive when the device is late, NaN if no lag)
+#   and corr (array (devices, windows) of the correlation at the lag)
+def lag_profile(columns, ref_column, window, step, max_lag, min_corr=0.5, min_valid=0.8):
+  columns = np.atleast_2d(np.asarray(columns, dtype=float))
+  ref_column = np.asarray(ref_column, dtype=float)
+  profile = {'center': np.array([]), 'lag': np.full((columns.shape[0], 0), np.nan), 'corr': np.full((columns.shape[0], 0), np.nan)}
+  if ((window < 3) or (len(ref_column) < window) or np.isnan(ref_column).all()):
+    return profile
+  step = max(1, int(step))
+  max_lag = max(1, min(int(max_lag), window - 1))
+  points = np.arange(len(ref_column))
+  ref_valid = ~np.isnan(ref_column)
+  # The missing values are interpolated, the windows with too many of them have no lag
+  ref_windows = np.lib.stride_tricks.sliding_window_view(np.interp(points, points[ref_valid], ref_column[ref_valid]), window)[::step]
+  nb_windows = len(ref_windows)
+  profile['center'] = np.arange(nb_windows) * step + (window - 1) / 2
+  profile['lag'] = np.full((columns.shape[0], nb_windows), np.nan)
+  profile['corr'] = np.full((columns.shape[0], nb_windows), np.nan)
+  lags = np.arange(-max_lag, max_lag + 1)
+  segment = window + 2 * max_lag
+  fft_size = int(2 ** np.ceil(np.log2(segment)))
+  # Batches of windows limited to a few million values
+  batch_size = max(1, 4000000 // fft_size)
+  for i in range(columns.shape[0]):
+    device_valid = ~np.isnan(columns[i])
+    if (not device_valid.any()):
+      continue
+    both_valid = np.lib.stride_tricks.sliding_window_view(ref_valid & device_valid, window)[::step].sum(axis=1) >= min_valid * window
+    # Device segments of window + 2 * max_lag points around each window (the ends are extended with the first / last value)
+    device_column = np.interp(points, points[device_valid], columns[i][device_valid])
+    device_column = np.concatenate((np.full(max_lag, device_column[0]), device_column, np.full(max_lag, device_column[-1])))
+    device_segments = np.lib.stride_tricks.sliding_window_view(device_column, segment)[::step]
+    for batch_start in range(0, nb_windows, batch_size):
+      # Both series are shifted by the mean of the reference window (the differences do not change)
+      ref_batch = ref_windows[batch_start:batch_start + batch_size]
+      ref_mean = ref_batch.mean(axis=1, keepdims=True)
+      ref_batch = ref_batch - ref_mean
+      device_batch = device_segments[batch_start:batch_start + batch_size] - ref_mean
+      # Value at lag k: sum of ref[t] * device[t+k]
+      cross = np.fft.irfft(np.conj(np.fft.rfft(ref_batch, fft_size, axis=1)) * np.fft.rfft(device_batch, fft_size, axis=1), fft_size, axis=1)[:, :len(lags)]
+      padding = np.zeros((len(device_batch), 1))
+      device_sum = np.concatenate((padding, np.cumsum(device_batch, axis=1)), axis=1)
+      device_squares = np.concatenate((padding, np.cumsum(device_batch**2, axis=1)), axis=1)
+      window_sum = device_sum[:, window:window + len(lags)] - device_sum[:, :len(lags)]
+      window_squares = device_squares[:, window:window + len(lags)] - device_squares[:, :len(lags)]
+      ref_squares = (ref_batch**2).sum(axis=1, keepdims=True)
+      # Mean squared difference of each shift, negated so the lag is at the peak
+      score = -(ref_squares - 2 * cross + window_squares) / window
+      peak = np.argmax(score, axis=1)
+      batch_idx = np.arange(len(peak))
+      # Correlation at the lag (the reference window is centered, so the sum of the products is the covariance), none for a flat window
+      peak_variance = window_squares[batch_idx, peak] - window_sum[batch_idx, peak]**2 / window
+      peak_variance[peak_variance <= 1e-9 * window_squares[batch_idx, peak]] = np.nan
+      with np.errstate(invalid='ignore', divide='ignore'):
+        peak_corr = cross[batch_idx, peak] / np.sqrt(ref_squares[:, 0] * peak_variance)
+      # Sub-point lag by parabolic interpolation around the peak
+      inner = (peak > 0) & (peak < len(lags) - 1)
+      before = score[batch_idx, np.maximum(peak - 1, 0)]
+      after = score[batch_idx, np.minimum(peak + 1, len(lags) - 1)]
+      curvature = before - 2 * score[batch_idx, peak] + after
+      with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(inner & (curvature < 0), 0.5 * (before - after) / curvature, 0)
+      accepted = (peak_corr >= min_corr) & both_valid[batch_start:batch_start + len(peak)]
+      profile['lag'][i, batch_start:batch_start + len(peak)] = np.where(accepted, lags[peak] + offset, np.nan)
+      profile['corr'][i, batch_start:batch_start + len(peak)] = peak_corr
+  return profile
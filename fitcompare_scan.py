@@ -0,0 +1,262 @@
+import struct
+import datetime
+import re
+import numpy as np
+from fitparse.profile import MESSAGE_TYPES
+from fitparse.records import BASE_TYPES
+
+# Specific FIT epoch
+FIT_EPOCH = datetime.datetime(1989, 12, 31, 0, 0, 0)
+# Global message number of the developer field descriptions
+FIELD_DESCRIPTION_MESG = 206
+
+# This function returns the name of a field of the FIT profile
+def profile_field_name(global_num, field_num):
+  if ((global_num in MESSAGE_TYPES) and (field_num in MESSAGE_TYPES[global_num].fields)):
+    return MESSAGE_TYPES[global_num].fields[field_num].name
+  return "unknown_%i" % (field_num)
+
+# This function returns the name of a message of the FIT profile
+def profile_message_name(global_num):
+  if (global_num in MESSAGE_TYPES):
+    return MESSAGE_TYPES[global_num].name
+  return "unknown_%i" % (global_num)
+
+# This function reads the raw value of a field of a data message (None if invalid, a tuple for arrays)
+def read_raw_value(data, offset, size, base_type_id, endian):
+  base_type = BASE_TYPES.get(base_type_id, BASE_TYPES[0x0D])
+  if (base_type.fmt == 's'):
+    return base_type.parse(data[offset:offset+size])
+  nb_values = size // base_type.size
+  if (nb_values == 0):
+    return None
+  raw_values = struct.unpack_from("%s%i%s" % (endian, nb_values, base_type.fmt), data, offset)
+  if (base_type is BASE_TYPES[0x0D]):
+    return base_type.parse(raw_values)
+  if (nb_values == 1):
+    return base_type.parse(raw_values[0])
+  raw_values = tuple([base_type.parse(raw_value) for raw_value in raw_values])
+  if (all([raw_value == None for raw_value in raw_values])):
+    return None
+  return raw_values
+
+# This function converts a raw value like fitparse does (enum name, scale and offset, date_time)
+def render_value(global_num, field_num, raw_value):
+  if ((raw_value == None) or (global_num not in MESSAGE_TYPES) or (field_num not in MESSAGE_TYPES[global_num].fields)):
+    return raw_value
+  field = MESSAGE_TYPES[global_num].fields[field_num]
+  if ((field.type.values != None) and (not isinstance(raw_value, tuple)) and (raw_value in field.type.values)):
+    return field.type.values[raw_value]
+  if ((field.type.name == 'date_time') and isinstance(raw_value, int)):
+    if (raw_value >= 0x10000000):
+      return FIT_EPOCH + datetime.timedelta(seconds=raw_value)
+    return raw_value
+  if (isinstance(raw_value, (int, float)) and not isinstance(raw_value, bool)):
+    if (field.scale):
+      raw_value = float(raw_value) / field.scale
+    if (field.offset):
+      raw_value = raw_value - field.offset
+  return raw_value
+
+# This function scans a FIT file message by message, from the record headers and the definition messages only
+# The data messages are skipped, except the ones of the requested messages which are decoded for the requested fields
+# Input:
+# - file_path: path of the FIT file
+# - decode: dict of global message number -> list of field names to decode (developer fields are decoded by name)
+# Output:
+# - dict with: protocol_version, profile_version, inventory (list of [message, field, developer, count]),
+#   messages (count of data messages by message name) and decoded (global message number -> list of dict of the decoded fields)
+def scan_fit(file_path, decode=None):
+  if (decode == None):
+    decode = {}
+  with open(file_path, 'rb') as fit_file:
+    data = fit_file.read()
+
+  scan = {'protocol_version': None, 'profile_version': None, 'inventory': [], 'messages': {}, 'decoded': {}}
+  for global_num in decode:
+    scan['decoded'][global_num] = []
+  all_definitions = []
+  dev_fields = {}
+  pos = 0
+  try:
+    # A file may contain several chained FIT files
+    while (pos + 12 <= len(data)):
+      header_size = data[pos]
+      protocol_ver_enc, profile_ver_enc, data_size = struct.unpack_from('<BHI', data, pos + 1)
+      if (data[pos+8:pos+12] != b'.FIT'):
+        if (scan['protocol_version'] == None):
+          raise ValueError("Invalid .FIT File Header")
+        break
+      if (scan['protocol_version'] == None):
+        # Decode the same way the SDK does
+        scan['protocol_version'] = float("%d.%d" % (protocol_ver_enc >> 4, protocol_ver_enc & ((1 << 4) - 1)))
+        scan['profile_version'] = float("%d.%d" % (profile_ver_enc / 100, profile_ver_enc % 100))
+      pos += header_size
+      end = min(pos + data_size, len(data))
+      local_definitions = {}
+      last_timestamp = None
+
+      while (pos < end):
+        record_header = data[pos]
+        pos += 1
+        compressed_timestamp = None
+        if (record_header & 0x80):
+          # Compressed timestamp header (data message)
+          definition = local_definitions[(record_header >> 5) & 0x3]
+          if (last_timestamp != None):
+            time_offset = record_header & 0x1F
+            compressed_timestamp = (last_timestamp & ~0x1F) + time_offset
+            if (time_offset < (last_timestamp & 0x1F)):
+              compressed_timestamp += 0x20
+            last_timestamp = compressed_timestamp
+        elif (record_header & 0x40):
+          # Definition message
+          endian = '>' if data[pos+1] else '<'
+          global_num = struct.unpack_from(endian + 'H', data, pos + 2)[0]
+          nb_fields = data[pos+4]
+          pos += 5
+          definition = {'global': global_num, 'endian': endian, 'fields': {}, 'dev_fields': {}, 'count': 0}
+          offset = 0
+          for field_idx in range(nb_fields):
+            definition['fields'][data[pos]] = [offset, data[pos+1], data[pos+2]]
+            offset += data[pos+1]
+            pos += 3
+          if (record_header & 0x20):
+            nb_dev_fields = data[pos]
+            pos += 1
+            for field_idx in range(nb_dev_fields):
+              definition['dev_fields'][(data[pos+2], data[pos])] = [offset, data[pos+1]]
+              offset += data[pos+1]
+              pos += 3
+          definition['size'] = offset
+          local_definitions[record_header & 0x0F] = definition
+          all_definitions.append(definition)
+          continue
+        else:
+          definition = local_definitions[record_header & 0x0F]
+
+        # Data message: only the timestamp is read, to resolve the compressed timestamps
+        message_start = pos
+        pos += definition['size']
+        definition['count'] += 1
+        endian = definition['endian']
+        if (253 in definition['fields']):
+          timestamp_field = definition['fields'][253]
+          timestamp_value = read_raw_value(data, message_start + timestamp_field[0], timestamp_field[1], timestamp_field[2], endian)
+          if (isinstance(timestamp_value, int)):
+            last_timestamp = timestamp_value
+        # Developer field descriptions give the names and types of the developer fields
+        if (definition['global'] == FIELD_DESCRIPTION_MESG):
+          description = {}
+          for field_num in [0, 1, 2, 3]:
+            if (field_num in definition['fields']):
+              field_def = definition['fields'][field_num]
+              description[field_num] = read_raw_value(data, message_start + field_def[0], field_def[1], field_def[2], endian)
+          if ((description.get(0) != None) and (description.get(1) != None)):
+            dev_fields[(description[0], description[1])] = [description.get(3) or "unnamed_dev_field_%s" % (description[1]), description.get(2, 0x0D)]
+        # Decode the requested fields
+        if (definition['global'] in decode):
+          message = {}
+          for field_num in definition['fields']:
+            field_name = profile_field_name(definition['global'], field_num)
+            if (field_name in decode[definition['global']]):
+              field_def = definition['fields'][field_num]
+              message[field_name] = render_value(definition['global'], field_num, read_raw_value(data, message_start + field_def[0], field_def[1], field_def[2], endian))
+          for dev_key in definition['dev_fields']:
+            if ((dev_key in dev_fields) and (dev_fields[dev_key][0] in decode[definition['global']])):
+              field_def = definition['dev_fields'][dev_key]
+              message[dev_fields[dev_key][0]] = read_raw_value(data, message_start + field_def[0], field_def[1], dev_fields[dev_key][1], endian)
+          if ((compressed_timestamp != None) and ('timestamp' not in message)):
+            message['timestamp'] = FIT_EPOCH + datetime.timedelta(seconds=compressed_timestamp)
+          scan['decoded'][definition['global']].append(message)
+      # Skip the CRC
+      pos = end + 2
+  except (struct.error, IndexError, KeyError):
+    raise ValueError("Truncated or invalid FIT file")
+
+  # Inventory of the fields: number of data messages using each definition
+  inventory = {}
+  for definition in all_definitions:
+    if (definition['count'] == 0):
+      continue
+    message_name = profile_message_name(definition['global'])
+    scan['messages'][message_name] = scan['messages'].get(message_name, 0) + definition['count']
+    for field_num in definition['fields']:
+      field_key = (message_name, profile_field_name(definition['global'], field_num), False)
+      inventory[field_key] = inventory.get(field_key, 0) + definition['count']
+    for dev_key in definition['dev_fields']:
+      dev_name = dev_fields[dev_key][0] if dev_key in dev_fields else "unknown_dev_%i_%i" % (dev_key[0], dev_key[1])
+      field_key = (message_name, dev_name, True)
+      inventory[field_key] = inventory.get(field_key, 0) + definition['count']
+  for field_key in inventory:
+    scan['inventory'].append([field_key[0], field_key[1], field_key[2], inventory[field_key]])
+  return scan
+
+# Tokens of the JSON scanner: keys (string followed by ":"), string values, brackets, and an unterminated string at the end of the buffer
+JSON_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?|([\[\]{}])|"')
+
+# This function reads a numeric array of a JSON document (Suunto R-R data...) with a streaming scanner, without loading the document
+# Only the keys and the brackets are tokenized to follow the path, the other values are skipped by the regular expression
+# The memory used is the size of a chunk and of the array
+# Input:
+# - file_path: path of the JSON file
+# - key_path: list of the keys of the array (from the root object)
+# - chunk_size: size of the chunks read from the file
+# Output:
+# - array of the float values of the array (empty if the path does not exist)
+def scan_json_array(file_path, key_path, chunk_size=1048576):
+  key_path = list(key_path)
+  # Stack of the keys of the open containers (None for an array) and last key of each open object
+  path = []
+  last_keys = []
+  array_parts = []
+  in_array = False
+  buffer = ''
+  with open(file_path, 'r', encoding='utf-8') as json_file:
+    while True:
+      chunk = json_file.read(chunk_size)
+      at_end = (chunk == '')
+      buffer += chunk
+      # A token ending at the end of the content may continue in the next chunk
+      content_end = len(buffer.rstrip())
+      pos = 0
+      while True:
+        if (in_array):
+          # Numeric values of the array, up to the closing bracket
+          array_end = buffer.find(']', pos)
+          if (array_end < 0):
+            # The last value may continue in the next chunk
+            values_end = buffer.rfind(',', pos)
+            if (at_end or (values_end < 0)):
+              break
+            array_parts.append(np.fromstring(buffer[pos:values_end], sep=','))
+            pos = values_end + 1
+            break
+          array_parts.append(np.fromstring(buffer[pos:array_end], sep=','))
+          return np.concatenate(array_parts)
+        token = JSON_TOKEN.search(buffer, pos)
+        if (token == None):
+          pos = len(buffer)
+          break
+        # A string at the end of the buffer may be incomplete, or be a key with its ":" in the next chunk
+        if ((not at_end) and ((token.group(0) == '"') or (token.end() >= content_end))):
+          pos = token.start()
+          break
+        pos = token.end()
+        if (token.group(1) != None):
+          if ((token.group(2) != None) and (len(last_keys) > 0)):
+            last_keys[-1] = token.group(1)
+        elif (token.group(3) in ['{', '[']):
+          container_key = last_keys[-1] if (len(last_keys) > 0) else None
+          path.append(container_key)
+          last_keys.append(None)
+          if ((token.group(3) == '[') and (path[1:] == key_path)):
+            in_array = True
+        elif (token.group(3) in ['}', ']']):
+          if (len(path) > 0):
+            path.pop()
+            last_keys.pop()
+      buffer = buffer[pos:]
+      if (at_end):
+        break
+  return np.array([])